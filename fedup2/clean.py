@@ -54,6 +54,8 @@ class Cleaner(object):
         with self.cli.state as state:
             del state.upgrade_ready
             del state.datadir
+            # the user kept that one; it's theirs to remove
+            del state.previous_datadir
 
     def clean_metadata(self):
         '''Remove cached metadata'''
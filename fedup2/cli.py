@@ -17,19 +17,18 @@
 #
 # Author: Will Woods <wwoods@redhat.com>
 
-import os, sys, time, argparse, libmount, platform
+import os, sys, time, json, shlex, argparse
 
-from .logutils import log_setup, console_is_enabled_for
+# NOTE: dnf, rpm, libmount etc. take a while to import, and most actions
+# (especially 'status') don't need them, so they get imported as needed.
+from .logutils import log_setup, log_flush, console_is_enabled_for
 from .version import version as fedupversion
 from .state import State
 from .lock import PidLock, PidLockError
-from .dnf_wrapper import DNFWrapper
-from .clean import Cleaner
-from .reboot import Bootprep, reboot, MAGIC_SYMLINK
-from .plymouth import PlymouthOutput
-
-import dnf.exceptions
-from dnf.cli.output import progressbar
+from .ratelimit import parse_rate, parse_schedule
+from .timing import PhaseTimer, timing_file
+from .format import format_number, format_time
+from .progress import ProgressRenderer
 
 from .i18n import _
 
@@ -37,11 +36,16 @@ import logging
 log = logging.getLogger("fedup2")
 
 DEFAULT_DATADIR = '/var/cache/system-upgrade'
+DEFAULT_PORT = 8873 # same as serve.DEFAULT_PORT
+DEFAULT_BIND = '127.0.0.1' # same as serve.DEFAULT_BIND
+OS_RELEASE = '/etc/os-release'
+PIDFILE = '/var/run/fedup2.pid'
 
 def init_parser():
     # === toplevel parser ===
     p = argparse.ArgumentParser(
-        usage='%(prog)s <status|download|media|reboot|clean> [OPTIONS]',
+        usage='%(prog)s <status|download|media|reboot|clean|serve|report> '
+              '[OPTIONS]',
         description=_('Prepare system for upgrade.'),
         epilog=_("Use '%(prog)s <ACTION> --help' for more info."),
     )
@@ -54,10 +58,19 @@ def init_parser():
 
     p.add_argument('--log', default='/var/log/fedup2.log',
         help=_('where to write detailed logs (default: %(default)s)'))
+    p.add_argument('--log-rate-limit', metavar='RATE', type=float,
+        help=_('write at most RATE debug messages per second from each '
+               'logger to the detailed log'))
+    p.add_argument('--wait', action='store_true', default=False,
+        help=_('if fedup2 is already running, wait for it to finish'))
+    p.add_argument('--wait-timeout', metavar='SECONDS', type=float,
+        help=_('like --wait, but give up after SECONDS'))
 
     # === hidden options. FOR DEBUGGING ONLY. ===
     p.add_argument('--logtraceback', action='store_true', default=False,
         help=argparse.SUPPRESS)
+    p.add_argument('--profile', action='store_true', default=False,
+        help=argparse.SUPPRESS)
     p.add_argument('--sleep-forever',action='store_const', const='sleep',
         dest='action', help=argparse.SUPPRESS)
 
@@ -66,7 +79,7 @@ def init_parser():
     cmds = p.add_subparsers(dest='action',
         title='Actions', metavar='', prog='fedup2',
     )
-    cmds.add_parser('status',
+    st = cmds.add_parser('status',
         help='show upgrade status',
         description='Show the upgrade preparation status.',
     )
@@ -91,6 +104,25 @@ def init_parser():
         help='clean up data',
         description='Clean up data written by this program.',
     )
+    sv = cmds.add_parser('serve',
+        help='share downloaded packages with other hosts',
+        description='Serve downloaded packages to hosts using --peer. '
+                    'Other fedup2 commands can run once the server has '
+                    'started; the list of packages to serve is read once, '
+                    'at startup.',
+    )
+    r = cmds.add_parser('report',
+        help='show how long the upgrade took',
+        description='Show where the time went during the last upgrade.',
+    )
+
+    # === options for 'fedup2 status' ===
+    st.add_argument('--json', action='store_true', default=False,
+        help=_('print the status as JSON'))
+    st.add_argument('--verify', action='store_true', default=False,
+        help=_('recount the downloaded packages instead of using the totals '
+               'saved by the download (packages from a download that is '
+               'still running are not counted)'))
 
     # === options for 'fedup2 download' ===
     # Translators: This is for '--network [VERSION]' in --help output
@@ -101,6 +133,34 @@ def init_parser():
     d.add_argument('--distro-sync', action='store_true', default=False,
         help=_('install packages from new release even if they are older'))
 
+    d.add_argument('--parallel', metavar='N', type=int, default=4,
+        help=_('maximum number of simultaneous downloads (default: %(default)s)'))
+
+    d.add_argument('--max-rate', metavar='RATE', type=RATE,
+        help=_('limit package download speed to RATE bytes/sec (e.g. 500k, '
+               '2M). Metadata, and packages from repos that need a proxy, '
+               'certificates or a login, are not limited.'))
+    d.add_argument('--schedule', metavar='HH:MM-HH:MM=RATE[,...]',
+        type=SCHEDULE, dest='rate_schedule',
+        help=_('use a different package download speed limit at certain '
+               'times (e.g. 01:00-05:00=0 for no limit at night)'))
+    d.add_argument('--peer', metavar='URL', action='append', default=[],
+        help=_("try to get packages from another host's 'fedup2 serve' first"))
+    d.add_argument('--deltarpm', action='store_true', default=False,
+        help=_('download deltarpms and rebuild packages where possible'))
+    d.add_argument('--no-conflict-check', action='store_false',
+        dest='conflict_check', default=True,
+        help=_("don't check the file lists for conflicts before downloading"))
+    d.add_argument('--strict-conflicts', action='store_true', default=False,
+        help=_("stop if the conflict check finds anything (it can't tell "
+               "identical files shared by two packages from real conflicts, "
+               "so by default it just warns)"))
+    d.add_argument('--header-first', action='store_true', default=False,
+        help=_('test the upgrade using package headers before downloading'))
+    d.add_argument('--lean', action='store_true', default=False,
+        help=_('use less memory by loading file lists only if needed '
+               '(skips the file conflict check)'))
+
     d.add_argument('--nogpgcheck', action='store_true', default=False,
         help=_('disable GPG signature checking (not recommended!)'))
     d.add_argument('--add-install', metavar='<PKG-PATTERN|@GROUP-ID>',
@@ -111,6 +171,19 @@ def init_parser():
     cn.add_argument('--no-clean', action='store_true', default=False,
         help="keep all downloaded data")
 
+    # === options for 'fedup2 serve' ===
+    sv.add_argument('--port', type=int, default=DEFAULT_PORT,
+        help=_('port to listen on (default: %(default)s)'))
+    sv.add_argument('--bind', metavar='ADDRESS', default=DEFAULT_BIND,
+        help=_('address to listen on (default: %(default)s; use 0.0.0.0 to '
+               'serve other hosts)'))
+
+    # === options for 'fedup2 report' ===
+    r.add_argument('--top', metavar='N', type=int, default=10,
+        help=_('show the N slowest packages (default: %(default)s)'))
+    r.add_argument('--file', metavar='PATH',
+        help=_('read package timing from PATH (default: next to --log)'))
+
     # === options for 'fedup2 clean' ===
     c.add_argument('clean',
         help=_('what to clean up')+' (%(choices)s)',
@@ -128,10 +201,29 @@ def init_parser():
 
     return p
 
+_os_release = None
+
+def read_os_release(path=OS_RELEASE):
+    '''Return a dict of the values in os-release(5). Only read once.'''
+    global _os_release
+    if _os_release is None:
+        _os_release = dict()
+        try:
+            with open(path) as inf:
+                for line in inf:
+                    key, eq, val = line.strip().partition('=')
+                    if eq and not key.startswith('#'):
+                        _os_release[key] = ''.join(shlex.split(val))
+        except (IOError, OSError, ValueError) as e:
+            log.debug("can't read %s: %s", path, e)
+    return _os_release
+
 def get_distro():
-    dists = ('fedora',)
-    distro, version, _ = platform.linux_distribution(supported_dists=dists)
-    return distro, version
+    '''Return (name, version) for supported distros, ('', '') otherwise.'''
+    osr = read_os_release()
+    if osr.get('ID') != 'fedora':
+        return '', ''
+    return osr.get('NAME', 'Fedora'), osr.get('VERSION_ID', '')
 
 def VERSION(arg):
     if arg.lower() == 'rawhide':
@@ -149,9 +241,24 @@ def VERSION(arg):
                                          % version)
     return arg
 
+def RATE(arg):
+    try:
+        parse_rate(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError(_("invalid rate %r") % arg)
+    return arg
+
+def SCHEDULE(arg):
+    try:
+        parse_schedule(arg)
+    except ValueError:
+        raise argparse.ArgumentTypeError(_("invalid schedule %r") % arg)
+    return arg
+
 def valid_datadir(datadir):
     '''Check the location of --datadir to make sure it's usable for upgrades.'''
     def err(msg): raise argparse.ArgumentTypeError(" ".join((datadir,msg)))
+    import libmount
     fs = libmount.Table('/proc/self/mountinfo').find_mountpoint(datadir)
     if fs.is_netfs():
         err(_("is on a network filesystem"))
@@ -168,6 +275,12 @@ def valid_datadir(datadir):
     # looks good!
     return datadir
 
+def download_errors():
+    '''The exceptions that mean the download failed.'''
+    import dnf.exceptions
+    from .downloader import DownloadError
+    return (dnf.exceptions.DownloadError, DownloadError)
+
 class Cli(object):
     """The main CLI object."""
     def __init__(self):
@@ -179,6 +292,8 @@ class Cli(object):
         self.has_lock = False
         self.resumed = False
         self.plymouth = None
+        self.timer = PhaseTimer()
+        self.renderer = ProgressRenderer()
 
     def error(self, msg, *args):
         log.error(msg, *args)
@@ -193,9 +308,8 @@ class Cli(object):
         if self.plymouth:
             self.plymouth.message(msg)
 
-    @staticmethod
-    def progressbar(count, total, name=None):
-        progressbar(count, total, name)
+    def progressbar(self, count, total, name=None):
+        self.renderer.update(count, total, name)
 
     def parse_args(self):
         assert self.parser
@@ -223,6 +337,12 @@ class Cli(object):
                 self.error(_("download incomplete"))
             else:
                 self.error(_("system not prepared for upgrade"))
+        if self.args.action == 'reboot' and self.state.unverified_packages():
+            self.error(_("download incomplete"))
+
+        # Can't serve packages we don't have
+        if self.args.action == 'serve' and not self.state.read_checksums():
+            self.error(_("no downloaded packages to serve"))
 
         # Can't resume/cancel unless something is in progress
         if self.args.action == 'resume' and not self.state.cmdline:
@@ -246,74 +366,243 @@ class Cli(object):
 
     def open_logs(self):
         try:
-            log_setup(self.args.log, self.args.loglevel)
+            log_setup(self.args.log, self.args.loglevel,
+                      self.args.log_rate_limit)
         except IOError as e:
             self.error(_("Can't open logfile '%s': %s"), self.args.log, e)
         log.info("fedup2 %s starting at %s", fedupversion, time.asctime())
         log.info("argv: %s", str(sys.argv))
 
     def get_lock(self):
+        timeout, waited = self.args.wait_timeout, False
+        if timeout is None and not self.args.wait:
+            timeout = 0
         try:
-            self.pidfile = PidLock("/var/run/fedup2.pid")
+            try:
+                self.pidfile = PidLock(PIDFILE)
+            except PidLockError as e:
+                if timeout == 0:
+                    raise
+                self.message(_("waiting for PID %s to finish..."), e.pid)
+                self.pidfile = PidLock(PIDFILE, timeout=timeout)
+                waited = True
             self.has_lock = True
         except PidLockError as e:
             self.error(_("already running as PID %s") % e.pid)
+        if waited:
+            log.info("got lock after waiting %.3fs", self.pidfile.waited)
+            # the other process probably changed things; look again
+            self.read_state()
+            self.check_state()
 
     def free_lock(self):
         assert self.pidfile
+        if not self.has_lock:
+            return
+        log.info("held lock for %.3fs", self.pidfile.held)
         self.pidfile.remove()
         self.has_lock = False
 
     def status(self):
-        self.message(self.state.summarize())
+        if getattr(self.args, 'verify', False):
+            self.state.rescan()
+        if getattr(self.args, 'json', False):
+            print(json.dumps(self.state.progress(), sort_keys=True))
+        else:
+            self.message(self.state.summarize())
 
     def download(self):
+        from .dnf_wrapper import DNFWrapper
+        from .verify import write_manifest, SIG_OK, SIG_BAD
+        from .savedtrans import TRANSFILE
         if not self.resumed:
             # new run - write initial state
             with self.state as state:
+                if state.datadir and state.datadir != self.args.datadir:
+                    # probably kept by 'cancel --no-clean'; we can reuse it
+                    state.previous_datadir = state.datadir
                 distro, version = get_distro()
                 state.current_system = "%s %s" % (distro, version)
                 state.upgrade_target = "%s %s" % (distro, self.args.version)
                 state.releasever = self.args.version
                 state.datadir = self.args.datadir
                 state.cmdline = sys.argv[1:]
+                if self.args.max_rate:
+                    state.max_rate = self.args.max_rate
+                if self.args.rate_schedule:
+                    state.rate_schedule = self.args.rate_schedule
 
         # set up downloader
-        dl = DNFWrapper(self)
-        dl.setup()
+        with self.timer.phase("setup"):
+            dl = DNFWrapper(self)
+            dl.setup()
+        dl.set_rate_limit(self.state.max_rate, self.state.rate_schedule)
         with self.state as state:
             state.cachedir = dl.cachedir
 
         self.message(_("setting up package repos..."))
-        enabled_repos = dl.read_metadata()
+        with self.timer.phase("metadata"):
+            enabled_repos = dl.read_metadata()
         with self.state as state:
             state.enabled_repos = ' '.join(enabled_repos)
 
         self.message(_("looking for upgrades..."))
-        pkglist = dl.find_upgrade_packages(distro_sync=self.args.distro_sync)
+        with self.timer.phase("depsolve"):
+            pkglist = dl.find_upgrade_packages(
+                                        distro_sync=self.args.distro_sync)
+        if dl.skipped_metadata:
+            self.message(_("lean mode: skipped loading %s of file lists"),
+                         format_number(dl.skipped_metadata))
+        self.check_disk_space(dl, pkglist)
+        if self.args.conflict_check:
+            self.check_conflicts(dl, strict=self.args.strict_conflicts)
+        pkgpaths = [p.localPkg() for p in pkglist]
+        verified = self.state.read_checksums()
         with self.state as state:
             state.pkgs_total = len(pkglist)
             state.size_total = sum(p.size for p in pkglist)
-            state.write_packagelist(p.localPkg() for p in pkglist)
+            state.write_packagelist(pkgpaths, verified)
             state.clean_datadir()
         # TODO: sanity-check pkglist - does something provide kernel?
 
+        if self.args.header_first:
+            self.header_test(dl, pkglist)
+
         self.message(_("starting download..."))
-        dl.download_packages(pkglist)
+        try:
+            with self.timer.phase("download"):
+                mirrors = dl.download_packages(pkglist, verified,
+                                               reuse_dirs=self.reuse_dirs(),
+                                               deltas=self.args.deltarpm)
+        finally:
+            # draw the last (throttled) progress update, if it was skipped
+            self.renderer.finish()
+            # record what we've verified so far, so we needn't check it again
+            self.state.write_packagelist(pkgpaths, verified)
+            # and how fast we were going, so the user can check the limits
+            if dl.download_rate:
+                with self.state as state:
+                    state.measured_rate = int(dl.download_rate)
+        if dl.download_rate:
+            self.message(_("average download speed: %s/s"),
+                         format_number(dl.download_rate))
+        if dl.reused_bytes:
+            self.message(_("reused %s of packages already on disk"),
+                         format_number(dl.reused_bytes))
+        if dl.delta_saved:
+            self.message(_("deltarpms saved %s, using %.1f CPU seconds"),
+                         format_number(dl.delta_saved), dl.delta_cpu_seconds)
+        for host, stats in sorted(mirrors.items()):
+            self.message(_("%s: %u files at %s/s"), host, stats.files,
+                         format_number(stats.rate))
+
+        if not self.args.nogpgcheck:
+            self.message(_("checking package signatures..."))
+            sigs = dl.check_signatures(pkglist)
+            bad = sorted(p for p, r in sigs.items() if r == SIG_BAD)
+            if bad:
+                self.error(_("bad signature on %s"), ", ".join(bad))
+            ok = [p for p, r in sigs.items() if r == SIG_OK]
+            if len(ok) < len(sigs):
+                log.info("%u packages could not be verified", len(sigs)-len(ok))
+            with self.state as state:
+                state.manifest_digest = write_manifest(state.datadir, ok,
+                                                       verified)
 
         self.message(_("testing upgrade transaction..."))
         # FIXME: handle and print problems
-        dl.do_transaction(test=True)
+        with self.timer.phase("transaction.test"):
+            dl.do_transaction(test=True)
+
+        # save the transaction so the upgrade doesn't have to resolve it again
+        dl.save_transaction(os.path.join(self.state.datadir, TRANSFILE),
+                            verified)
+        # ...and a repo of just our packages, in case it has to
+        self.message(_("creating local repo..."))
+        dl.make_local_repo(pkglist)
 
         # we're done! mark it, dude!
         with self.state as state:
             state.upgrade_ready = 1
 
+    def header_test(self, dl, pkglist):
+        '''Exit with an error if the upgrade fails a test transaction using
+           just the package headers.'''
+        self.message(_("downloading package headers..."))
+        with self.timer.phase("headers.download"):
+            headers = dl.fetch_headers(pkglist)
+        if headers is None:
+            self.message(_("can't get all the headers; skipping header test"))
+            return
+        self.message(_("testing upgrade transaction with package headers..."))
+        try:
+            with self.timer.phase("headers.test"):
+                problems = dl.test_headers(headers)
+        finally:
+            for pkgpath, hdrpath in headers.items():
+                if hdrpath != pkgpath and os.path.exists(hdrpath):
+                    os.unlink(hdrpath)
+        if problems:
+            self.error(_("upgrade test failed:\n  %s"), "\n  ".join(problems))
+
+    def check_conflicts(self, dl, strict=False):
+        '''
+        Warn if the new packages (probably) have file conflicts.
+        If strict is True, exit with an error instead.
+        '''
+        if dl.lean:
+            self.message(_("lean mode: file lists not loaded; skipping the "
+                           "file conflict check"))
+            return
+        with self.timer.phase("conflicts"):
+            conflicts = dl.find_conflicts()
+        if not conflicts:
+            return
+        msg = [_("possible file conflicts found:")]
+        for path, pkg1, pkg2 in conflicts[:20]:
+            msg.append(_("  %s is in both %s and %s") % (path, pkg1, pkg2))
+        if len(conflicts) > 20:
+            msg.append(_("  ...and %u more") % (len(conflicts) - 20))
+        if strict:
+            msg.append(_("(drop --strict-conflicts to download anyway)"))
+            self.error("\n".join(msg))
+        msg.append(_("(the upgrade will fail if the copies differ)"))
+        log.warning("%u possible file conflicts", len(conflicts))
+        self.message("\n".join(msg))
+
+    def check_disk_space(self, dl, pkglist):
+        '''Exit with an error if the download/upgrade won't fit.'''
+        if dl.lean:
+            self.message(_("lean mode: file lists not loaded; the disk space "
+                           "check can't tell which filesystem files go on"))
+        with self.timer.phase("diskspace"):
+            usage = dl.disk_usage(pkglist)
+        short = [m for m in usage if m.short > 0]
+        if not short:
+            return
+        msg = [_("not enough disk space:")]
+        for m in short:
+            msg.append(_("  %s needs %s more (%s needed, %s free)") % (
+                       m.target, format_number(m.short),
+                       format_number(m.needed), format_number(m.free)))
+        self.error("\n".join(msg))
+
+    def reuse_dirs(self):
+        '''Places where we might find packages we'd otherwise download.'''
+        from dnf.const import SYSTEM_CACHEDIR
+        dirs = [SYSTEM_CACHEDIR, DEFAULT_DATADIR, self.state.previous_datadir]
+        return [d for d in dirs if d and os.path.isdir(d)]
+
     def upgrade(self):
+        from .dnf_wrapper import DNFWrapper
+        from .verify import manifest_covers
+        from .savedtrans import read_transaction, TRANSFILE
+        from .localrepo import has_local_repo
         # avoid looping - remove magic symlink
         self.clean("misc")
         # set up plymouth output, if requested
         if self.args.plymouth:
+            from .plymouth import PlymouthOutput
             self.plymouth = PlymouthOutput()
             self.plymouth.set_mode("updates")
             self.plymouth.progress(0)
@@ -325,31 +614,54 @@ class Cli(object):
         self.resume()
         try:
             # create transaction using cached metadata and saved args
+            datadir = self.state.datadir
+            localrepo = datadir if has_local_repo(datadir) else None
             upg = DNFWrapper(self)
-            upg.setup(cacheonly=True)
-            upg.read_metadata()
-            upg.find_upgrade_packages(distro_sync=self.args.distro_sync)
-            upg.do_transaction(test=testing)
+            upg.setup(cacheonly=True, localrepo=localrepo)
+            pkgs = None
+            saved = read_transaction(os.path.join(datadir, TRANSFILE))
+            if saved:
+                pkgs = upg.load_transaction(saved)
+            if pkgs is None:
+                # no (usable) saved transaction; resolve it all again
+                upg = DNFWrapper(self)
+                upg.setup(cacheonly=True, localrepo=localrepo)
+                upg.read_metadata()
+                pkgs = upg.find_upgrade_packages(
+                                        distro_sync=self.args.distro_sync)
+            verified = manifest_covers(datadir,
+                                       self.state.manifest_digest,
+                                       [p.localPkg() for p in pkgs])
+            with self.timer.phase("transaction"):
+                upg.do_transaction(test=testing, verified=verified)
         except Exception as e:
             self.message(_("Upgrade failed: %s", str(e)))
+            if self.plymouth:
+                self.plymouth.flush()
             time.sleep(5) # let the user see the error
             raise
         else:
             self.message(_("Upgrade finished! Cleaning up and rebooting."))
+            if self.plymouth:
+                self.plymouth.flush()
             self.plymouth = None
             if not testing:
                 self.clean("all")
         finally:
             if reboot:
+                log_flush()
                 reboot()
 
     def reboot(self):
+        from .reboot import Bootprep, reboot
         r = Bootprep(self)
         r.prep_mounts()
         r.prep_boot()
+        log_flush()
         reboot()
 
     def clean(self, what):
+        from .clean import Cleaner
         cleaner = Cleaner(self)
         if what == 'all':
             # NOTE: metadata is system-owned, so leave it alone by default
@@ -366,6 +678,45 @@ class Cli(object):
         else:
             raise AssertionError("invalid 'clean' arg")
 
+    def serve(self):
+        from .serve import PeerServer, drop_privileges
+        files = self.state.read_checksums()
+        server = PeerServer(self.state.datadir, files,
+                            (self.args.bind, self.args.port))
+        # that's all we need from the state; let other commands run,
+        # and don't talk to the network as root.
+        self.free_lock()
+        drop_privileges()
+        self.message(_("serving %u packages on port %u"),
+                     len(files), server.server_port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def report(self):
+        from .report import read_timing, summarize, packages_file, PHASES
+        path = self.args.file or packages_file(self.args.log)
+        try:
+            rows = read_timing(path)
+        except (IOError, OSError, ValueError, KeyError) as e:
+            self.error(_("can't read package timing from %s: %s"), path, e)
+        phases, slowest = summarize(rows, self.args.top)
+        total = sum(secs for _p, secs in phases)
+        msg = [_("Upgrade transaction took %s (%u packages)") % (
+               format_time(total, True), len([r for r in rows if r['package']]))]
+        for phase, secs in phases:
+            pct = 100.0 * secs / total if total else 0.0
+            msg.append("  %-12s %s %5.1f%%" % (phase, format_time(secs, True),
+                                              pct))
+        if slowest:
+            msg.append(_("Slowest packages:"))
+        for r in slowest:
+            split = ", ".join("%s %.1fs" % (p, r[p]) for p in PHASES if r[p])
+            msg.append("  %7.1fs  %s %s (%s)" % (r['total'], r['action'],
+                                                 r['package'], split))
+        self.message("\n".join(msg))
+
     def sleep(self):
         print("pid %u, now going to sleep forever!" % os.getpid())
         while True:
@@ -385,6 +736,29 @@ class Cli(object):
         self.args = self.parser.parse_args(self.state.cmdline)
         self.resumed = True
 
+    def write_timing(self):
+        if not self.timer.phases:
+            return
+        try:
+            self.timer.write(timing_file(self.args.log))
+        except (IOError, OSError) as e:
+            log.info("can't write timing summary: %s", e)
+
+    def start_profile(self):
+        from .profiling import Profiler
+        profiler = Profiler()
+        self.timer.listeners.append(profiler.phase)
+        profiler.start()
+        return profiler
+
+    def stop_profile(self, profiler):
+        profiler.stop()
+        self.timer.listeners.remove(profiler.phase)
+        try:
+            profiler.write(self.args.log)
+        except (IOError, OSError) as e:
+            log.info("can't write profile: %s", e)
+
     def main(self):
         self.parse_args()
         self.check_args()
@@ -394,11 +768,15 @@ class Cli(object):
         if self.args.action == 'status':
             self.status()
             return
+        if self.args.action == 'report':
+            self.report()
+            return
 
         self.check_perms()
         self.open_logs()
         self.get_lock()
 
+        profiler = self.start_profile() if self.args.profile else None
         try:
             log.info("doing action %r", self.args.action)
             if self.args.action in ('resume', 'retry', 'refresh'):
@@ -409,6 +787,8 @@ class Cli(object):
                 self.clean(self.args.clean)
             elif self.args.action == 'reboot':
                 self.reboot()
+            elif self.args.action == 'serve':
+                self.serve()
             elif self.args.action == 'sleep':
                 self.sleep()
             elif self.args.action == 'cancel':
@@ -418,14 +798,17 @@ class Cli(object):
         except KeyboardInterrupt:
             self.message(_("exiting on keyboard interrupt"))
             raise SystemExit(1)
-        except dnf.exceptions.DownloadError as e:
+        except download_errors() as e:
             self.error(_("Download failed: %s"), e)
         except Exception:
             log.info("Exception:", exc_info=True)
             self.exittype = "with unhandled exception"
             raise
         finally:
+            if profiler:
+                self.stop_profile(profiler)
             self.free_lock()
+            self.write_timing()
             self.status()
             log.info("fedup2 %s exiting %s at %s",
                      fedupversion, self.exittype, time.asctime())
@@ -0,0 +1,131 @@
+# conflicts.py - look for file conflicts before downloading anything
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+A quick check for file conflicts, using the file lists from the metadata
+and the rpmdb, so we don't download gigabytes of packages just to have
+the test transaction fail:
+
+    conflicts = find_conflicts(newpkgs, keptpkgs, lambda pkg: pkg.files)
+    for path, pkg1, pkg2 in conflicts:
+        ...
+
+There can be a few hundred thousand paths, so they're kept in a PathIndex:
+a flat array of 64-bit integers, each holding a hash of the path and the
+number of the package that owns it. Sorting that puts packages that
+(probably) share a path next to each other; only those packages' file
+lists get compared for real.
+
+The metadata doesn't have file digests, so packages that ship identical
+copies of a file (which rpm allows) can't be told apart from real
+conflicts. Directories and packages with the same name (multilib) are
+ignored, which takes care of most of those.
+'''
+
+from array import array
+
+import logging
+log = logging.getLogger("fedup2.conflicts")
+
+__all__ = ['PathIndex', 'find_conflicts']
+
+OWNER_BITS = 20
+HASH_BITS = 64 - OWNER_BITS
+_OWNER_MASK = (1 << OWNER_BITS) - 1
+_HASH_MASK = (1 << HASH_BITS) - 1
+
+def _hash(path):
+    return hash(path) & _HASH_MASK
+
+def _parent(path):
+    return path.rpartition('/')[0] or '/'
+
+class PathIndex(object):
+    '''A compact index of which owners have which paths.'''
+    def __init__(self):
+        self.owners = []
+        self.entries = array('Q')
+        self.dirs = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, owner, paths):
+        '''Add the paths belonging to owner. Returns the owner's number.'''
+        num = len(self.owners)
+        if num > _OWNER_MASK:
+            raise ValueError("too many owners for PathIndex")
+        self.owners.append(owner)
+        entries, dirs = self.entries, self.dirs
+        for path in paths:
+            entries.append((_hash(path) << OWNER_BITS) | num)
+            dirs.add(_hash(_parent(path)))
+        return num
+
+    def shared(self):
+        '''
+        Yield lists of owner numbers that (probably) have a path in
+        common, skipping paths that are directories of other paths.
+        '''
+        last, group, dirs = None, [], self.dirs
+        for entry in sorted(self.entries):
+            h, num = entry >> OWNER_BITS, entry & _OWNER_MASK
+            if h != last:
+                if len(group) > 1:
+                    yield group
+                last, group = h, []
+                skip = h in dirs
+            if not skip and num not in group:
+                group.append(num)
+        if len(group) > 1:
+            yield group
+
+def find_conflicts(new, kept, files, same=None):
+    '''
+    Find paths that would be owned by more than one package after the
+    transaction. new is the list of packages being installed, kept is the
+    list of installed packages that will still be there, and files(pkg)
+    returns the paths in pkg. same(pkg1, pkg2) should be True for pairs
+    of packages that are allowed to share files (e.g. multilib).
+    Returns a sorted list of (path, pkg1, pkg2) tuples; pkg1 is new.
+    '''
+    index = PathIndex()
+    for pkg in new:
+        index.add(pkg, files(pkg))
+    newcount = len(index.owners)
+    for pkg in kept:
+        index.add(pkg, files(pkg))
+    log.debug("indexed %u paths from %u packages", len(index),
+              len(index.owners))
+    pairs = set()
+    for group in index.shared():
+        # owners are in order (they're sorted along with the hashes)
+        for i, a in enumerate(group):
+            if a >= newcount:
+                break
+            pairs.update((a, b) for b in group[i+1:])
+    conflicts = []
+    for a, b in sorted(pairs):
+        pkg1, pkg2 = index.owners[a], index.owners[b]
+        if same and same(pkg1, pkg2):
+            continue
+        common = set(files(pkg1)).intersection(files(pkg2))
+        conflicts.extend((path, pkg1, pkg2) for path in common
+                         if _hash(path) not in index.dirs)
+    return sorted(conflicts, key=lambda c: c[0])
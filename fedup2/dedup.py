@@ -0,0 +1,110 @@
+# dedup.py - reuse packages that are already on disk
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Lots of the packages we need might already be sitting around on disk -
+in the DNF cache, in a datadir that was kept after 'fedup2 cancel', etc.
+There's no point downloading them again:
+
+    cache = LocalCache(['/var/cache/dnf', '/some/old/datadir'])
+    src = cache.find("foo-1.0-1.noarch.rpm", size, "sha256:...")
+    if src:
+        link_file(src, dest)
+
+Files are indexed by name, and only files with the right name and size
+get checksummed, so this is cheap even with big caches.
+'''
+
+import os
+import errno
+import fcntl
+
+from .downloader import file_checksum
+
+import logging
+log = logging.getLogger("fedup2.dedup")
+
+__all__ = ['LocalCache', 'link_file']
+
+FICLONE = 0x40049409 # from linux/fs.h
+
+class LocalCache(object):
+    '''An index of the RPMs found in a set of directories.'''
+    def __init__(self, dirs, exclude=None):
+        self.files = dict()
+        self._checksums = dict()
+        exclude = os.path.realpath(exclude) if exclude else None
+        for topdir in dirs:
+            for dirpath, dirnames, filenames in os.walk(topdir):
+                if os.path.realpath(dirpath) == exclude:
+                    dirnames[:] = []
+                    continue
+                for f in filenames:
+                    if f.endswith('.rpm'):
+                        self.files.setdefault(f, []).append(
+                                                    os.path.join(dirpath, f))
+        log.debug("indexed %u local packages", len(self.files))
+
+    def _checksum(self, path, csumtype):
+        key = (path, csumtype)
+        if key not in self._checksums:
+            self._checksums[key] = file_checksum(path, csumtype)
+        return self._checksums[key]
+
+    def find(self, name, size, checksum):
+        '''Return the path of a local copy of the given file, or None.'''
+        csumtype = checksum.split(':', 1)[0]
+        for path in self.files.get(name, []):
+            try:
+                if os.path.getsize(path) != size:
+                    continue
+                if self._checksum(path, csumtype) == checksum:
+                    return path
+            except (IOError, OSError):
+                continue
+        return None
+
+def _reflink(src, dest):
+    with open(src, 'rb') as inf, open(dest, 'wb') as outf:
+        try:
+            fcntl.ioctl(outf.fileno(), FICLONE, inf.fileno())
+        except (IOError, OSError):
+            outf.close()
+            os.unlink(dest)
+            raise
+
+def link_file(src, dest):
+    '''
+    Hardlink src to dest, or make a reflink copy if they're on different
+    filesystems. Returns "hardlink" or "reflink" to say which one worked,
+    or None if neither did.
+    '''
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            log.info("can't link %s: %s", src, e)
+            return None
+    try:
+        _reflink(src, dest)
+        return "reflink"
+    except (IOError, OSError) as e:
+        log.debug("can't reflink %s: %s", src, e)
+        return None
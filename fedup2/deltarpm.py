@@ -0,0 +1,130 @@
+# deltarpm.py - rebuild packages from deltarpms
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Rebuild full RPMs from downloaded deltarpms (and the files of the
+installed package) using applydeltarpm:
+
+    jobs = [DeltaJob(str(pkg), "/path/to/foo.drpm", "/path/to/foo.rpm",
+                     checksum, fullsize), ...]
+    rebuild = Rebuilder(jobs)
+    rebuild.start()
+    # ... do something else while that runs ...
+    ok, failed = rebuild.wait()
+
+Rebuilding is CPU-heavy, so we run one applydeltarpm per CPU at a time.
+The CPU time they use is added up in rebuild.cpu_seconds, so it can be
+compared to the bytes we saved.
+'''
+
+import os
+import time
+import resource
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from subprocess import call
+
+from .downloader import file_checksum
+
+import logging
+log = logging.getLogger("fedup2.deltarpm")
+
+__all__ = ['DeltaJob', 'Rebuilder', 'APPLYDELTA']
+
+APPLYDELTA = '/usr/bin/applydeltarpm'
+
+class DeltaJob(object):
+    '''A deltarpm, and where to put the full RPM once it's rebuilt.'''
+    def __init__(self, name, delta, dest, checksum, fullsize, deltasize=None):
+        self.name = name
+        self.delta = delta
+        self.dest = dest
+        self.checksum = checksum
+        self.fullsize = fullsize
+        if deltasize is None:
+            deltasize = os.path.getsize(delta)
+        self.deltasize = deltasize
+
+    @property
+    def saved(self):
+        return self.fullsize - self.deltasize
+
+    def __str__(self):
+        return self.name
+
+def _children_cpu_time():
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+def rebuild_one(job):
+    '''Rebuild a single RPM. Returns (job, ok).'''
+    tmpfile = job.dest + '.tmp'
+    ok = False
+    try:
+        if call([APPLYDELTA, job.delta, tmpfile]) != 0:
+            log.info("%s: applydeltarpm failed", job)
+        elif file_checksum(tmpfile, job.checksum.split(':')[0]) != job.checksum:
+            log.info("%s: rebuilt package has wrong checksum", job)
+        else:
+            os.rename(tmpfile, job.dest)
+            ok = True
+    except (IOError, OSError) as e:
+        log.info("%s: rebuild failed: %s", job, e)
+    finally:
+        for f in (tmpfile, job.delta):
+            if os.path.exists(f):
+                os.unlink(f)
+    return job, ok
+
+class Rebuilder(object):
+    '''Run rebuild_one() for a bunch of DeltaJobs, one per CPU at a time.'''
+    def __init__(self, jobs, processes=None):
+        self.jobs = list(jobs)
+        # each worker thread just waits for its applydeltarpm process, so
+        # this is effectively a pool of applydeltarpm processes.
+        self.processes = processes or multiprocessing.cpu_count()
+        self.cpu_seconds = 0.0
+        self.wall_seconds = 0.0
+        self._pool = None
+        self._result = None
+        self._start = None
+
+    def start(self):
+        log.info("rebuilding %u packages from deltas, %u at a time",
+                 len(self.jobs), self.processes)
+        self._start = (time.time(), _children_cpu_time())
+        self._pool = ThreadPool(self.processes)
+        self._result = self._pool.map_async(rebuild_one, self.jobs)
+
+    def wait(self):
+        '''Wait for the rebuilds to finish; returns (ok, failed) job lists.'''
+        if self._pool is None:
+            self.start()
+        try:
+            results = self._result.get()
+        finally:
+            self._pool.close()
+            self._pool.join()
+        self.wall_seconds = time.time() - self._start[0]
+        self.cpu_seconds = _children_cpu_time() - self._start[1]
+        ok = [job for job, good in results if good]
+        failed = [job for job, good in results if not good]
+        log.info("rebuilt %u packages (%u failed) in %.1fs, %.1f CPU seconds",
+                 len(ok), len(failed), self.wall_seconds, self.cpu_seconds)
+        return ok, failed
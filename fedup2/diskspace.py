@@ -0,0 +1,105 @@
+# diskspace.py - check for enough disk space before downloading
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Figure out how much space the download and the upgrade will need on each
+filesystem, using just the repo metadata, so we can stop *before*
+downloading gigabytes of packages that won't fit:
+
+    changes = [(pkg.files, pkg.installsize) for pkg in new] + \\
+              [(pkg.files, -pkg.installsize) for pkg in old]
+    short = [m for m in disk_usage(datadir, download_bytes, changes)
+             if m.short > 0]
+
+The metadata doesn't say how big each file is, so a package's installed
+size is split between filesystems according to how many of its files
+go on each one.
+'''
+
+import os
+
+import logging
+log = logging.getLogger("fedup2.diskspace")
+
+__all__ = ['MountUsage', 'disk_usage', 'MountFinder']
+
+class MountFinder(object):
+    '''Find the mountpoint for a path (which needn't exist yet).'''
+    def __init__(self, mountinfo='/proc/self/mountinfo'):
+        import libmount
+        self.table = libmount.Table(mountinfo)
+        self._cache = dict()
+
+    def __call__(self, path):
+        if path not in self._cache:
+            self._cache[path] = self.table.find_mountpoint(path).target
+        return self._cache[path]
+
+class MountUsage(object):
+    '''How much space we need on one filesystem.'''
+    def __init__(self, target, free):
+        self.target = target
+        self.free = free
+        self.download = 0
+        self.growth = 0.0
+
+    @property
+    def needed(self):
+        return self.download + max(int(self.growth), 0)
+
+    @property
+    def short(self):
+        '''How many more bytes we need than there are (<= 0 if it fits)'''
+        return self.needed - self.free
+
+    def __repr__(self):
+        return "<MountUsage %s: need %u, free %u>" % (self.target,
+                                                      self.needed, self.free)
+
+def _free_space(target, statvfs):
+    st = statvfs(target)
+    return st.f_bavail * st.f_frsize
+
+def disk_usage(datadir, download_bytes, changes, find_mount=None,
+               statvfs=os.statvfs):
+    '''
+    Return a list of MountUsage objects, one per filesystem affected.
+    download_bytes is how much will be written to datadir.
+    changes is a list of (files, size) pairs, for the packages being
+    installed (positive size) and removed (negative size).
+    '''
+    if find_mount is None:
+        find_mount = MountFinder()
+    mounts = dict()
+    def usage(path):
+        target = find_mount(path)
+        if target not in mounts:
+            mounts[target] = MountUsage(target, _free_space(target, statvfs))
+        return mounts[target]
+
+    usage(datadir).download += download_bytes
+    for files, size in changes:
+        dirs = [os.path.dirname(f) for f in files] or ['/usr']
+        share = float(size) / len(dirs)
+        for d in dirs:
+            usage(d).growth += share
+    for m in mounts.values():
+        log.debug("%s: download %u, growth %d, free %u",
+                  m.target, m.download, m.growth, m.free)
+    return sorted(mounts.values(), key=lambda m: m.target)
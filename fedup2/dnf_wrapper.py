@@ -18,18 +18,69 @@
 # Author: Will Woods <wwoods@redhat.com>
 
 import os
-import sys
+import time
 import rpm
 import dnf
+import hawkey
+import binascii
 import dnf.cli
 import dnf.util
+import dnf.repo
+import dnf.transaction
+import dnf.callback
+import dnf.lock
+import dnf.sack
+
+try:
+    from urllib.parse import urljoin, quote
+except ImportError:
+    from urlparse import urljoin
+    from urllib import quote
 
 from .plymouth import PlymouthOutput
+from .downloader import Downloader, DownloadJob, DownloadError, MirrorStats
+from .downloader import staging_files
+from .deltarpm import DeltaJob, Rebuilder
+from .ratelimit import RateSchedule, RateLimiter
+from .verify import check_signatures
+from .dedup import LocalCache, link_file
+from .savedtrans import write_transaction
+from .clean import remove
+from .prefetch import prefetch
+from .localrepo import make_local_repo, build_solv_cache, LOCALREPO
+from .diskspace import disk_usage
+from .conflicts import find_conflicts
+from .lean import skipped_upgrades
+from .ledger import DownloadLedger
+from .progress import DownloadMeter
+from .timing import DepsolveClock
+from .report import TransactionTimer, packages_file, INSTALL, CLEANUP
 from .i18n import _
 
 import logging
 log = logging.getLogger("fedup2.download")
 
+# only use a delta if it's smaller than this fraction of the full package
+DELTA_MAX_RATIO = 0.75
+
+# repo options our downloader doesn't handle; repos that set any of these
+# get downloaded by DNF instead
+DNF_ONLY_REPO_OPTS = ('proxy', 'proxy_username', 'proxy_password',
+                      'sslcacert', 'sslclientcert', 'sslclientkey',
+                      'username', 'password', 'throttle', 'bandwidth')
+
+# where to put package headers for the header-only test transaction
+HEADER_SUFFIX = '.hdr'
+
+# names for dnf.transaction op_types, for the saved transaction
+TRANS_ACTIONS = {
+    dnf.transaction.DOWNGRADE: 'downgrade',
+    dnf.transaction.ERASE: 'erase',
+    dnf.transaction.INSTALL: 'install',
+    dnf.transaction.REINSTALL: 'reinstall',
+    dnf.transaction.UPGRADE: 'upgrade',
+}
+
 class DepsolveProgressCallback(dnf.cli.output.DepSolveProgressCallBack):
     """upgrade depsolving takes a while, so we need output to screen"""
     # NOTE: DNF calls this *after* it does hawkey stuff, while it's building
@@ -37,6 +88,7 @@ class DepsolveProgressCallback(dnf.cli.output.DepSolveProgressCallBack):
     # Right now (April 2015) the hawkey Python bindings don't expose
     # a callback hook for that (AFAICT).
     # So, if there's a pause before this starts.. that's what's going on.
+    # (self.clock lets find_upgrade_packages() time the two parts.)
     def __init__(self, cli):
         super(DepsolveProgressCallback, self).__init__()
         self.cli = cli
@@ -44,6 +96,7 @@ class DepsolveProgressCallback(dnf.cli.output.DepSolveProgressCallBack):
         self.total = None
         self.name = "finding updates"
         self.modecounter = dict()
+        self.clock = DepsolveClock()
 
     def bar(self):
         self.cli.progressbar(self.count, self.total, self.name)
@@ -53,6 +106,7 @@ class DepsolveProgressCallback(dnf.cli.output.DepSolveProgressCallBack):
         self.bar()
 
     def pkg_added(self, pkg, mode):
+        self.clock.pkg_added()
         super(DepsolveProgressCallback, self).pkg_added(pkg, mode)
         if mode not in self.modecounter:
             self.modecounter[mode] = 0
@@ -66,6 +120,7 @@ class DepsolveProgressCallback(dnf.cli.output.DepSolveProgressCallBack):
         if self.count != self.total:
             self.count = self.total
             self.bar()
+        self.clock.end()
 
 class TransactionDisplay(dnf.cli.output.CliTransactionDisplay):
     def __init__(self, cli, testtrans=False):
@@ -76,6 +131,11 @@ class TransactionDisplay(dnf.cli.output.CliTransactionDisplay):
         self.ply = PlymouthOutput()
         self.plymouth = self.ply.ping()
         self.testtrans = testtrans
+        self.pkgtimer = TransactionTimer()
+
+    def _timer_action(self, action):
+        return CLEANUP if action in (self.PKG_CLEANUP, self.PKG_ERASE) \
+                       else INSTALL
 
     def _plyprog(self, cur, total, msg):
         self.ply.progress(int(100.0 * cur / total))
@@ -84,6 +144,8 @@ class TransactionDisplay(dnf.cli.output.CliTransactionDisplay):
     def event(self, package, action, te_cur, te_total, ts_cur, ts_total):
         super(TransactionDisplay, self).event(package,
             action, te_cur, te_total, ts_cur, ts_total)
+        self.pkgtimer.event(str(package), self._timer_action(action),
+                            te_cur, te_total)
 
         if self.plymouth and action in self.action:
             msg = "%s %s..." % (self.action.get(action), package)
@@ -91,6 +153,7 @@ class TransactionDisplay(dnf.cli.output.CliTransactionDisplay):
 
     def filelog(self, package, action):
         super(TransactionDisplay, self).filelog(package, action)
+        self.pkgtimer.finished(str(package), self._timer_action(action))
 
         if self.testtrans and action in (self.PKG_INSTALL, self.PKG_UPGRADE):
             self.inst_count += 1
@@ -100,13 +163,53 @@ class TransactionDisplay(dnf.cli.output.CliTransactionDisplay):
                 msg = "%s %s..." % (self.fileaction.get(action), package)
                 self._plyprog(self.inst_count, self.inst_total, msg)
 
+class LeanBase(dnf.Base):
+    '''
+    A dnf.Base that can skip loading the (huge) filelists metadata.
+    Set load_filelists = False before fill_sack(); the total size of the
+    filelists that weren't loaded is kept in skipped_bytes.
+    See fedup2.lean for how we decide whether we need them after all.
+    '''
+    load_filelists = True
+    skipped_bytes = 0
+
+    def fill_sack(self, *args, **kwargs):
+        self.skipped_bytes = 0
+        return super(LeanBase, self).fill_sack(*args, **kwargs)
+
+    def _add_repo_to_sack(self, name):
+        if self.load_filelists:
+            return super(LeanBase, self)._add_repo_to_sack(name)
+        # dnf always asks hawkey for the filelists, so intercept that
+        sack = self._sack
+        def load_yum_repo(hrepo, **kwargs):
+            kwargs['load_filelists'] = False
+            return type(sack).load_yum_repo(sack, hrepo, **kwargs)
+        sack.load_yum_repo = load_yum_repo
+        try:
+            return super(LeanBase, self)._add_repo_to_sack(name)
+        finally:
+            del sack.load_yum_repo
+            fn = getattr(self.repos[name], 'filelists_fn', None)
+            if fn and os.path.exists(fn):
+                self.skipped_bytes += os.path.getsize(fn)
+
 class DNFWrapper(object):
     def __init__(self, cli):
         self.cli = cli
         self.base = None
         self.dlprogress = None
+        self.ledger = None
         self.transdisplay = None
-        self.repodir = os.path.dirname(self.cli.state.statefile)
+        self.reused_bytes = 0
+        self.delta_saved = 0
+        self.delta_cpu_seconds = 0.0
+        self.mirrors = dict()
+        self.limiter = None
+        self.downloaded_bytes = 0
+        self.download_seconds = 0.0
+        self.localrepo = None
+        self.timer = cli.timer
         self._get_base()
 
     @property
@@ -130,7 +233,8 @@ class DNFWrapper(object):
         """
         conf = dnf.conf.Conf()
         conf.releasever = self.cli.args.version
-        self.base = dnf.Base(conf)
+        self.base = LeanBase(conf)
+        self.base.load_filelists = not getattr(self.cli.args, 'lean', False)
         conf = self.base.conf
         log.debug("before: conf.cachedir=%s", conf.cachedir)
         suffix = self._subst(dnf.const.CACHEDIR_SUFFIX)
@@ -138,7 +242,7 @@ class DNFWrapper(object):
         conf.cachedir = cache_dirs.cachedir
         log.debug("after: conf.cachedir=%s", conf.cachedir)
 
-    def setup(self, cacheonly=False):
+    def setup(self, cacheonly=False, localrepo=None):
         # activate cachedir etc.
         self.base.activate_persistor()
         # make sure datadir exists too
@@ -149,8 +253,17 @@ class DNFWrapper(object):
         self.base.repos.all().pkgdir = self.cli.args.datadir
         # apply cacheonly
         self.base.repos.all().md_only_cached = cacheonly
+        # use only the repo of downloaded packages, if we have one
+        if localrepo:
+            self.base.repos.all().disable()
+            repo = dnf.repo.Repo(LOCALREPO, self.cachedir)
+            repo.baseurl = ['file://' + localrepo]
+            repo.pkgdir = localrepo
+            self.base.repos.add(repo)
+            self.localrepo = localrepo
         # add progress callbacks
-        self.dlprogress = dnf.cli.progress.MultiFileProgressMeter(fo=sys.stdout)
+        self.dlprogress = DownloadMeter(self.cli.renderer)
+        self.ledger = DownloadLedger(self.cli.state, progress=self.dlprogress)
         self.transdisplay = TransactionDisplay(self.cli)
         self.base.repos.all().set_progress_bar(self.dlprogress)
         self.base.ds_callback = DepsolveProgressCallback(self.cli)
@@ -158,10 +271,54 @@ class DNFWrapper(object):
         #key_import = FedupCliKeyImport()
         #self.base.repos.all().set_key_import(key_import)
 
+    def _load_system_repo(self):
+        '''
+        Load the rpmdb into a throwaway sack. That writes the @System solv
+        cache, so fill_sack() can load that instead of reading the rpmdb.
+        '''
+        sack = dnf.sack.build_sack(self.base)
+        sack.load_system_repo(build_cache=True)
+
+    def prefetch_metadata(self):
+        '''
+        Fetch the metadata for all the enabled repos at once, and load the
+        rpmdb meanwhile, rather than one after another in fill_sack().
+        See fedup2.prefetch.
+        '''
+        repos = list(self.base.repos.iter_enabled())
+        # DownloadMeter can't handle more than one repo at a time
+        quiet = dnf.callback.NullDownloadProgress()
+        self.base.repos.all().set_progress_bar(quiet)
+        try:
+            with dnf.lock.build_metadata_lock(self.cachedir):
+                return prefetch(repos, lambda repo: repo.load(),
+                                self._load_system_repo)
+        finally:
+            self.base.repos.all().set_progress_bar(self.dlprogress)
+
+    @property
+    def lean(self):
+        '''True if we're working without the file lists'''
+        return not self.base.load_filelists
+
+    @property
+    def skipped_metadata(self):
+        '''bytes of filelists metadata we didn't load (see LeanBase)'''
+        return self.base.skipped_bytes
+
     def read_metadata(self):
         '''read rpmdb to find installed packages, get metadata for new pkgs.'''
-        # may raise RepoError if a mandatory repo is unavailable
-        self.base.fill_sack(load_system_repo=True, load_available_repos=True)
+        with self.timer.phase("metadata.fetch"):
+            self.prefetch_metadata()
+        start = time.time()
+        with self.timer.phase("metadata.sack"):
+            # may raise RepoError if a mandatory repo is unavailable
+            self.base.fill_sack(load_system_repo=True,
+                                load_available_repos=True)
+        log.info("sack built in %.1fs", time.time() - start)
+        if self.skipped_metadata:
+            log.info("lean mode: skipped %u bytes of filelists",
+                     self.skipped_metadata)
         return [r.id for r in self.base.repos.enabled()]
 
     def find_upgrade_packages(self, distro_sync=False):
@@ -169,26 +326,532 @@ class DNFWrapper(object):
         Find all available upgrades.
         returns: list of package objects.
         '''
-        installed = len(self.base.doPackageLists('installed').installed)
-        self.base.ds_callback.total = installed
-        if distro_sync:
-            self.base.distro_sync()
-        else:
-            self.base.upgrade_all()
-        self.base.resolve() # XXX: allow_erasing? conf.best?
-        downloads = self.base.transaction.install_set
+        timer = self.timer
+        with timer.phase("depsolve.installed-count"):
+            installed = self.base.sack.query().installed().count()
+        timer.count("installed", installed)
+        cb = self.base.ds_callback
+        cb.total = installed
+        with timer.phase("depsolve.mark"):
+            if distro_sync:
+                self.base.distro_sync()
+            else:
+                self.base.upgrade_all()
+        cb.clock.reset()
+        start = time.time()
+        try:
+            self.base.resolve() # XXX: allow_erasing? conf.best?
+        except dnf.exceptions.DepsolveError as e:
+            timer.add("depsolve.goal", time.time() - start)
+            if not self.lean:
+                raise
+            # maybe it's a file dependency that isn't in primary
+            log.info("lean mode: can't resolve without file lists: %s", e)
+            return self._load_filelists_and_retry(distro_sync)
+        goal, trans = cb.clock.split(start, time.time())
+        timer.add("depsolve.goal", goal)
+        timer.add("depsolve.transaction", trans)
+        with timer.phase("depsolve.install-set"):
+            downloads = self.base.transaction.install_set
+        timer.count("install_set", len(downloads))
+        if self.lean:
+            skipped = self.skipped_upgrades()
+            if skipped:
+                log.info("lean mode: %u packages weren't upgraded (%s); "
+                         "checking again with file lists", len(skipped),
+                         ", ".join(str(p) for p in skipped[:5]))
+                return self._load_filelists_and_retry(distro_sync)
         # remove rpm SIGINT handler (see dnf.cli.cli.BaseCli.do_transaction)
         del self.base.ts
         return downloads
 
-    def download_packages(self, pkglist):
-        self.base.download_packages(pkglist, self.dlprogress)
+    def _load_filelists_and_retry(self, distro_sync):
+        self.base.load_filelists = True
+        self.base.reset(sack=True, goal=True)
+        self.read_metadata()
+        return self.find_upgrade_packages(distro_sync)
+
+    def skipped_upgrades(self):
+        '''Installed packages that have an upgrade available that isn't
+           in the transaction (see fedup2.lean).'''
+        q = self.base.sack.query()
+        keys = set((p.name, p.arch) for p in q.upgrades())
+        upgradable = [p for p in q.installed() if (p.name, p.arch) in keys]
+        new, removed = [], []
+        for tsi in self.base.transaction:
+            if tsi.installed:
+                new.append(tsi.installed)
+            removed.extend(p for p in [tsi.erased] + list(tsi.obsoleted) if p)
+        return skipped_upgrades(upgradable, new, removed)
+
+    def disk_usage(self, pkglist):
+        '''
+        Estimate the space needed on each filesystem to download pkglist
+        and run the transaction. Returns a list of MountUsage objects
+        (see fedup2.diskspace). In lean mode we don't know where the files
+        go, so all the changes are counted against /usr's filesystem.
+        '''
+        files = lambda pkg: [] if self.lean else pkg.files
+        download = 0
+        for pkg in pkglist:
+            dest = pkg.localPkg()
+            if os.path.exists(dest):
+                continue
+            partial = staging_files(dest)[0]
+            have = os.path.getsize(partial) if os.path.exists(partial) else 0
+            download += max(pkg.downloadsize - have, 0)
+        changes = []
+        for tsi in self.base.transaction:
+            if tsi.installed:
+                changes.append((files(tsi.installed),
+                                tsi.installed.installsize))
+            for old in [tsi.erased] + list(tsi.obsoleted):
+                if old:
+                    changes.append((files(old), -old.installsize))
+        return disk_usage(self.cli.args.datadir, download, changes)
+
+    def find_conflicts(self):
+        '''
+        Look for files that would belong to more than one package after
+        the transaction, using the file lists from the metadata and the
+        rpmdb. Returns a list of (path, newpkg, otherpkg) tuples.
+        This needs the file lists, so it can't be used in lean mode.
+        '''
+        assert not self.lean, "no file lists in lean mode"
+        new, removed = [], set()
+        for tsi in self.base.transaction:
+            if tsi.installed:
+                new.append(tsi.installed)
+            removed.update(str(p) for p in [tsi.erased] + list(tsi.obsoleted)
+                           if p)
+        kept = [p for p in self.base.sack.query().installed()
+                if str(p) not in removed]
+        return find_conflicts(new, kept, lambda pkg: pkg.files,
+                              same=lambda a, b: a.name == b.name)
+
+    def save_transaction(self, path, checksums):
+        '''
+        Save the resolved transaction to path (see fedup2.savedtrans), so
+        load_transaction() can use it instead of resolving it all again.
+        checksums is a dict of package path -> verified checksum.
+        If the transaction has anything else in it (e.g. obsoletes), no
+        transaction is saved and the upgrade resolves it again.
+        '''
+        items = []
+        for tsi in self.base.transaction:
+            action = TRANS_ACTIONS.get(tsi.op_type)
+            if action is None:
+                log.info("not saving transaction: can't save op_type %s",
+                         tsi.op_type)
+                remove(path, "old saved transaction")
+                return
+            pkg = tsi.installed or tsi.erased
+            item = dict(action=action, nevra=str(pkg),
+                        reason=tsi.reason, path=None, checksum=None,
+                        replaces=[str(p) for p in tsi.obsoleted])
+            if tsi.installed:
+                item['path'] = tsi.installed.localPkg()
+                item['checksum'] = checksums.get(item['path'])
+                if tsi.erased:
+                    item['replaces'].insert(0, str(tsi.erased))
+            items.append(item)
+        repoids = [r.id for r in self.base.repos.enabled()]
+        write_transaction(path, items, self.cachedir, repoids)
+
+    def load_transaction(self, items):
+        '''
+        Set up the transaction from saved items (see save_transaction()),
+        loading only the rpmdb and the local repo (or the packages
+        themselves, if there's no local repo) - no depsolving.
+        Returns the list of packages to install, or None if the saved
+        transaction doesn't match the installed system.
+        '''
+        self.base.fill_sack(load_system_repo=True,
+                            load_available_repos=bool(self.localrepo))
+        installed = dict((str(p), p) for p in
+                         self.base.sack.query().installed())
+        available = dict((str(p), p) for p in
+                         self.base.sack.query().available())
+        trans = dnf.transaction.Transaction()
+        downloads = []
+        try:
+            for item in items:
+                old = [installed[nevra] for nevra in item['replaces']]
+                action = item['action']
+                if action == 'erase':
+                    trans.add_erase(installed[item['nevra']])
+                    continue
+                new = available.get(item['nevra']) or \
+                      self.base.add_remote_rpm(item['path'])
+                downloads.append(new)
+                if action == 'install':
+                    trans.add_install(new, old, item['reason'])
+                elif action == 'upgrade':
+                    trans.add_upgrade(new, old[0], old[1:])
+                elif action == 'downgrade':
+                    trans.add_downgrade(new, old[0], old[1:])
+                elif action == 'reinstall':
+                    trans.add_reinstall(new, old[0], old[1:])
+        except (KeyError, IndexError, IOError, OSError,
+                dnf.exceptions.Error) as e:
+            log.warning("can't use saved transaction: %s", e)
+            return None
+        self.base.transaction = trans
+        log.info("loaded saved transaction with %u items", len(items))
+        return downloads
+
+    @staticmethod
+    def _repo_urls(repo, location, baseurl=None):
+        '''
+        Return the list of http/https URLs we could fetch location from, or
+        an empty list if we should leave it to DNF (proxies, certificates,
+        authentication, throttling, local/ftp repos, etc.)
+        '''
+        if any(getattr(repo, opt, None) for opt in DNF_ONLY_REPO_OPTS):
+            return []
+        if not getattr(repo, 'sslverify', True):
+            return []
+        if baseurl:
+            mirrors = [baseurl]
+        else:
+            mirrors = getattr(repo.metadata, 'mirrors', None) or repo.baseurl
+        urls = [urljoin(m.rstrip('/')+'/', location) for m in mirrors or []]
+        if urls and all(u.startswith(('http://','https://')) for u in urls):
+            return urls
+        return []
+
+    def _pkg_urls(self, pkg):
+        urls = self._repo_urls(pkg.repo, pkg.location, pkg.baseurl)
+        if urls:
+            # try peers first; they get checked against our checksums
+            name = quote(os.path.basename(pkg.localPkg()))
+            urls = [p.rstrip('/')+'/'+name for p in self.cli.args.peer] + urls
+        return urls
+
+    @staticmethod
+    def _pkg_checksum(pkg):
+        '''Return the repo metadata checksum for pkg as "<type>:<hexdigest>".'''
+        csumtype, csum = pkg.returnIdSum()
+        if csumtype == 'sha':
+            csumtype = 'sha1'
+        return "%s:%s" % (csumtype, csum)
+
+    def reuse_local_packages(self, pkglist, verified, dirs):
+        '''
+        Hardlink/reflink packages from pkglist that we already have in dirs
+        into datadir. Updates verified, and returns the number of bytes we
+        won't need to download.
+        '''
+        cache = LocalCache(dirs, exclude=self.cli.args.datadir)
+        saved = 0
+        for pkg in pkglist:
+            dest = pkg.localPkg()
+            if os.path.exists(dest):
+                continue
+            checksum = self._pkg_checksum(pkg)
+            src = cache.find(os.path.basename(dest), pkg.downloadsize, checksum)
+            if src:
+                how = link_file(src, dest)
+                if how:
+                    log.debug("%s: %s from %s", pkg, how, src)
+                    verified[dest] = checksum
+                    saved += pkg.downloadsize
+        self.reused_bytes += saved
+        return saved
+
+    @staticmethod
+    def _delta_checksum(delta):
+        csumtype, csum = delta.chksum
+        return "%s:%s" % (hawkey.chksum_name(csumtype),
+                          binascii.hexlify(csum).decode('ascii'))
+
+    def _find_delta(self, pkg):
+        '''Return the smallest delta that gets us from an installed version
+           of pkg to pkg, or None if there isn't one worth using.'''
+        best = None
+        q = self.base.sack.query().installed().filter(name=pkg.name,
+                                                      arch=pkg.arch)
+        for ipkg in q:
+            delta = pkg.get_delta_from_evr(ipkg.evr)
+            if delta and (not best or delta.downloadsize < best.downloadsize):
+                best = delta
+        if best and best.downloadsize < pkg.downloadsize * DELTA_MAX_RATIO:
+            return best
+        return None
+
+    def set_rate_limit(self, max_rate=None, schedule=None):
+        '''Limit download bandwidth; see fedup2.ratelimit for the format.'''
+        sched = RateSchedule(max_rate, schedule)
+        self.limiter = RateLimiter(sched.rate_at) if sched else None
+
+    @property
+    def download_rate(self):
+        '''average download rate (bytes/sec) actually achieved'''
+        if self.download_seconds:
+            return self.downloaded_bytes / self.download_seconds
+        return 0.0
+
+    def _download(self, jobs, verified):
+        dl = Downloader(max_parallel=self.cli.args.parallel,
+                        progress=self.ledger, limiter=self.limiter)
+        try:
+            dl.download(jobs)
+        finally:
+            self.downloaded_bytes += dl.bytes
+            self.download_seconds += dl.elapsed
+            verified.update((j.dest, j.verified) for j in jobs if j.verified)
+            # count the ones that were already there, too
+            self.ledger.sync(j.name for j in jobs if j.verified)
+            for host, stats in dl.mirrors.items():
+                self.mirrors.setdefault(host, MirrorStats(host)).add(stats)
+
+    def _download_deltas(self, deltajobs):
+        '''
+        Download the deltas for the given packages and start rebuilding
+        them in the background. deltajobs is a dict mapping the DownloadJob
+        for each delta to the DownloadJob for its full package.
+        Returns a Rebuilder, and a list of full-package DownloadJobs for the
+        packages whose deltas we couldn't get.
+        '''
+        try:
+            self._download(list(deltajobs), dict())
+        except DownloadError as e:
+            log.info("failed to download %u deltas", len(e.errors))
+        rebuilds, nodelta = [], []
+        for djob, job in deltajobs.items():
+            if djob.verified:
+                rebuilds.append(DeltaJob(job.name, djob.dest, job.dest,
+                                         job.checksum, job.size, djob.size))
+            else:
+                nodelta.append(job)
+        rebuilder = Rebuilder(rebuilds)
+        rebuilder.start()
+        return rebuilder, nodelta
+
+    def download_packages(self, pkglist, verified=None, reuse_dirs=None,
+                          deltas=False):
+        '''
+        Download the packages in pkglist.
+        verified is a dict mapping package paths to checksums that have
+        already been verified; it gets updated as packages are downloaded
+        (even if the download fails partway through).
+        Identical packages found in reuse_dirs are used instead of
+        downloading them again; see reuse_local_packages().
+        If deltas is True, packages are rebuilt from deltarpms where
+        possible, falling back to the full package if that fails.
+        '''
+        if verified is None:
+            verified = dict()
+        if reuse_dirs:
+            self.reuse_local_packages(pkglist, verified, reuse_dirs)
+        self.ledger.reset(dict((str(p), p.downloadsize) for p in pkglist),
+                          done=[str(p) for p in pkglist
+                                if p.localPkg() in verified])
+        jobs, deltajobs, leftovers = [], dict(), []
+        for pkg in pkglist:
+            urls = self._pkg_urls(pkg)
+            if not urls:
+                leftovers.append(pkg)
+                continue
+            dest = pkg.localPkg()
+            job = DownloadJob(str(pkg), urls, dest, pkg.downloadsize,
+                              checksum=self._pkg_checksum(pkg),
+                              verified=verified.get(dest))
+            delta = None
+            if deltas and not any(os.path.exists(f) for f in
+                                  (dest,) + staging_files(dest)):
+                delta = self._find_delta(pkg)
+            if delta:
+                ddest = os.path.join(os.path.dirname(dest),
+                                     os.path.basename(delta.location))
+                durls = self._repo_urls(pkg.repo, delta.location,
+                                        delta.baseurl)
+                if durls:
+                    djob = DownloadJob(os.path.basename(ddest), durls, ddest,
+                                       delta.downloadsize,
+                                       checksum=self._delta_checksum(delta))
+                    deltajobs[djob] = job
+                    continue
+            jobs.append(job)
+        if leftovers:
+            self._dnf_download(leftovers, verified)
+        rebuilder = None
+        if deltajobs:
+            rebuilder, nodelta = self._download_deltas(deltajobs)
+            jobs += nodelta
+        bynames = dict((str(p), p) for p in pkglist)
+        try:
+            self._download_or_dnf(jobs, verified, bynames)
+        finally:
+            if rebuilder:
+                ok, failed = rebuilder.wait()
+                verified.update((j.dest, j.checksum) for j in ok)
+                self.ledger.sync(j.name for j in ok)
+                self.delta_saved += sum(j.saved for j in ok)
+                self.delta_cpu_seconds += rebuilder.cpu_seconds
+        if rebuilder and failed:
+            log.info("downloading %u packages that failed to rebuild",
+                     len(failed))
+            failed = set(j.dest for j in failed)
+            self._download_or_dnf([j for j in deltajobs.values()
+                                   if j.dest in failed], verified, bynames)
+        return self.mirrors
+
+    def _dnf_download(self, pkglist, verified):
+        '''Let DNF download the packages in pkglist.'''
+        log.info("letting DNF download %u packages", len(pkglist))
+        if self.limiter:
+            log.info("DNF downloads are not rate-limited")
+        self.base.download_packages(pkglist, self.ledger)
+        # DNF checks the checksums of the files it downloads
+        for pkg in pkglist:
+            verified[pkg.localPkg()] = self._pkg_checksum(pkg)
+        self.ledger.sync(str(pkg) for pkg in pkglist)
 
-    def do_transaction(self, test=False):
+    def _download_or_dnf(self, jobs, verified, bynames):
+        '''
+        Download jobs; if every URL fails for some of them, try again with
+        DNF's downloader. bynames maps job names to packages.
+        '''
+        try:
+            self._download(jobs, verified)
+        except DownloadError as e:
+            failed = [bynames[name] for name in e.errors if name in bynames]
+            if len(failed) != len(e.errors):
+                raise
+            log.info("%u packages failed to download; trying DNF",
+                     len(failed))
+            self._dnf_download(failed, verified)
+
+    def make_local_repo(self, pkglist):
+        '''
+        Make datadir into a repo containing just the packages in pkglist,
+        with its solv cache prebuilt, so the upgrade can load that instead
+        of all the enabled repos (see setup()).
+        '''
+        datadir = self.cli.args.datadir
+        if make_local_repo(datadir, [p.localPkg() for p in pkglist]):
+            try:
+                build_solv_cache(datadir, self.cachedir)
+            except Exception as e: # pylint: disable=broad-except
+                # not fatal; DNF will just build it during the upgrade
+                log.info("couldn't build solv cache: %s", e)
+            return True
+        return False
+
+    def fetch_headers(self, pkglist):
+        '''
+        Download just the headers of the packages in pkglist (the first
+        pkg.hdr_end bytes of each). Packages that are already downloaded
+        are used as-is. Returns a dict mapping each package's path to the
+        file holding its header, or None if we can't get all of them.
+        '''
+        headers, jobs = dict(), []
+        for pkg in pkglist:
+            dest = pkg.localPkg()
+            if os.path.exists(dest):
+                headers[dest] = dest
+                continue
+            urls = self._pkg_urls(pkg)
+            if not urls or not pkg.hdr_end:
+                log.info("can't fetch just the header of %s", pkg)
+                return None
+            headers[dest] = dest + HEADER_SUFFIX
+            jobs.append(DownloadJob(str(pkg), urls, headers[dest],
+                                    pkg.hdr_end, prefix=True))
+        try:
+            self._download(jobs, dict())
+        except DownloadError as e:
+            log.info("couldn't download all the headers: %s", e)
+            for job in jobs:
+                if os.path.exists(job.dest):
+                    os.unlink(job.dest)
+            return None
+        return headers
+
+    def test_headers(self, headers):
+        '''
+        Run an rpm test transaction using only the package headers (see
+        fetch_headers()). Returns a list of problems; empty if it passed.
+        '''
+        ts = rpm.TransactionSet(self.base.conf.installroot)
+        # the headers don't have a payload to check
+        ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
+        ts.setFlags(rpm.RPMTRANS_FLAG_TEST)
+        ts.setProbFilter(rpm.RPMPROB_FILTER_OLDPACKAGE)
+        for tsi in self.base.transaction:
+            if tsi.installed:
+                path = headers[tsi.installed.localPkg()]
+                with open(path, 'rb') as inf:
+                    hdr = ts.hdrFromFdno(inf.fileno())
+                mode = 'i' if tsi.op_type == dnf.transaction.INSTALL else 'u'
+                ts.addInstall(hdr, path, mode)
+            elif tsi.erased:
+                ts.addErase(tsi.erased.rpmdbid)
+            for pkg in tsi.obsoleted:
+                ts.addErase(pkg.rpmdbid)
+        problems = []
+        for (n, v, r), (reqname, reqver), _flags, _sugg, sense in ts.check():
+            what = 'conflicts with' if sense == rpm.RPMDEP_SENSE_CONFLICTS \
+                   else 'requires'
+            problems.append("%s-%s-%s %s %s %s" % (n, v, r, what,
+                                                    reqname, reqver or ''))
+        if problems:
+            return [p.strip() for p in problems]
+        ts.order()
+        files = dict()
+        def callback(what, _amount, _total, key, _data):
+            if what == rpm.RPMCALLBACK_INST_OPEN_FILE:
+                files[key] = open(key, 'rb')
+                return files[key].fileno()
+            elif what == rpm.RPMCALLBACK_INST_CLOSE_FILE:
+                files.pop(key).close()
+        try:
+            result = ts.run(callback, '') or []
+        finally:
+            for f in files.values():
+                f.close()
+        return [str(p[0]) for p in result]
+
+    def check_signatures(self, pkglist):
+        '''
+        Check the signatures of the (downloaded) packages in pkglist that
+        come from repos with gpgcheck enabled.
+        Returns a dict mapping package paths to fedup2.verify.SIG_* values.
+        '''
+        paths = [p.localPkg() for p in pkglist if p.repo.gpgcheck]
+        return check_signatures(paths)
+
+    def do_transaction(self, test=False, verified=False):
+        '''
+        Run the transaction (or a test transaction, if test is True).
+        If verified is True, the packages' signatures were already checked,
+        so rpm won't check them again. It still checks the digests, so a
+        package that was changed after it was checked will still fail.
+        '''
         origflags = self.base.ts.getTsFlags()
         if test:
             self.base.ts.addTsFlag(rpm.RPMTRANS_FLAG_TEST)
             self.transdisplay.testtrans = True
+        if verified:
+            log.info("packages already verified; skipping signature checks")
+            self.base.ts.pushVSFlags(rpm._RPMVSF_NOSIGNATURES)
         self.transdisplay.inst_total = len(self.base.transaction.install_set)
-        self.base.do_transaction(self.transdisplay)
+        try:
+            self.base.do_transaction(self.transdisplay)
+        finally:
+            if not test:
+                self.write_package_timing()
+        self.cli.renderer.finish()
         self.base.ts.setFlags(origflags)
+        if verified:
+            self.base.ts.popVSFlags()
+
+    def write_package_timing(self):
+        '''Save how long each package took (see fedup2.report).'''
+        timer = self.transdisplay.pkgtimer
+        timer.finish()
+        try:
+            timer.write(packages_file(self.cli.args.log))
+        except (IOError, OSError) as e:
+            log.info("can't write package timing: %s", e)
@@ -0,0 +1,681 @@
+# downloader.py - parallel package downloader
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+A simple parallel HTTP downloader for package payloads.
+
+    jobs = [DownloadJob(name, [url1, url2], "/path/to/file.rpm", size), ...]
+    dl = Downloader(max_parallel=4)
+    dl.download(jobs)
+    for host, stats in dl.mirrors.items():
+        print(host, stats.rate)
+
+Jobs are started largest-first, so the big files get going right away and
+the small ones fill in the gaps around them. Each mirror host gets its own
+pool of keep-alive connections, and the number of active transfers is
+tuned up or down based on the measured throughput. Redirects (which most
+mirror lists use) are followed, up to MAX_REDIRECTS.
+
+Data is written to a staging file (see staging_files()) with an index of
+per-chunk hashes; if a download gets interrupted, the next attempt checks
+the chunks already on disk and uses a HTTP Range request to fetch the rest.
+The file's checksum is computed while it's written, so each file only gets
+read once; job.verified holds the result.
+
+The optional 'progress' object should look like dnf's MultiFileProgressMeter:
+it gets start(total_files, total_size), progress(job, done) and
+end(job, status, msg) calls. DownloadJob quacks enough like a dnf Payload
+for that to work. Those calls come from the worker threads (one at a time),
+so they should be quick; if the progress object also has a poll() method,
+that gets called every POLL_INTERVAL seconds from the thread that called
+download(), for anything slower (like writing things to disk).
+'''
+
+import os
+import time
+import hashlib
+import threading
+from collections import deque
+
+try:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit, urljoin
+except ImportError:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit, urljoin
+
+import logging
+log = logging.getLogger("fedup2.downloader")
+
+__all__ = ['Downloader', 'DownloadJob', 'DownloadError', 'MirrorStats',
+           'PartialFile', 'staging_files', 'file_checksum']
+
+CHUNKSIZE = 64*1024
+TUNE_INTERVAL = 2.0 # seconds between concurrency adjustments
+POLL_INTERVAL = 0.5 # seconds between progress.poll() calls
+MAX_UNREACHABLE = 3 # give up on a host after this many failed connections
+MAX_REDIRECTS = 5   # follow at most this many redirects per request
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PART_SUFFIX = '.part'       # staging name for partial downloads
+INDEX_SUFFIX = '.idx'       # chunk hash index, next to the .part file
+INDEX_CHUNKSIZE = 1024*1024 # bytes per chunk hash
+INDEX_HASH = 'sha256'
+
+# same values as dnf.callback.STATUS_*
+STATUS_OK = None
+STATUS_FAILED = 2
+
+class DownloadError(Exception):
+    '''One or more files could not be downloaded.
+       'errors' maps the name of each failed job to a list of error strings.'''
+    def __init__(self, errors):
+        self.errors = errors
+        msg = "; ".join("%s: %s" % (name, ", ".join(errs))
+                        for name, errs in sorted(errors.items()))
+        Exception.__init__(self, msg)
+
+def _hasher(checksum):
+    '''Return a new hash object for a "<type>:<hexdigest>" checksum string.'''
+    csumtype = checksum.split(':', 1)[0]
+    return hashlib.new(csumtype)
+
+def file_checksum(path, csumtype):
+    '''Return the "<type>:<hexdigest>" checksum string for the given file.'''
+    h = hashlib.new(csumtype)
+    with open(path, 'rb') as inf:
+        for buf in iter(lambda: inf.read(CHUNKSIZE), b''):
+            h.update(buf)
+    return "%s:%s" % (csumtype, h.hexdigest())
+
+def staging_files(path):
+    '''Return the names of the staging files used while downloading path.'''
+    return (path + PART_SUFFIX, path + PART_SUFFIX + INDEX_SUFFIX)
+
+def check_content_range(header, offset):
+    '''Make sure a 206 response's Content-Range starts where we asked.'''
+    try:
+        unit, rng = header.split(None, 1)
+        first = int(rng.split('-', 1)[0])
+    except (AttributeError, ValueError):
+        raise IOError("bad Content-Range header %r" % header)
+    if unit != 'bytes' or first != offset:
+        raise IOError("Content-Range %r does not start at %u" % (header, offset))
+
+class PartialFile(object):
+    '''
+    A partially-downloaded file, plus an index of hashes for each complete
+    chunk of it. When opened, the data on disk is checked against the index
+    and anything after the first bad (or unindexed) chunk gets thrown away,
+    so 'offset' is always a safe place to resume from.
+
+    The index is a text file: a header line ("<hashname> <chunksize>")
+    followed by one hex digest per line. A digest is only appended after
+    the chunk it describes has been written out.
+
+    If 'checksum' (a "<type>:<hexdigest>" string) is given, the whole-file
+    checksum is computed as the data is written (or verified), and finish()
+    will refuse to finish a file that doesn't match.
+    '''
+    def __init__(self, path, chunksize=INDEX_CHUNKSIZE, checksum=None):
+        self.path = path
+        self.idxpath = path + INDEX_SUFFIX
+        self.chunksize = chunksize
+        self.checksum = checksum
+        self.header = "%s %u\n" % (INDEX_HASH, chunksize)
+        self._filehash = _hasher(checksum) if checksum else None
+        self.hashes = self._verify()
+        self.fobj = open(self.path, 'ab')
+        self.idx = open(self.idxpath, 'a')
+        if not self.hashes:
+            self.idx.write(self.header)
+            self.idx.flush()
+        self.size = self.fobj.tell()
+        self._hasher = hashlib.new(INDEX_HASH)
+        self._pending = 0
+
+    @property
+    def offset(self):
+        return self.size
+
+    def _read_index(self):
+        try:
+            with open(self.idxpath) as idx:
+                lines = idx.readlines()
+        except (IOError, OSError):
+            return []
+        if not lines or lines[0] != self.header:
+            return []
+        return [l.strip() for l in lines[1:] if l.endswith('\n')]
+
+    def _verify(self):
+        good = []
+        try:
+            with open(self.path, 'rb') as inf:
+                for digest in self._read_index():
+                    data = inf.read(self.chunksize)
+                    if len(data) != self.chunksize:
+                        break
+                    if hashlib.new(INDEX_HASH, data).hexdigest() != digest:
+                        log.info("%s: chunk %u is corrupt", self.path, len(good))
+                        break
+                    good.append(digest)
+                    if self._filehash:
+                        self._filehash.update(data)
+        except (IOError, OSError):
+            pass
+        # throw away anything we can't vouch for and rewrite the index
+        with open(self.path, 'ab') as outf:
+            outf.truncate(len(good)*self.chunksize)
+        with open(self.idxpath, 'w') as idx:
+            if good:
+                idx.write(self.header)
+                idx.writelines(d+'\n' for d in good)
+        return good
+
+    def write(self, buf):
+        self.fobj.write(buf)
+        self.size += len(buf)
+        if self._filehash:
+            self._filehash.update(buf)
+        while buf:
+            want = self.chunksize - self._pending
+            piece, buf = buf[:want], buf[want:]
+            self._hasher.update(piece)
+            self._pending += len(piece)
+            if self._pending == self.chunksize:
+                self.fobj.flush()
+                self.idx.write(self._hasher.hexdigest()+'\n')
+                self.idx.flush()
+                self._hasher = hashlib.new(INDEX_HASH)
+                self._pending = 0
+
+    def reset(self):
+        '''Throw away all the data and start over from zero.'''
+        self.fobj.truncate(0)
+        self.idx.truncate(0)
+        self.idx.write(self.header)
+        self.idx.flush()
+        self.size = 0
+        self.hashes = []
+        self._hasher = hashlib.new(INDEX_HASH)
+        self._pending = 0
+        if self.checksum:
+            self._filehash = _hasher(self.checksum)
+
+    def close(self):
+        self.fobj.close()
+        self.idx.close()
+
+    @property
+    def hexdigest(self):
+        '''whole-file "<type>:<hexdigest>" of the data so far, if known'''
+        if self._filehash:
+            return "%s:%s" % (self._filehash.name, self._filehash.hexdigest())
+
+    def finish(self, dest):
+        '''
+        The download is complete; move the data to dest.
+        If the checksum doesn't match, the data is thrown away and IOError
+        is raised.
+        '''
+        if self.checksum and self.hexdigest != self.checksum:
+            self.reset()
+            self.close()
+            raise IOError("checksum mismatch for %s" % dest)
+        self.close()
+        os.rename(self.path, dest)
+        os.unlink(self.idxpath)
+
+class DownloadJob(object):
+    '''
+    A file to download: candidate URLs (in order of preference), where to
+    put it, how big it is supposed to be, and (optionally) its checksum as
+    a "<type>:<hexdigest>" string.
+
+    'verified' is the checksum that dest is already known to have (e.g. from
+    a previous run), or None. Once the download finishes, it's set to the
+    checksum computed while downloading.
+
+    If 'prefix' is True, only the first 'size' bytes of the file are
+    fetched (e.g. just the header of a package) and written to dest.
+    '''
+    def __init__(self, name, urls, dest, size, checksum=None, verified=None,
+                 prefix=False):
+        self.name = name
+        self.urls = list(urls)
+        self.dest = dest
+        self.size = int(size or 0)
+        self.checksum = checksum
+        self.verified = verified
+        self.prefix = prefix
+
+    # for dnf.cli.progress.MultiFileProgressMeter
+    @property
+    def download_size(self):
+        return self.size
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "<DownloadJob %s (%u bytes)>" % (self.name, self.size)
+
+    def is_done(self):
+        '''
+        True if dest already exists, is the right size, and has the right
+        checksum. Files that were verified previously aren't read again;
+        files that exist but turn out to be bad are removed.
+        '''
+        try:
+            if os.stat(self.dest).st_size != self.size:
+                return False
+        except OSError:
+            return False
+        if not self.checksum or self.verified == self.checksum:
+            return True
+        csumtype = self.checksum.split(':', 1)[0]
+        if file_checksum(self.dest, csumtype) == self.checksum:
+            self.verified = self.checksum
+            return True
+        log.info("%s: checksum mismatch, removing", self.dest)
+        os.unlink(self.dest)
+        return False
+
+class MirrorStats(object):
+    '''Transfer statistics for a single mirror host.'''
+    def __init__(self, host):
+        self.host = host
+        self.bytes = 0
+        self.seconds = 0.0
+        self.files = 0
+        self.failures = 0
+        self.unreachable = 0 # connection failures in a row
+
+    def add(self, other):
+        '''Add the numbers from another MirrorStats to this one.'''
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+        self.files += other.files
+        self.failures += other.failures
+
+    @property
+    def rate(self):
+        '''average bytes/sec while transferring from this mirror'''
+        # NOTE: with several transfers going at once this is per-connection,
+        # so the sum of these can be more than the total rate.
+        if self.seconds > 0:
+            return self.bytes / self.seconds
+        return 0.0
+
+class ConnectionPool(object):
+    '''Idle keep-alive connections for a single mirror host.'''
+    def __init__(self, scheme, netloc, timeout=30):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        '''Make a new connection to this host.'''
+        if self.scheme == 'https':
+            return HTTPSConnection(self.netloc, timeout=self.timeout)
+        return HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def get(self):
+        '''Returns (conn, reused); reused is True for an idle connection.'''
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connect(), False
+
+    def put(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle = []
+
+class Downloader(object):
+    def __init__(self, max_parallel=4, progress=None, timeout=30,
+                       adaptive=True, chunksize=INDEX_CHUNKSIZE, limiter=None):
+        self.max_parallel = max(1, int(max_parallel))
+        self.chunksize = chunksize
+        self.limiter = limiter
+        self.rate = 0.0
+        self.elapsed = 0.0
+        self.parallel = self.max_parallel
+        self.progress = progress
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.mirrors = dict()
+        self.errors = dict()
+        self._pools = dict()
+        self._queue = deque()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._proglock = threading.Lock()
+        self._bytes = 0
+        self._last_rate = None
+        self._direction = -1
+
+    @property
+    def bytes(self):
+        '''total bytes downloaded so far'''
+        return self._bytes
+
+    # == bookkeeping ==========================================================
+
+    def _pool(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._cond:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(scheme, netloc, self.timeout)
+                self.mirrors[netloc] = MirrorStats(netloc)
+            return self._pools[key]
+
+    def _progress(self, method, *args):
+        if self.progress is not None:
+            with self._proglock:
+                getattr(self.progress, method)(*args)
+
+    def _poll(self):
+        # not under _proglock: this is for the slow stuff
+        poll = getattr(self.progress, 'poll', None)
+        if poll is not None:
+            poll()
+
+    def _tune(self, rate):
+        '''
+        Simple hill-climbing on the number of active transfers: keep moving
+        in the same direction while throughput improves, turn around when it
+        gets worse, stay put if it's about the same.
+        '''
+        last, self._last_rate = self._last_rate, rate
+        if last is None:
+            return self.parallel
+        if rate < last * 0.95:
+            self._direction = -self._direction
+        elif rate <= last * 1.05:
+            return self.parallel
+        newval = min(self.max_parallel, max(1, self.parallel+self._direction))
+        if newval != self.parallel:
+            log.debug("throughput %.0f B/s (was %.0f): parallel %u -> %u",
+                      rate, last, self.parallel, newval)
+        with self._cond:
+            self.parallel = newval
+            self._cond.notify_all()
+        return newval
+
+    # == the actual downloading ===============================================
+
+    def _request(self, pool, stats, path, headers):
+        '''Send a GET request on a connection from pool.
+           Returns (conn, response).'''
+        conn, reused = pool.get()
+        try:
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+            except (OSError, HTTPException):
+                if not reused:
+                    raise
+                # the server probably closed the idle connection
+                conn.close()
+                conn = pool.connect()
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+        except (OSError, HTTPException):
+            conn.close()
+            with self._cond:
+                stats.unreachable += 1
+            raise
+        with self._cond:
+            stats.unreachable = 0
+        return conn, resp
+
+    def _open(self, url, headers):
+        '''GET url, following redirects.
+           Returns (conn, response, pool, stats) for the URL that answered.'''
+        for _ in range(MAX_REDIRECTS+1):
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https'):
+                raise ValueError("unsupported URL scheme %r" % parts.scheme)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            pool = self._pool(parts.scheme, parts.netloc)
+            stats = self.mirrors[parts.netloc]
+            conn, resp = self._request(pool, stats, path, headers)
+            if resp.status not in REDIRECT_CODES:
+                return conn, resp, pool, stats
+            location = resp.getheader('Location')
+            resp.read()
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+            if not location:
+                raise IOError("%s: HTTP %u with no Location" %
+                              (url, resp.status))
+            log.debug("%s redirected to %s", url, location)
+            url = urljoin(url, location)
+        raise IOError("%s: too many redirects" % url)
+
+    def _transferred(self, job, nbytes, done):
+        with self._cond:
+            self._bytes += nbytes
+        if self.limiter:
+            self.limiter.consume(nbytes)
+        self._progress('progress', job, done)
+
+    def _fetch_prefix(self, job, url):
+        '''Fetch just the first job.size bytes of url into job.dest.'''
+        start = time.time()
+        done = 0
+        tmpfile = job.dest + '.tmp'
+        conn, resp, pool, stats = self._open(url, {'Range': 'bytes=0-%u' %
+                                                            (job.size-1)})
+        try:
+            if resp.status == 206:
+                check_content_range(resp.getheader('Content-Range'), 0)
+            elif resp.status != 200:
+                resp.read()
+                raise IOError("%s: HTTP error %u" % (url, resp.status))
+            with open(tmpfile, 'wb') as outf:
+                while done < job.size:
+                    buf = resp.read(min(CHUNKSIZE, job.size-done))
+                    if not buf:
+                        raise IOError("%s: got %u bytes, expected %u" %
+                                      (url, done, job.size))
+                    outf.write(buf)
+                    done += len(buf)
+                    self._transferred(job, len(buf), done)
+            os.rename(tmpfile, job.dest)
+        except Exception:
+            conn.close()
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+            raise
+        else:
+            # if the server sent more than we asked for, we didn't read it all
+            if resp.length == 0 and not resp.will_close:
+                pool.put(conn)
+            else:
+                conn.close()
+        finally:
+            with self._cond:
+                stats.bytes += done
+                stats.seconds += time.time() - start
+        with self._cond:
+            stats.files += 1
+
+    def _fetch_url(self, job, url):
+        scheme = urlsplit(url).scheme
+        if scheme not in ('http', 'https'):
+            raise ValueError("unsupported URL scheme %r" % scheme)
+        if job.prefix:
+            return self._fetch_prefix(job, url)
+        part = PartialFile(job.dest + PART_SUFFIX, self.chunksize,
+                           job.checksum)
+        if job.size and part.size == job.size:
+            # got all the data last time but didn't get to finish up
+            part.finish(job.dest)
+            job.verified = part.hexdigest
+            return
+        elif job.size and part.size > job.size:
+            part.reset()
+        start = time.time()
+        done = 0
+        headers = {}
+        if part.offset:
+            log.debug("resuming %s at byte %u", job, part.offset)
+            headers['Range'] = 'bytes=%u-' % part.offset
+        try:
+            conn, resp, pool, stats = self._open(url, headers)
+        except Exception:
+            part.close()
+            raise
+        try:
+            if resp.status == 200 and part.offset:
+                log.debug("%s: server ignored Range request", stats.host)
+                part.reset()
+            elif resp.status == 206:
+                check_content_range(resp.getheader('Content-Range'),
+                                    part.offset)
+            elif resp.status != 200:
+                resp.read()
+                raise IOError("%s: HTTP error %u" % (url, resp.status))
+            while True:
+                buf = resp.read(CHUNKSIZE)
+                if not buf:
+                    break
+                part.write(buf)
+                done += len(buf)
+                self._transferred(job, len(buf), part.size)
+            if job.size and part.size != job.size:
+                raise IOError("%s: got %u bytes, expected %u" %
+                              (url, part.size, job.size))
+            part.finish(job.dest)
+            job.verified = part.hexdigest
+        except Exception:
+            conn.close()
+            part.close()
+            raise
+        else:
+            if resp.will_close:
+                conn.close()
+            else:
+                pool.put(conn)
+        finally:
+            with self._cond:
+                stats.bytes += done
+                stats.seconds += time.time() - start
+        with self._cond:
+            stats.files += 1
+
+    def _fetch(self, job):
+        errs = []
+        for url in job.urls:
+            stats = self.mirrors.get(urlsplit(url).netloc)
+            if stats and stats.unreachable >= MAX_UNREACHABLE:
+                errs.append("%s is unreachable" % stats.host)
+                continue
+            try:
+                self._fetch_url(job, url)
+            except (IOError, OSError, ValueError, HTTPException) as e:
+                log.info("download of %s from %s failed: %s", job, url, e)
+                errs.append(str(e) or e.__class__.__name__)
+                netloc = urlsplit(url).netloc
+                with self._cond:
+                    if netloc in self.mirrors:
+                        self.mirrors[netloc].failures += 1
+            else:
+                self._progress('end', job, STATUS_OK, None)
+                return
+        with self._cond:
+            self.errors[job.name] = errs or ["no usable URLs"]
+        self._progress('end', job, STATUS_FAILED, "; ".join(errs))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._active >= self.parallel and self._queue:
+                    self._cond.wait(0.5)
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                self._active += 1
+            try:
+                self._fetch(job)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def download(self, jobs):
+        '''
+        Download everything in jobs (largest first), skipping files that
+        are already present. Raises DownloadError if anything failed.
+        '''
+        todo = sorted((j for j in jobs if not j.is_done()),
+                      key=lambda j: j.size, reverse=True)
+        log.info("downloading %u files (%u skipped), max %u at once",
+                 len(todo), len(jobs)-len(todo), self.max_parallel)
+        self._progress('start', len(todo), sum(j.size for j in todo))
+        self._queue.extend(todo)
+        threads = [threading.Thread(target=self._worker)
+                   for _ in range(min(self.max_parallel, len(todo)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        start = lastcheck = time.time()
+        lastbytes = 0
+        try:
+            while threads:
+                threads[0].join(POLL_INTERVAL)
+                threads = [t for t in threads if t.is_alive()]
+                self._poll()
+                now = time.time()
+                if now - lastcheck >= TUNE_INTERVAL:
+                    with self._cond:
+                        total = self._bytes
+                    self.rate = (total-lastbytes) / (now-lastcheck)
+                    log.debug("current rate: %.0f bytes/sec", self.rate)
+                    if self.adaptive:
+                        self._tune(self.rate)
+                    lastcheck, lastbytes = now, total
+        except KeyboardInterrupt:
+            # let the workers finish up their current file and exit
+            with self._cond:
+                self._queue.clear()
+            raise
+        finally:
+            self.elapsed = time.time() - start
+            for pool in self._pools.values():
+                pool.close()
+        for host, stats in sorted(self.mirrors.items()):
+            log.info("mirror %s: %u files, %u bytes, %.0f bytes/sec, "
+                     "%u failures", host, stats.files, stats.bytes,
+                     stats.rate, stats.failures)
+        if self.errors:
+            raise DownloadError(self.errors)
@@ -0,0 +1,55 @@
+# format.py - format numbers and times for humans
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+The same output as format_number() and format_time() from dnf.cli.format,
+without having to import dnf (which takes longer than everything else
+'fedup2 status' does put together).
+'''
+
+__all__ = ['format_number', 'format_time']
+
+_SYMBOLS = (' ', 'k', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
+
+def format_number(number, SI=0, space=' '):
+    '''Turn a number into a human-readable string, like "1.2 M".'''
+    step = 1000.0 if SI else 1024.0
+    depth = 0
+    while number > 999 and depth < len(_SYMBOLS) - 1:
+        depth += 1
+        number = number / step
+    if isinstance(number, int):
+        fmt = '%i%s%s'
+    elif number < 9.95:
+        fmt = '%.1f%s%s'
+    else:
+        fmt = '%.0f%s%s'
+    return fmt % (float(number or 0), space, _SYMBOLS[depth])
+
+def format_time(seconds, use_hours=0):
+    '''Turn a number of seconds into MM:SS (or HH:MM:SS, with use_hours).'''
+    if seconds is None or seconds < 0:
+        return '--:--:--' if use_hours else '--:--'
+    if seconds == float('inf'):
+        return 'Infinite'
+    minutes, seconds = divmod(int(seconds), 60)
+    if use_hours:
+        hours, minutes = divmod(minutes, 60)
+        return '%02i:%02i:%02i' % (hours, minutes, seconds)
+    return '%02i:%02i' % (minutes, seconds)
@@ -1,3 +1,5 @@
+import sys
 import gettext
 t = gettext.translation("fedup2", "/usr/share/locale", fallback=True)
-_ = t.lgettext
+# lgettext returns bytes on python3 (and is gone in 3.11)
+_ = t.gettext if sys.version_info[0] >= 3 else t.lgettext
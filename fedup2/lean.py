@@ -0,0 +1,52 @@
+# lean.py - resolving the upgrade without the file lists
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+The filelists metadata is huge, and the upgrade hardly ever needs it.
+'fedup2 download --lean' resolves the upgrade without it (see LeanBase
+in dnf_wrapper) and only loads it if the result looks wrong.
+
+Without the file lists the solver only knows about the files that are
+listed in primary (/etc/*, */bin/*), so any other file dependency can't
+be satisfied. That doesn't always make resolving fail: with best=False
+the solver may just leave a package at its old version. So rather than
+guessing from the error message, we check the result:
+
+    skipped = skipped_upgrades(upgradable, new, removed)
+    if skipped:
+        # load the file lists and resolve it again
+
+Anything that looks at the files in the packages (fedup2.conflicts,
+fedup2.diskspace) can't be trusted in lean mode either.
+'''
+
+__all__ = ['skipped_upgrades']
+
+def _key(pkg):
+    return (pkg.name, pkg.arch)
+
+def skipped_upgrades(upgradable, new, removed):
+    '''
+    upgradable is the installed packages that have a newer version
+    available; new and removed are the packages the transaction installs
+    and removes (including the ones being upgraded or obsoleted).
+    Returns the packages in upgradable that the transaction leaves alone.
+    '''
+    done = set(_key(p) for p in new) | set(_key(p) for p in removed)
+    return sorted((p for p in upgradable if _key(p) not in done), key=str)
@@ -0,0 +1,147 @@
+# ledger.py - keep track of download progress in the upgrade state
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+'fedup2 status' gets run a lot (by people and by monitoring tools), so
+it shouldn't have to look at every file in datadir to say how far along
+the download is. Instead, the downloader keeps a running tally in the
+upgrade state as each package finishes:
+
+    ledger = DownloadLedger(state, progress=meter)
+    ledger.reset(dict((str(p), p.size) for p in pkglist), done=already_have)
+    Downloader(progress=ledger).download(jobs)
+    ledger.sync(j.name for j in jobs if j.verified)
+    ledger.flush()
+
+DownloadLedger is a progress object for the Downloader (or DNF); it
+passes everything along to the real progress meter, if there is one.
+Commits to the state are limited to one every 'interval' seconds.
+
+The Downloader calls end() from its worker threads while holding its
+progress lock, so a commit there would stall every other download. So
+commits only happen in the thread that created the ledger: done() calls
+from other threads just update the tally, and the Downloader's poll()
+calls (from the main thread) commit it.
+'''
+
+import time
+import threading
+
+import logging
+log = logging.getLogger("fedup2.ledger")
+
+__all__ = ['DownloadLedger']
+
+COMMIT_INTERVAL = 1.0 # minimum seconds between state commits
+
+# same value as dnf.callback.STATUS_OK
+STATUS_OK = None
+
+class DownloadLedger(object):
+    def __init__(self, state, progress=None, interval=COMMIT_INTERVAL,
+                 clock=time.time):
+        self.state = state
+        self.progress_meter = progress
+        self.interval = interval
+        self._clock = clock
+        self._pending = dict()
+        self._pkgs = 0
+        self._bytes = 0
+        self._session = 0
+        self._start = clock()
+        self._committed = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._thread = threading.current_thread()
+
+    def reset(self, sizes, done=()):
+        '''
+        Start counting. sizes is a dict mapping the name of each package
+        to its size; the ones named in done are already downloaded.
+        '''
+        with self._lock:
+            self._pending = dict(sizes)
+            self._pkgs = self._bytes = self._session = 0
+            for name in done:
+                if name in self._pending:
+                    self._pkgs += 1
+                    self._bytes += self._pending.pop(name)
+            self._start = self._clock()
+        del self.state.current_rate
+        log.debug("ledger: %u packages (%u bytes) done, %u to go",
+                  self._pkgs, self._bytes, len(self._pending))
+        self.flush()
+
+    def done(self, name):
+        '''Count the named package as downloaded, if we haven't already.'''
+        with self._lock:
+            size = self._pending.pop(name, None)
+            if size is None:
+                return
+            self._pkgs += 1
+            self._bytes += size
+            self._session += size
+            self._dirty = True
+        if threading.current_thread() is self._thread:
+            self.poll()
+
+    def poll(self):
+        '''Commit, if anything changed since the last commit (and it was
+        at least 'interval' seconds ago).'''
+        now = self._clock()
+        if self._dirty and (self._committed is None or
+                            now - self._committed >= self.interval):
+            self.flush()
+
+    def sync(self, names):
+        '''Count all the named packages, then commit.'''
+        for name in names:
+            self.done(name)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pkgs, size, session, start = (self._pkgs, self._bytes,
+                                          self._session, self._start)
+            self._dirty = False
+        now = self._clock()
+        with self.state as state:
+            state.pkgs_done = pkgs
+            state.size_done = size
+            state.progress_time = int(now)
+            if session and now > start:
+                state.current_rate = int(session / (now - start))
+        self._committed = now
+
+    # == progress meter methods ===============================================
+
+    def _forward(self, method, *args):
+        if self.progress_meter is not None:
+            getattr(self.progress_meter, method)(*args)
+
+    def start(self, total_files, total_size):
+        self._forward('start', total_files, total_size)
+
+    def progress(self, payload, done):
+        self._forward('progress', payload, done)
+
+    def end(self, payload, status, msg):
+        self._forward('end', payload, status, msg)
+        if status == STATUS_OK:
+            self.done(str(payload))
@@ -0,0 +1,97 @@
+# localrepo.py - a small repo of just the downloaded packages
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+The offline upgrade only needs the packages in datadir, but loading the
+metadata for all the enabled repos means loading tens of thousands of
+packages. So after the download we make datadir into a repo of its own:
+
+    if make_local_repo(datadir, paths):
+        build_solv_cache(datadir, cachedir)
+
+and the upgrade only loads that repo (and the rpmdb). The solv cache
+gets built in advance too, using the same cachedir DNF will use, so the
+upgrade doesn't even have to parse the XML.
+'''
+
+import os
+from subprocess import call
+from xml.etree import ElementTree
+
+import logging
+log = logging.getLogger("fedup2.localrepo")
+
+__all__ = ['make_local_repo', 'build_solv_cache', 'has_local_repo',
+           'repomd_files', 'LOCALREPO', 'REPODATA']
+
+CREATEREPO = '/usr/bin/createrepo_c'
+LOCALREPO = 'system-upgrade'
+REPODATA = 'repodata'
+_REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+
+def _repomd(datadir):
+    return os.path.join(datadir, REPODATA, 'repomd.xml')
+
+def has_local_repo(datadir):
+    return os.path.exists(_repomd(datadir))
+
+def repomd_files(datadir):
+    '''Return a dict mapping metadata types to the files in repomd.xml.'''
+    files = dict()
+    root = ElementTree.parse(_repomd(datadir)).getroot()
+    for data in root.findall(_REPO_NS+'data'):
+        location = data.find(_REPO_NS+'location')
+        if location is not None:
+            files[data.get('type')] = os.path.join(datadir,
+                                                   location.get('href'))
+    return files
+
+def make_local_repo(datadir, paths):
+    '''Write repodata for the packages in paths into datadir.
+       Returns True if it worked.'''
+    listfile = os.path.join(datadir, 'localrepo.pkglist')
+    with open(listfile, 'w') as outf:
+        for p in sorted(paths):
+            outf.write(os.path.relpath(p, datadir)+'\n')
+    try:
+        rv = call([CREATEREPO, '--quiet', '--no-database',
+                   '--simple-md-filenames', '--pkglist', listfile, datadir])
+    except OSError as e:
+        log.info("can't run %s: %s", CREATEREPO, e)
+        rv = None
+    finally:
+        os.unlink(listfile)
+    if rv != 0:
+        log.info("couldn't create local repo in %s", datadir)
+        return False
+    log.info("created local repo with %u packages", len(paths))
+    return True
+
+def build_solv_cache(datadir, cachedir, repoid=LOCALREPO):
+    '''Load the local repo into a hawkey sack, so the solv cache gets
+       written to cachedir for DNF to use later.'''
+    import hawkey
+    files = repomd_files(datadir)
+    hrepo = hawkey.Repo(repoid)
+    hrepo.repomd_fn = _repomd(datadir)
+    hrepo.primary_fn = files['primary']
+    hrepo.filelists_fn = files['filelists']
+    sack = hawkey.Sack(cachedir=cachedir, make_cache_dir=True)
+    sack.load_yum_repo(hrepo, build_cache=True, load_filelists=True)
+    log.info("built solv cache for %s in %s", repoid, cachedir)
@@ -60,8 +60,14 @@ program:
     finally:
         if pidlock:
             pidlock.remove()
+
+If you'd rather wait for the other process to finish, give PidLock a
+timeout (in seconds, or None to wait forever). The 'waited' attribute says
+how long it took to get the lock, and 'held' says how long we've had it.
 '''
 
+import os
+import time
 from fcntl import lockf, LOCK_UN, LOCK_EX, LOCK_SH, LOCK_NB
 from os import getpid, unlink
 from contextlib import contextmanager
@@ -82,6 +88,12 @@ class LockError(IOError):
             strerror = "Could not obtain exclusive lock"
         IOError.__init__(self, errno, strerror, filename)
 
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
+
 class PidLockError(LockError):
     'Failed to lock the pidfile.'
     def __init__(self, errno, strerror, filename, pid=None):
@@ -139,31 +151,67 @@ def locked(fobj, mode='r+', block=False, share=False):
     with locked(filename) as fobj:
         # opens filename (with mode 'r+') and attempts to lock it as above.
         # NOTE: will raise IOError if the file doesn't exist.
+        # the file gets closed (and thus unlocked) at the end.
     '''
-    if not hasattr(fobj, 'fileno'):
+    opened = not hasattr(fobj, 'fileno')
+    if opened:
         fobj = open(fobj, mode)
-    lock(fobj, block=block, share=share)
-    yield fobj
-    unlock(fobj)
+    try:
+        lock(fobj, block=block, share=share)
+        yield fobj
+        unlock(fobj)
+    finally:
+        if opened:
+            fobj.close()
+
+POLL_INTERVAL = 0.1 # seconds between attempts while waiting for a PidLock
 
 class PidLock(object):
     '''Represents a PID file which will be locked to prevent multiple
-       processes from running at the same time.'''
-    def __init__(self, name):
+       processes from running at the same time.
+       If the lock is taken, wait up to 'timeout' seconds (None means
+       forever) for it to be released before raising PidLockError.'''
+    def __init__(self, name, timeout=0):
         self.name = name
-        self.fobj = open(name, 'a+')
-        self.fobj.seek(0)
+        start = time.time()
+        self.fobj = None
+        while self.fobj is None:
+            try:
+                self.fobj = self._trylock()
+            except PidLockError:
+                waited = time.time() - start
+                if timeout is not None and waited + POLL_INTERVAL > timeout:
+                    raise
+                time.sleep(POLL_INTERVAL)
+        self.acquired = time.time()
+        self.waited = self.acquired - start
+
+    def _trylock(self):
+        '''Try to lock the pidfile. Returns the locked file, or None if
+           the pidfile was removed while we were locking it.'''
+        fobj = open(self.name, 'a+')
+        fobj.seek(0)
         try:
-            lock(self.fobj, share=False, block=False)
-            self.fobj.truncate(0)
-            self.fobj.write("%u\n" % getpid())
-            self.fobj.flush()
-            lock(self.fobj, share=True, block=True) # downgrade to reader-lock
+            lock(fobj, share=False, block=False)
         except LockError as e:
-            lock(self.fobj, share=True, block=True) # wait for downgrade
-            pid = self.fobj.read().strip()
-            self.fobj.close()
+            lock(fobj, share=True, block=True) # wait for downgrade
+            pid = fobj.read().strip()
+            fobj.close()
             raise PidLockError(e.errno, None, e.filename, pid)
+        if os.fstat(fobj.fileno()).st_ino != _inode(self.name):
+            # the previous owner removed it after we opened it
+            fobj.close()
+            return None
+        fobj.truncate(0)
+        fobj.write("%u\n" % getpid())
+        fobj.flush()
+        lock(fobj, share=True, block=True) # downgrade to reader-lock
+        return fobj
+
+    @property
+    def held(self):
+        '''How long (in seconds) we've held the lock.'''
+        return time.time() - self.acquired
 
     def remove(self):
         '''Unlock and remove the pidfile.'''
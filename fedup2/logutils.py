@@ -17,7 +17,24 @@
 #
 # Author: Will Woods <wwoods@redhat.com>
 
-import logging, logging.config
+import os
+import copy
+import gzip
+import time
+import shutil
+import atexit
+import threading
+import logging, logging.config, logging.handlers
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+LOG_MAX_BYTES = 32*1024*1024 # rotate the debug log when it gets this big
+LOG_BACKUPS = 4              # and keep this many (compressed) old logs
+
+DEBUGLOG_FORMAT = ("[%(reltime)10.3f] %(levelsym)s %(name)s:%(funcName)s() "
+                   "%(message)s")
 
 levelsyms = {
     logging.DEBUG:   '(DD)',
@@ -28,13 +45,119 @@ levelsyms = {
     logging.FATAL:   '(FF)',
 }
 
-from dnf.logging import DDEBUG
-
 class FedupFormatter(logging.Formatter):
     def format(self, record):
         record.reltime = float(record.relativeCreated)/1000
         record.levelsym = levelsyms.get(record.levelno, '(--)')
-        return logging.Formatter.format(self, record)
+        msg = logging.Formatter.format(self, record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            msg += " [%u earlier messages suppressed]" % suppressed
+        return msg
+
+class RateLimitFilter(logging.Filter):
+    '''
+    Let through at most 'rate' debug messages per second (with bursts of up
+    to 'burst') from each logger. The number of messages dropped is noted
+    on the next one that gets through. Messages of INFO or higher are never
+    dropped.
+    '''
+    def __init__(self, rate, burst=None, clock=time.time):
+        logging.Filter.__init__(self)
+        self.rate = float(rate)
+        self.burst = burst or max(self.rate, 1)
+        self.dropped = 0
+        self._clock = clock
+        self._buckets = dict() # logger name -> [tokens, last, dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.INFO:
+            return True
+        with self._lock:
+            now = self._clock()
+            b = self._buckets.get(record.name)
+            if b is None:
+                b = self._buckets[record.name] = [self.burst, now, 0]
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+            if b[0] < 1:
+                b[2] += 1
+                self.dropped += 1
+                return False
+            b[0] -= 1
+            if b[2]:
+                record.suppressed, b[2] = b[2], 0
+        return True
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+def _gzip_rotator(source, dest):
+    with open(source, 'rb') as inf:
+        with gzip.open(dest, 'wb') as outf:
+            shutil.copyfileobj(inf, outf)
+    os.unlink(source)
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    '''A RotatingFileHandler that compresses the old logs (fedup2.log.1.gz)'''
+    def __init__(self, filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS):
+        logging.handlers.RotatingFileHandler.__init__(self, filename,
+                                                      maxBytes=maxBytes,
+                                                      backupCount=backupCount)
+        self.namer = _gzip_namer
+        self.rotator = _gzip_rotator
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Put records on a queue for a QueueListener to format and write.
+    Unlike QueueHandler, only the message itself is filled in here (the
+    args might change before the listener gets to it); timestamps,
+    tracebacks and the actual I/O are left for the listener thread.
+    '''
+    def prepare(self, record):
+        # other handlers might still want the original msg and args
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+_listener = None
+
+def debuglog_handler(filename, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                     rate_limit=None):
+    '''
+    Return a handler that writes to filename (rotating and compressing it
+    when it gets bigger than max_bytes) from a background thread. Call
+    log_flush() to wait for it to catch up, or log_shutdown() to stop it.
+    '''
+    global _listener
+    target = GzipRotatingFileHandler(filename, max_bytes, backups)
+    target.setFormatter(FedupFormatter(DEBUGLOG_FORMAT))
+    log_shutdown()
+    queue = Queue()
+    handler = BackgroundQueueHandler(queue)
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
+    _listener = logging.handlers.QueueListener(queue, target)
+    _listener.start()
+    return handler
+
+def log_flush():
+    '''Wait until everything queued for the debug log has been written.'''
+    if _listener is not None:
+        _listener.queue.join()
+
+def log_shutdown():
+    '''Write out whatever's queued for the debug log and stop the thread.'''
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for h in listener.handlers:
+            h.close()
+
+atexit.register(log_shutdown)
 
 def console_is_enabled_for(level):
     log = logging.getLogger("fedup2")
@@ -43,11 +166,15 @@ def console_is_enabled_for(level):
             return h.level <= level
     return False
 
-def log_setup(debug_log="/var/log/fedup2.log", console_level='WARNING'):
+def log_setup(debug_log="/var/log/fedup2.log", console_level='WARNING',
+              rate_limit=None):
     '''Set up logging:
         - Send copious debugging information to debug_log (/var/log/fedup2.log)
+          from a background thread, at most rate_limit debug messages per
+          second from each logger (if given)
         - Messages of console_level (WARNING) or higher go to the console
     '''
+    from dnf.logging import DDEBUG
     logging.config.dictConfig({
         'version':1,
         'loggers':{
@@ -62,10 +189,10 @@ def log_setup(debug_log="/var/log/fedup2.log", console_level='WARNING'):
         },
         'handlers':{
           'debuglog':{
-            'class':'logging.FileHandler',
+            '()':debuglog_handler,
             'level':DDEBUG,
-            'formatter':'debuglog',
             'filename':debug_log,
+            'rate_limit':rate_limit,
           },
           'console':{
             'class':'logging.StreamHandler',
@@ -74,11 +201,6 @@ def log_setup(debug_log="/var/log/fedup2.log", console_level='WARNING'):
           },
         },
         'formatters': {
-          'debuglog': {
-            '()':FedupFormatter,
-            'format':"[%(reltime)10.3f] %(levelsym)s %(name)s:%(funcName)s() "
-                     "%(message)s"
-          },
           'console':{
             'format':"%(name)s %(levelname)s: %(message)s"
           },
@@ -1,3 +1,5 @@
+import time
+import threading
 from subprocess import call
 
 __all__ = [
@@ -5,6 +7,8 @@ __all__ = [
 ]
 
 PLYMOUTH = '/usr/bin/plymouth'
+UPDATE_INTERVAL = 0.1 # minimum seconds between batches of plymouth updates
+FLUSH_TIMEOUT = 5.0
 
 def message(msg):
     return call([PLYMOUTH, "display-message", "--text", msg]) == 0
@@ -18,33 +22,101 @@ def set_mode(mode):
 def ping():
     return call([PLYMOUTH, "--ping"]) == 0
 
+# the order updates get sent in, if more than one is waiting
+_UPDATES = (('mode', set_mode), ('progress', progress), ('message', message))
+
 class _PlymouthOutput(object):
-    def __init__(self):
+    '''
+    Talks to plymouth from a background thread, so the caller (e.g. the
+    rpm transaction callback) never waits for it. Updates are sent at most
+    once per 'interval' seconds; if several come in meanwhile, only the
+    latest message/progress/mode gets sent. Use flush() to wait for
+    everything to be sent (e.g. before rebooting).
+
+    Creating one doesn't run plymouth; it gets pinged the first time
+    someone asks if it's alive, and after that 'alive' is the result of
+    the last command sent.
+    '''
+    def __init__(self, interval=UPDATE_INTERVAL):
         self.msg = ""
         self.mode = ""
         self.percent = -1
-        self.alive = ping()
+        self.interval = interval
+        self.sent = 0
+        self._pending = dict()
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._alive = None
+
+    @property
+    def alive(self):
+        if self._alive is None:
+            self._alive = ping()
+        return self._alive
 
     def ping(self):
-        self.alive = ping()
+        '''Is plymouth running? (Only pings it if we don't know yet.)'''
         return self.alive
 
+    def _queue(self, what, value):
+        with self._cond:
+            self._pending[what] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="plymouth")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                pending, self._pending = self._pending, dict()
+                self._busy = True
+            for what, send in _UPDATES:
+                if what in pending:
+                    self._alive = send(pending[what])
+                    self.sent += 1
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+            time.sleep(self.interval)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        '''Wait for the pending updates to be sent. Returns False if that
+           took longer than timeout seconds.'''
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
     def message(self, msg):
         if msg != self.msg:
-            self.alive = message(msg)
+            self._queue('message', msg)
             self.msg = msg
 
     def set_mode(self, mode):
         if mode != self.mode:
-            self.alive = set_mode(mode)
+            self._queue('mode', mode)
             self.mode = mode
 
     def progress(self, percent):
         if percent != self.percent:
-            self.alive = progress(percent)
+            self._queue('progress', percent)
             self.percent = percent
 
-_PlymouthSingleton = _PlymouthOutput()
+# created on first use, so just importing this doesn't run plymouth
+_PlymouthSingleton = None
 
 def PlymouthOutput():
+    global _PlymouthSingleton
+    if _PlymouthSingleton is None:
+        _PlymouthSingleton = _PlymouthOutput()
     return _PlymouthSingleton
@@ -0,0 +1,84 @@
+# prefetch.py - load repo metadata and the rpmdb at the same time
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+fill_sack() loads each repo's metadata one after another, and the rpmdb
+before all of them. Most of that time is spent waiting for the network,
+so we get it all going at once beforehand:
+
+    timings = prefetch(repos, load_repo, load_system)
+    base.fill_sack(...)
+
+load_repo(repo) is called for each repo, up to 'threads' at once, while
+load_system() runs in the calling thread. For DNF, load_repo downloads
+the metadata (repo.load()) and load_system loads the rpmdb into a
+throwaway sack, which writes the @System solv cache. fill_sack() then
+finds the metadata already downloaded and the rpmdb already converted.
+
+Decompressing the repo metadata and converting it to solv still happens
+in fill_sack(), one repo at a time: that's done by hawkey while it builds
+the sack, and it doesn't let go of the GIL while it works.
+
+Nothing here is required: errors are logged and otherwise ignored, and
+fill_sack() will try again and decide what to do about them.
+'''
+
+import time
+from multiprocessing.pool import ThreadPool
+
+import logging
+log = logging.getLogger("fedup2.prefetch")
+
+__all__ = ['prefetch', 'PREFETCH_THREADS']
+
+PREFETCH_THREADS = 8 # how many repos to fetch at once
+
+def _timed(func, *args):
+    '''Return how long func(*args) took, or None if it failed.'''
+    start = time.time()
+    try:
+        func(*args)
+    except Exception as e: # pylint: disable=broad-except
+        log.info("prefetch: %s", e)
+        return None
+    return time.time() - start
+
+def prefetch(repos, load_repo, load_system=None, threads=PREFETCH_THREADS):
+    '''
+    Call load_repo(repo) for each repo (up to 'threads' at once) and
+    load_system() (if given) at the same time. Returns a dict mapping each
+    repo id (and '@System') to how long it took, or None if it failed.
+    '''
+    repos = list(repos)
+    timings = dict()
+    pool = ThreadPool(max(1, min(len(repos), threads)))
+    try:
+        results = pool.map_async(lambda r: (r.id, _timed(load_repo, r)), repos)
+        if load_system is not None:
+            timings['@System'] = _timed(load_system)
+        timings.update(results.get())
+    finally:
+        pool.close()
+        pool.join()
+    for name, secs in sorted(timings.items()):
+        if secs is None:
+            log.info("%s: prefetch failed", name)
+        else:
+            log.info("%s: loaded in %.1fs", name, secs)
+    return timings
@@ -0,0 +1,190 @@
+# profiling.py - find out where the time and memory go
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Profiling for 'fedup2 --profile':
+
+    profiler = Profiler()
+    profiler.start()
+    timer.listeners.append(profiler.phase) # snapshot memory after each phase
+    ...
+    profiler.stop()
+    profiler.write("/var/log/fedup2.log")
+
+SamplingProfiler looks at the stack of every thread SAMPLE_INTERVAL
+seconds, and writes the counts in the "folded" format that flamegraph.pl
+(and speedscope, etc.) read:
+
+    thread:MainThread;main (cli.py:123);download (cli.py:456) 42
+
+MemoryTracker uses tracemalloc to record the Python heap (current, peak
+since the last phase, and the biggest allocation sites) at the end of
+each phase, along with the process's RSS. Memory that's in the RSS but
+not the Python heap belongs to C libraries (e.g. the hawkey sack or rpm).
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+
+import logging
+log = logging.getLogger("fedup2.profiling")
+
+__all__ = ['Profiler', 'SamplingProfiler', 'MemoryTracker', 'profile_files']
+
+SAMPLE_INTERVAL = 0.005 # seconds
+TOP_ALLOCATIONS = 10
+
+def profile_files(logfile):
+    '''Where to write (stack samples, memory snapshots), given the log path.'''
+    base = os.path.splitext(logfile)[0]
+    return base + '-profile.folded', base + '-memory.json'
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%u)" % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+class SamplingProfiler(object):
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = dict()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        '''Record the current stack of every thread (except this one).'''
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        me = threading.current_thread().ident
+        # pylint: disable=protected-access
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append("thread:%s" % names.get(ident, ident))
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def write(self, path):
+        with open(path, 'w') as outf:
+            for stack, count in sorted(self.stacks.items()):
+                outf.write("%s %u\n" % (stack, count))
+
+def _rss():
+    '''Return (current RSS, peak RSS) in bytes.'''
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as inf:
+            current = int(inf.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        current = None
+    return current, peak
+
+class MemoryTracker(object):
+    def __init__(self, top=TOP_ALLOCATIONS):
+        self.top = top
+        self.snapshots = []
+
+    def start(self):
+        import tracemalloc
+        tracemalloc.start()
+
+    def stop(self):
+        import tracemalloc
+        tracemalloc.stop()
+
+    def snapshot(self, phase):
+        '''Record the memory use at the end of phase.'''
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics('lineno')
+        if hasattr(tracemalloc, 'reset_peak'): # python 3.9+
+            tracemalloc.reset_peak()
+        rss, rss_peak = _rss()
+        self.snapshots.append(dict(
+            phase=phase,
+            time=time.time(),
+            python_current=current,
+            python_peak=peak,
+            rss=rss,
+            rss_peak=rss_peak,
+            top=[dict(where=str(s.traceback[0]), size=s.size, count=s.count)
+                 for s in stats[:self.top]],
+        ))
+        log.debug("memory after %s: python %u (peak %u), rss %s (peak %u)",
+                  phase, current, peak, rss, rss_peak)
+
+    def write(self, path):
+        with open(path, 'w') as outf:
+            json.dump(self.snapshots, outf, indent=2, sort_keys=True)
+            outf.write('\n')
+
+class Profiler(object):
+    '''A SamplingProfiler and a MemoryTracker, together.'''
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.sampler = SamplingProfiler(interval)
+        self.memory = MemoryTracker()
+
+    def start(self):
+        self.memory.start()
+        self.memory.snapshot("start")
+        self.sampler.start()
+
+    def phase(self, name, seconds=None):
+        '''Call at the end of each phase (e.g. as a PhaseTimer listener).'''
+        self.memory.snapshot(name)
+
+    def stop(self):
+        self.sampler.stop()
+        self.memory.snapshot("end")
+        self.memory.stop()
+
+    def write(self, logfile):
+        folded, memory = profile_files(logfile)
+        self.sampler.write(folded)
+        self.memory.write(memory)
+        log.info("wrote %u profile samples to %s and %u memory snapshots "
+                 "to %s", self.sampler.samples, folded,
+                 len(self.memory.snapshots), memory)
@@ -0,0 +1,136 @@
+# progress.py - progress bars that don't slow down the thing they measure
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Depsolving, downloading and the transaction all want to update a progress
+bar for every package, and on a slow serial console or ssh session the
+terminal writes can take longer than the work. So they all go through a
+ProgressRenderer, which draws at most 'fps' times per second:
+
+    renderer = ProgressRenderer()
+    for n, pkg in enumerate(pkgs, 1):
+        renderer.update(n, len(pkgs), "doing stuff")
+    renderer.finish()
+
+If stdout isn't a terminal, only the final state gets drawn. The final
+state (count == total) is always drawn; finish() draws the last update
+if it was skipped (e.g. the count never reached the total).
+
+DownloadMeter adapts a ProgressRenderer to the progress-meter interface
+the Downloader and DNF use for downloads.
+'''
+
+import sys
+import time
+import logging
+
+from .format import format_number
+from .i18n import _
+
+__all__ = ['ProgressRenderer', 'DownloadMeter']
+
+log = logging.getLogger("fedup2.progress")
+
+# same value as dnf.callback.STATUS_OK
+STATUS_OK = None
+
+MAX_FPS = 10
+
+def _progressbar(count, total, name=None):
+    from dnf.cli.output import progressbar
+    progressbar(count, total, name)
+
+class ProgressRenderer(object):
+    def __init__(self, draw=_progressbar, fps=MAX_FPS, isatty=None,
+                 clock=time.time):
+        if isatty is None:
+            isatty = sys.stdout.isatty()
+        self.draw = draw
+        self.interval = 1.0 / fps
+        self.isatty = isatty
+        self.draws = 0
+        self._clock = clock
+        self._last = None
+        self._lastdraw = None
+        self._pending = None
+
+    def update(self, count, total, name=None):
+        '''Draw the progress bar, unless we drew it very recently.'''
+        final = total is not None and count >= total
+        now = self._clock()
+        if final or (self.isatty and (self._lastdraw is None or
+                                      now - self._lastdraw >= self.interval)):
+            self._draw(now, (count, total, name))
+        else:
+            self._pending = (count, total, name)
+
+    def finish(self):
+        '''Draw the last update, if it hasn't been drawn.'''
+        if self._pending is not None:
+            self._draw(self._clock(), self._pending)
+
+    def _draw(self, now, args):
+        if args == self._last:
+            return
+        self.draw(*args)
+        self.draws += 1
+        self._last, self._lastdraw, self._pending = args, now, None
+
+class DownloadMeter(object):
+    '''
+    A progress meter for downloads (like dnf's MultiFileProgressMeter),
+    drawn with a ProgressRenderer: it counts finished files, and shows
+    how many bytes have been downloaded. Failed downloads don't count as
+    done; they're logged, and counted in 'failed_files'.
+    '''
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.total_files = 0
+        self.total_size = 0
+        self.done_files = 0
+        self.failed_files = 0
+        self._done = dict()
+        self._finished = 0
+
+    def start(self, total_files, total_size):
+        self.total_files, self.total_size = total_files, total_size
+        self.done_files = self.failed_files = self._finished = 0
+        self._done = dict()
+
+    def _update(self):
+        done = self._finished + sum(self._done.values())
+        name = _("downloading (%s/%s)") % (format_number(done),
+                                          format_number(self.total_size))
+        if self.failed_files:
+            name += _(", %d failed") % self.failed_files
+        self.renderer.update(self.done_files, self.total_files, name)
+
+    def progress(self, payload, done):
+        self._done[payload] = done
+        self._update()
+
+    def end(self, payload, status, msg):
+        self._done.pop(payload, None)
+        if status == STATUS_OK:
+            self._finished += payload.download_size
+            self.done_files += 1
+        else:
+            log.warning("[FAILED] %s: %s", payload, msg)
+            self.failed_files += 1
+        self._update()
@@ -0,0 +1,139 @@
+# ratelimit.py - download bandwidth limits and schedules
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Bandwidth limits for the downloader.
+
+Rates are given like "500k" or "2M" (bytes/sec; k/M/G are powers of 1024),
+and "0" means unlimited. A schedule is a comma-separated list of time
+windows with their own rate, e.g.:
+
+    sched = RateSchedule("2M", "01:00-05:00=0,12:00-13:00=500k")
+
+means "unlimited from 1am to 5am, 500k/s over lunch, 2M/s otherwise".
+Windows can wrap around midnight ("22:00-06:00=0").
+
+A RateLimiter is shared by all the download threads; each one calls
+limiter.consume(nbytes) after reading some data, which sleeps as long as
+needed to keep the total under the current limit.
+
+Only fedup2's own downloader is limited; metadata and any packages that
+are left to DNF (see DNFWrapper._repo_urls) are downloaded at full speed.
+'''
+
+import math
+import time
+import threading
+
+__all__ = ['parse_rate', 'parse_schedule', 'RateSchedule', 'RateLimiter']
+
+_SUFFIXES = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+def parse_rate(ratestr):
+    '''Parse a rate like "2M" into bytes/sec. Raises ValueError if invalid.'''
+    ratestr = ratestr.strip().lower()
+    if ratestr.endswith('b'):
+        ratestr = ratestr[:-1]
+    num, suffix = ratestr, ''
+    if ratestr and ratestr[-1] in _SUFFIXES:
+        num, suffix = ratestr[:-1], ratestr[-1]
+    rate = float(num) * _SUFFIXES[suffix]
+    if math.isinf(rate) or math.isnan(rate):
+        raise ValueError("rate must be a finite number")
+    if rate < 0:
+        raise ValueError("rate can't be negative")
+    if 0 < rate < 1:
+        # int() would make it 0, which means "no limit"
+        raise ValueError("rate must be 0 or at least 1 byte/sec")
+    return int(rate)
+
+def _parse_time(timestr):
+    hour, minute = timestr.strip().split(':')
+    hour, minute = int(hour), int(minute)
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError("invalid time %r" % timestr)
+    return hour*60 + minute
+
+def parse_schedule(schedstr):
+    '''
+    Parse a schedule like "01:00-05:00=0,12:00-13:00=500k" into a list of
+    (start_minute, end_minute, rate) tuples. Raises ValueError if invalid.
+    '''
+    windows = []
+    for item in (schedstr or '').split(','):
+        if not item.strip():
+            continue
+        times, rate = item.split('=')
+        start, end = times.split('-')
+        windows.append((_parse_time(start), _parse_time(end), parse_rate(rate)))
+    return windows
+
+class RateSchedule(object):
+    '''A default rate limit, plus time windows with different limits.'''
+    def __init__(self, default=None, schedule=None):
+        self.default = parse_rate(default) if default else 0
+        self.windows = parse_schedule(schedule)
+
+    def rate_at(self, when=None):
+        '''The rate limit (bytes/sec, 0 = unlimited) at the given time.'''
+        t = time.localtime(when)
+        minute = t.tm_hour*60 + t.tm_min
+        for start, end, rate in self.windows:
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+            if inside:
+                return rate
+        return self.default
+
+    def __bool__(self):
+        return bool(self.default or self.windows)
+    __nonzero__ = __bool__
+
+class RateLimiter(object):
+    '''
+    A token bucket shared between threads. 'rate' is a function that
+    returns the current limit in bytes/sec (or 0 for no limit).
+    'burst' is how many seconds' worth of data can be sent at full speed.
+    '''
+    def __init__(self, rate, burst=1.0, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = 0.0
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self._lock:
+            now = self._clock()
+            rate = self.rate()
+            if not rate:
+                self._tokens, self._last = 0.0, now
+                return 0.0
+            self._tokens += (now - self._last) * rate
+            self._tokens = min(self._tokens, rate * self.burst)
+            self._tokens -= nbytes
+            self._last = now
+            delay = -self._tokens / rate if self._tokens < 0 else 0.0
+        if delay:
+            self._sleep(delay)
+        return delay
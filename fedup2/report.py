@@ -0,0 +1,160 @@
+# report.py - how long each package took during the upgrade
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Keep track of how long each transaction element takes during the offline
+upgrade, so we can figure out where the time goes:
+
+    timer = TransactionTimer()
+    # in the transaction display's event() and filelog():
+    timer.event("foo-1.1-1.x86_64", INSTALL, te_cur, te_total)
+    timer.finished("foo-1.1-1.x86_64", INSTALL)
+    # after the transaction:
+    timer.finish()
+    timer.write(packages_file("/var/log/fedup2.log"))
+
+rpm only tells us so much, so the phases are approximate:
+
+  - unpack: from the first progress event for a package until it's 100%
+  - scriptlets: from then until rpm closes the package (%pre, %post)
+  - cleanup: removing the old packages (including their scriptlets)
+  - triggers: time between elements, and after the last one, when rpm is
+    running triggers (and %pretrans/%posttrans)
+
+Each element is a line in a CSV file; summarize() reads it back for
+'fedup2 report'.
+'''
+
+import os
+import csv
+import time
+
+import logging
+log = logging.getLogger("fedup2.report")
+
+__all__ = ['TransactionTimer', 'read_timing', 'summarize', 'packages_file',
+           'INSTALL', 'CLEANUP', 'PHASES']
+
+INSTALL = 'install'
+CLEANUP = 'cleanup'
+TRIGGERS = 'triggers' # the action for the time after the last element
+PHASES = ('unpack', 'scriptlets', 'cleanup', 'triggers')
+FIELDS = ('package', 'action', 'size', 'start') + PHASES
+
+def packages_file(logfile):
+    '''Where to write the per-package timing, given the path of the log.'''
+    return os.path.splitext(logfile)[0] + '-packages.csv'
+
+class _Element(object):
+    def __init__(self, package, action, size, start, gap):
+        self.package = package
+        self.action = action
+        self.size = size
+        self.start = start
+        self.gap = gap
+        self.unpacked = None
+        self.end = None
+
+    def row(self):
+        end = self.end if self.end is not None else self.start
+        unpacked = self.unpacked if self.unpacked is not None else end
+        times = dict.fromkeys(PHASES, 0.0)
+        times['triggers'] = self.gap
+        if self.action == CLEANUP:
+            times['cleanup'] = end - self.start
+        else:
+            times['unpack'] = unpacked - self.start
+            times['scriptlets'] = end - unpacked
+        return [self.package, self.action, self.size, "%.3f" % self.start] + \
+               ["%.3f" % times[p] for p in PHASES]
+
+class TransactionTimer(object):
+    def __init__(self, clock=time.time):
+        self.elements = []
+        self._clock = clock
+        self._current = None
+        self._last_end = None
+
+    def _close(self, now):
+        cur, self._current = self._current, None
+        if cur is not None:
+            if cur.end is None:
+                cur.end = now
+            self._last_end = cur.end
+
+    def event(self, package, action, done, total):
+        '''A progress event for a transaction element.'''
+        now = self._clock()
+        cur = self._current
+        if cur is None or (cur.package, cur.action) != (package, action):
+            self._close(now)
+            gap = now - self._last_end if self._last_end is not None else 0.0
+            cur = _Element(package, action, total, now, gap)
+            self.elements.append(cur)
+            self._current = cur
+        if cur.unpacked is None and done >= total:
+            cur.unpacked = now
+
+    def finished(self, package, action):
+        '''rpm is done with the element (e.g. it closed the package file).'''
+        cur = self._current
+        if cur is not None and (cur.package, cur.action) == (package, action):
+            cur.end = self._clock()
+            self._close(cur.end)
+
+    def finish(self):
+        '''The transaction is over; count the time since the last element.'''
+        now = self._clock()
+        self._close(now)
+        if self._last_end is not None:
+            self.elements.append(_Element('', TRIGGERS, 0, now,
+                                          now - self._last_end))
+            self._last_end = now
+
+    def write(self, path):
+        with open(path, 'w') as outf:
+            writer = csv.writer(outf)
+            writer.writerow(FIELDS)
+            for e in self.elements:
+                writer.writerow(e.row())
+        log.info("wrote timing for %u transaction elements to %s",
+                 len(self.elements), path)
+
+def read_timing(path):
+    '''Read the file written by TransactionTimer.write() into a list of
+       dicts, with the times as floats.'''
+    rows = []
+    with open(path) as inf:
+        for row in csv.DictReader(inf):
+            for p in PHASES:
+                row[p] = float(row[p])
+            row['size'] = int(row['size'])
+            row['total'] = sum(row[p] for p in PHASES)
+            rows.append(row)
+    return rows
+
+def summarize(rows, top=10):
+    '''
+    Return (phases, slowest): phases is a list of (phase, seconds)
+    totals, and slowest is the 'top' slowest elements.
+    '''
+    phases = [(p, sum(r[p] for r in rows)) for p in PHASES]
+    elements = [r for r in rows if r['package']]
+    slowest = sorted(elements, key=lambda r: r['total'], reverse=True)[:top]
+    return phases, slowest
@@ -0,0 +1,123 @@
+# savedtrans.py - save the upgrade transaction for the offline upgrade
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Depsolving the upgrade takes a long time, and we already did it once
+when we downloaded the packages. So at the end of the download we save
+the resolved transaction into datadir:
+
+    write_transaction(path, items, cachedir, repoids)
+
+Each item is a dict like:
+
+    {"action": "upgrade", "nevra": "foo-1.1-1.x86_64",
+     "path": "/var/cache/system-upgrade/foo-1.1-1.x86_64.rpm",
+     "checksum": "sha256:...", "replaces": ["foo-1.0-1.x86_64"],
+     "reason": "user"}
+
+The file also holds a fingerprint of the rpmdb and the repo metadata we
+used. During the upgrade, read_transaction() checks that fingerprint
+again; if anything has changed (someone installed a package, refreshed
+the metadata...) it returns None and we have to resolve it all again.
+
+The dnf plugin (plugins/fedup2.py) uses this module too, so it needs to
+keep working on python 2.
+'''
+
+import os
+import json
+import hashlib
+
+import logging
+log = logging.getLogger("fedup2.savedtrans")
+
+__all__ = ['fingerprint', 'write_transaction', 'read_transaction',
+           'TRANSFILE', 'RPMDB']
+
+TRANSFILE = 'upgrade.transaction'
+RPMDB = '/var/lib/rpm'
+# the files that change when the rpmdb does (old BDB or new sqlite rpmdb)
+_RPMDB_FILES = ('Packages', 'rpmdb.sqlite')
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as inf:
+            for block in iter(lambda: inf.read(64*1024), b''):
+                h.update(block)
+    except (IOError, OSError):
+        return 'missing'
+    return h.hexdigest()
+
+def _mtime_ns(st):
+    # st_mtime_ns is python 3.3+; the dnf plugin might be running on python 2
+    return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1e9)
+
+def fingerprint(cachedir, repoids, rpmdb=RPMDB):
+    '''
+    Return a digest that changes if the rpmdb or the cached metadata for
+    any of the repos in repoids changes.
+    '''
+    h = hashlib.sha256()
+    for name in _RPMDB_FILES:
+        try:
+            st = os.stat(os.path.join(rpmdb, name))
+            h.update(("%s %u %u\n" % (name, st.st_size,
+                                      _mtime_ns(st))).encode('utf-8'))
+        except OSError:
+            pass
+    for repoid in sorted(repoids):
+        repomd = os.path.join(cachedir, repoid, 'repodata', 'repomd.xml')
+        h.update(("%s %s\n" % (repoid, _file_digest(repomd))).encode('utf-8'))
+    return h.hexdigest()
+
+def write_transaction(path, items, cachedir, repoids, rpmdb=RPMDB):
+    '''Save the transaction items, along with the current fingerprint.'''
+    data = {
+        "cachedir": cachedir,
+        "repos": sorted(repoids),
+        "fingerprint": fingerprint(cachedir, repoids, rpmdb),
+        "items": list(items),
+    }
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as outf:
+        json.dump(data, outf)
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.rename(tmpfile, path)
+    log.info("saved transaction with %u items", len(data["items"]))
+
+def read_transaction(path, rpmdb=RPMDB):
+    '''
+    Return the saved transaction items from path, or None if there aren't
+    any or the system/metadata has changed since they were saved.
+    '''
+    try:
+        with open(path) as inf:
+            data = json.load(inf)
+        saved = data["fingerprint"]
+        current = fingerprint(data["cachedir"], data["repos"], rpmdb)
+        items = data["items"]
+    except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+        log.info("no usable saved transaction: %s", e)
+        return None
+    if saved != current:
+        log.info("rpmdb or metadata changed; ignoring saved transaction")
+        return None
+    return items
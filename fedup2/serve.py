@@ -0,0 +1,193 @@
+# serve.py - share downloaded packages with other hosts
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+A tiny read-only HTTP server for the packages in datadir, so other hosts
+upgrading to the same release can use this one as a peer:
+
+    server = PeerServer(datadir, state.read_checksums(), ('0.0.0.0', 8873))
+    drop_privileges()
+    server.serve_forever()
+
+By default the server only listens on localhost; other hosts can only
+reach it if it's given an address to bind to. Once it's listening,
+drop_privileges() switches to an unprivileged user ('nobody'), which
+needs to be able to read the packages in datadir.
+
+Only verified packages (the ones in 'files') are served; partial downloads
+and anything else in datadir are not. GET /package.list gets the list of
+files with their checksums, in the same format as datadir/package.list.
+Simple Range requests are supported, so peers can resume downloads too.
+
+Clients should never trust a peer: they must check what they get against
+their own repo metadata (the downloader does this).
+'''
+
+import os
+import shutil
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+import logging
+log = logging.getLogger("fedup2.serve")
+
+__all__ = ['PeerServer', 'drop_privileges', 'DEFAULT_PORT', 'DEFAULT_BIND']
+
+DEFAULT_PORT = 8873
+DEFAULT_BIND = '127.0.0.1'
+SERVE_USER = 'nobody'
+PACKAGELIST = 'package.list'
+
+def parse_range(header, size):
+    '''
+    Parse a single "bytes=first-[last]" Range header.
+    Returns (first, last), or None if it's missing/unsupported/unsatisfiable.
+    '''
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    try:
+        first, last = header[len('bytes='):].split('-')
+        first = int(first)
+        last = int(last) if last else size-1
+    except ValueError:
+        return None
+    if first > last or first >= size:
+        return None
+    return first, min(last, size-1)
+
+class PeerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args): # pylint: disable=arguments-differ
+        log.debug("%s %s", self.address_string(), fmt % args)
+
+    def _error(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_packagelist(self, head):
+        data = ''.join("%s %s\n" % item
+                       for item in sorted(self.server.files.items()))
+        data = data.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def _send_file(self, relpath, head):
+        path = os.path.join(self.server.datadir, relpath)
+        try:
+            inf = open(path, 'rb')
+        except (IOError, OSError):
+            return self._error(404)
+        with inf:
+            size = os.fstat(inf.fileno()).st_size
+            rng = None
+            if self.headers.get('Range'):
+                rng = parse_range(self.headers.get('Range'), size)
+                if rng is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%u' % size)
+                    self.send_header('Content-Length', '0')
+                    return self.end_headers()
+            if rng:
+                first, last = rng
+                self.send_response(206)
+                self.send_header('Content-Range',
+                                 'bytes %u-%u/%u' % (first, last, size))
+            else:
+                first, last = 0, size-1
+                self.send_response(200)
+            length = last - first + 1
+            self.send_header('Content-Type', 'application/x-rpm')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if not head:
+                inf.seek(first)
+                shutil.copyfileobj(_Limited(inf, length), self.wfile)
+
+    def _handle(self, head=False):
+        relpath = unquote(self.path.split('?', 1)[0]).lstrip('/')
+        if relpath == PACKAGELIST:
+            self._send_packagelist(head)
+        elif relpath in self.server.files:
+            self._send_file(relpath, head)
+        else:
+            self._error(404)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle(head=True)
+
+class _Limited(object):
+    '''File-like wrapper that only reads 'length' bytes.'''
+    def __init__(self, fobj, length):
+        self.fobj = fobj
+        self.left = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.left:
+            size = self.left
+        data = self.fobj.read(size)
+        self.left -= len(data)
+        return data
+
+class PeerServer(ThreadingMixIn, HTTPServer):
+    '''
+    Serve the files in datadir. 'files' is a dict mapping absolute paths
+    to checksums, like State.read_checksums() returns.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, datadir, files, address=(DEFAULT_BIND, DEFAULT_PORT)):
+        self.datadir = datadir
+        self.files = dict((os.path.relpath(p, datadir), c)
+                          for p, c in files.items())
+        HTTPServer.__init__(self, address, PeerRequestHandler)
+        log.info("serving %u files from %s on port %u",
+                 len(self.files), datadir, self.server_port)
+
+def drop_privileges(user=SERVE_USER):
+    '''
+    If we're running as root, switch to 'user' (and its group) for good.
+    Returns True if we did.
+    '''
+    if os.getuid() != 0:
+        return False
+    import pwd
+    pw = pwd.getpwnam(user)
+    os.setgroups([])
+    os.setgid(pw.pw_gid)
+    os.setuid(pw.pw_uid)
+    log.info("dropped privileges; now running as %s", user)
+    return True
@@ -17,13 +17,15 @@
 #
 # Author: Will Woods <wwoods@redhat.com>
 
-# pylint: disable=wildcard-import,unused-wildcard-import
-
+import io
 import os
+import json
+import time
+import shutil
 try:
-    from configparser import *
+    from configparser import RawConfigParser
 except ImportError:
-    from ConfigParser import *
+    from ConfigParser import RawConfigParser
 
 import shlex
 try:
@@ -32,9 +34,10 @@ except ImportError:
     from pipes import quote as _quote
 
 from .i18n import _
+from .verify import MANIFEST
+from .lock import lock
 
-from dnf.cli.format import format_number
-from dnf.util import ensure_dir
+from .format import format_number, format_time
 
 import logging
 log = logging.getLogger("fedup2.state")
@@ -42,6 +45,13 @@ log = logging.getLogger("fedup2.state")
 __all__ = ['State']
 
 PACKAGELIST = 'package.list'
+LOCK_LOG_SECONDS = 0.1 # log waits for the state lock longer than this
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
 
 def shelljoin(argv):
     return ' '.join(_quote(a) for a in argv)
@@ -65,58 +75,195 @@ def _configprop(section, option, encode=None, decode=None, doc=None):
     return property(getprop, setprop, delprop, doc)
 
 class State(object):
+    '''
+    The upgrade state, kept in statefile as a journal: each line is a JSON
+    object holding the changes made by one commit, like:
+
+        {"download": {"pkgs_total": "17", "cmdline": null}}
+
+    where null means the option was deleted. Lines are only ever appended
+    (and fsync'd), so a reader sees either all of a commit or none of it;
+    a torn last line is ignored. Once the journal gets long, it's replaced
+    with a single snapshot line (written to a temp file and renamed).
+
+    Changes made inside a 'with state:' block are committed together when
+    the outermost block ends. Old INI-style state files are read and get
+    converted at the next commit.
+
+    Readers take a shared lock on statefile and writers take an exclusive
+    one, so other processes (like 'fedup2 status') can read the state while
+    a download is running. Before committing, a writer reads anything other
+    processes have appended since it last looked, so their changes aren't
+    lost when the journal gets compacted.
+    '''
     statefile = '/var/lib/system-upgrade/upgrade.state'
+    compact_lines = 100
     def __init__(self):
-        self._conf = RawConfigParser()
-        self._conf.read(self.statefile)
+        self._data = dict()
+        self._changes = dict()
+        self._cleared = False
+        self._file_id = None
+        self._offset = 0
+        self._lines = 0
+        self._rewrite = False
+        self._depth = 0
+        self._read()
         self.args = None
 
-    def _get(self, section, option):
+    def _open_locked(self, mode, share):
+        '''Open statefile and lock it, making sure it's still the statefile
+           once we have the lock (compacting the journal replaces it).'''
+        while True:
+            fobj = open(self.statefile, mode)
+            lock(fobj, block=True, share=share)
+            if os.fstat(fobj.fileno()).st_ino == _inode(self.statefile):
+                return fobj
+            fobj.close()
+
+    def _read(self):
         try:
-            return self._conf.get(section, option)
-        except (NoSectionError, NoOptionError):
-            return None
+            inf = self._open_locked('rb', share=True)
+        except (IOError, OSError):
+            return
+        with inf:
+            self._load(inf)
+
+    def _load(self, inf):
+        '''Apply whatever has been added to the (locked) file inf since we
+           last read it.'''
+        st = os.fstat(inf.fileno())
+        if (st.st_dev, st.st_ino) != self._file_id:
+            # it's been replaced; start over
+            self._file_id = (st.st_dev, st.st_ino)
+            self._data, self._offset, self._lines = dict(), 0, 0
+        inf.seek(self._offset)
+        data = inf.read()
+        if not self._offset and data.lstrip().startswith(b'['):
+            self._offset = len(data)
+            self._read_ini(data)
+            return
+        for line in data.splitlines(True):
+            if not line.endswith(b'\n'):
+                log.info("ignoring incomplete commit in %s", self.statefile)
+                self._rewrite = True
+                break
+            self._offset += len(line)
+            self._lines += 1
+            try:
+                self._apply(json.loads(line.decode('utf-8')))
+            except ValueError:
+                log.warning("ignoring bad line in %s", self.statefile)
+                self._rewrite = True
+
+    def _read_ini(self, data):
+        # parse what we already read: opening statefile again (and closing
+        # it) would drop our lock on it, since lockf() locks are per-process
+        conf = RawConfigParser()
+        text = data.decode('utf-8')
+        if hasattr(conf, 'read_string'):
+            conf.read_string(text)
+        else:
+            conf.readfp(io.StringIO(text))
+        for section in conf.sections():
+            self._data[section] = dict(conf.items(section))
+        log.debug("read old-style state file; will convert it")
+        self._rewrite = True
+
+    def _apply(self, changes):
+        for section, options in changes.items():
+            for option, value in options.items():
+                if value is None:
+                    self._data.get(section, {}).pop(option, None)
+                else:
+                    self._data.setdefault(section, {})[option] = value
+
+    def _get(self, section, option):
+        return self._data.get(section, {}).get(option)
 
     def _set(self, section, option, value):
         if value is None: # ...probably need a broader check here
             raise TypeError('expected string, got %r' % type(value).__name__)
-        try:
-            self._conf.add_section(section)
-        except DuplicateSectionError:
-            pass
-        self._conf.set(section, option, value)
+        value = str(value)
+        self._data.setdefault(section, {})[option] = value
+        self._changes.setdefault(section, {})[option] = value
         log.debug("set %s.%s=%s", section, option, value)
 
     def _del(self, section, option):
-        try:
-            self._conf.remove_option(section, option)
+        if option in self._data.get(section, {}):
+            del self._data[section][option]
+            self._changes.setdefault(section, {})[option] = None
             log.debug("del %s.%s", section, option)
-        except NoSectionError:
-            pass
 
     def _items(self, section):
-        try:
-            return self._conf.items(section)
-        except NoSectionError:
-            return []
+        return sorted(self._data.get(section, {}).items())
+
+    def _snapshot(self):
+        '''Replace the journal with a single line holding all the data.
+           The caller should have statefile locked.'''
+        data = dict((s, o) for s, o in self._data.items() if o)
+        tmpfile = self.statefile + '.tmp'
+        with open(tmpfile, 'wb') as outf:
+            if data:
+                outf.write((json.dumps(data, sort_keys=True) + '\n')
+                           .encode('utf-8'))
+            outf.flush()
+            os.fsync(outf.fileno())
+            st = os.fstat(outf.fileno())
+        os.rename(tmpfile, self.statefile)
+        self._file_id = (st.st_dev, st.st_ino)
+        self._offset = st.st_size
+        self._lines = 1 if data else 0
+        self._rewrite = False
+
+    def _append(self, outf, changes):
+        line = (json.dumps(changes, sort_keys=True) + '\n').encode('utf-8')
+        outf.write(line)
+        outf.flush()
+        os.fsync(outf.fileno())
+        self._offset += len(line)
+        self._lines += 1
 
     def write(self):
+        '''Commit the changes made since the last write().'''
+        if not (self._changes or self._rewrite):
+            return
+        from dnf.util import ensure_dir
         ensure_dir(os.path.dirname(self.statefile))
-        with open(self.statefile, 'w') as outf:
-            self._conf.write(outf)
+        start = time.time()
+        with self._open_locked('a+b', share=False) as outf:
+            waited = time.time() - start
+            # catch up with other writers, then put our changes on top
+            changes = self._changes
+            self._load(outf)
+            if self._cleared:
+                self._data = dict()
+            self._apply(changes)
+            if self._rewrite or self._lines >= self.compact_lines:
+                self._snapshot()
+            else:
+                self._append(outf, changes)
+        if waited > LOCK_LOG_SECONDS:
+            log.info("waited %.3fs to lock %s", waited, self.statefile)
+        self._changes = dict()
+        self._cleared = False
 
     def clear(self):
         persist = self._items("persist")
-        self._conf = RawConfigParser()
+        self._data = dict()
+        self._changes = dict()
+        self._cleared = True
+        self._rewrite = True
         log.debug("cleared all data")
         for name, val in persist:
             self._set("persist", name, val)
 
     def __enter__(self):
+        self._depth += 1
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if exc_type is None:
+        self._depth -= 1
+        if exc_type is None and self._depth == 0:
             self.write()
 
     # system info
@@ -131,10 +278,20 @@ class State(object):
     # persistent stuff that we should keep after a cancel
     datadir = _configprop("persist", "datadir")
     cachedir = _configprop("persist", "cachedir")
+    previous_datadir = _configprop("persist", "previous_datadir")
 
     # info about the download process
     pkgs_total = _configprop("download", "pkgs_total")
     size_total = _configprop("download", "size_total")
+    manifest_digest = _configprop("download", "manifest")
+    max_rate = _configprop("download", "max_rate")
+    rate_schedule = _configprop("download", "rate_schedule")
+    measured_rate = _configprop("download", "measured_rate")
+    # running totals, kept up to date by the DownloadLedger
+    pkgs_done = _configprop("download", "pkgs_done")
+    size_done = _configprop("download", "size_done")
+    current_rate = _configprop("download", "current_rate")
+    progress_time = _configprop("download", "progress_time")
     cmdline = _configprop("download", "cmdline",
                           encode=shelljoin,
                           decode=shellsplit)
@@ -145,35 +302,95 @@ class State(object):
             raise TypeError("datadir is not set")
         return os.path.join(self.datadir, PACKAGELIST)
 
-    def read_packagelist(self):
+    def _read_packagelist_lines(self):
         try:
             with open(self.packagelist) as listf:
-                return [os.path.join(self.datadir, p.strip()) for p in listf]
+                return [l.split() for l in listf if l.strip()]
         except (TypeError, IOError, OSError):
             return []
 
-    def write_packagelist(self, pkgs):
+    def read_packagelist(self):
+        return [os.path.join(self.datadir, l[0])
+                for l in self._read_packagelist_lines()]
+
+    def read_checksums(self):
+        '''Return a dict mapping each package path to its verified checksum
+           (a "<type>:<hexdigest>" string), for packages that have one.'''
+        return dict((os.path.join(self.datadir, l[0]), l[1])
+                    for l in self._read_packagelist_lines() if len(l) > 1)
+
+    def write_packagelist(self, pkgs, checksums=None):
+        '''
+        Write the list of package paths to package.list.
+        If checksums (a dict like the one from read_checksums) has an entry
+        for a package, it gets written next to it, meaning that the file
+        has been downloaded and verified.
+        '''
+        checksums = checksums or {}
         with open(self.packagelist, 'w') as outf:
-            outf.writelines(os.path.relpath(p, self.datadir)+'\n' for p in pkgs)
+            for p in pkgs:
+                line = os.path.relpath(p, self.datadir)
+                if p in checksums:
+                    line += ' ' + checksums[p]
+                outf.write(line+'\n')
+
+    def unverified_packages(self):
+        '''Return the packages in package.list that are missing or haven't
+           been verified.'''
+        checksums = self.read_checksums()
+        return [p for p in self.read_packagelist()
+                if p not in checksums or not os.path.exists(p)]
 
     def clean_datadir(self):
+        from .downloader import staging_files
+        from .localrepo import REPODATA
         keepfiles = set(self.read_packagelist())
+        # keep partial downloads around so they can be resumed
+        for p in list(keepfiles):
+            keepfiles.update(staging_files(p))
         keepfiles.add(self.packagelist)
+        keepfiles.add(os.path.join(self.datadir, MANIFEST))
         for f in os.listdir(self.datadir):
             fullpath = os.path.join(self.datadir, f)
-            if fullpath not in keepfiles:
+            if f == REPODATA:
+                # the local repo gets rebuilt after the download
+                log.info("removing local repo from datadir")
+                shutil.rmtree(fullpath)
+            elif fullpath not in keepfiles:
                 log.info("removing %s from datadir", f)
                 os.unlink(fullpath)
 
-    def get_size_local(self):
-        '''Return the total size (in bytes) of the packages in packagelist that
-           are present in datadir, or None if there's no packagelist.
-           You can get the download progress percentage with:
-             100.0 * state.size_total / state.get_size_local()
-        '''
-        pkglist = self.read_packagelist()
-        if pkglist:
-            return sum(os.stat(f).st_size for f in pkglist if os.path.exists(f))
+    def rescan(self):
+        '''Recount the downloaded packages by looking at datadir, rather
+           than trusting pkgs_done/size_done. This reads package.list and
+           stats every package, so only do it if asked.
+           The checksums in package.list only get written when a download
+           run ends, so while one is running this undercounts.'''
+        unverified = set(self.unverified_packages())
+        done = [p for p in self.read_packagelist() if p not in unverified]
+        self.pkgs_done = len(done)
+        self.size_done = sum(os.stat(p).st_size for p in done)
+
+    def progress(self):
+        '''Return a dict describing the upgrade and the download progress.
+           Missing values are None; eta is in seconds.'''
+        def num(value):
+            return int(value) if value is not None else None
+        info = dict(target=self.upgrade_target,
+                    ready=bool(self.upgrade_ready),
+                    pkgs_total=num(self.pkgs_total),
+                    pkgs_done=num(self.pkgs_done),
+                    size_total=num(self.size_total),
+                    size_done=num(self.size_done),
+                    rate=num(self.current_rate),
+                    updated=num(self.progress_time),
+                    eta=None)
+        if info['ready']:
+            info['eta'] = 0
+        elif info['rate'] and info['size_total'] is not None:
+            left = max(info['size_total'] - (info['size_done'] or 0), 0)
+            info['eta'] = left // info['rate']
+        return info
 
     def summarize(self):
         if not self.upgrade_target:
@@ -186,14 +403,26 @@ class State(object):
                 _("Use 'fedup2 resume' to resume downloading."),
                 _("Use 'fedup2 cancel' to cancel the upgrade."),
             ]
-            localdata = self.get_size_local()
-            if localdata:
-                total = int(self.size_total)
+            info = self.progress()
+            localdata, total = info['size_done'], info['size_total']
+            if localdata and total:
                 pct = 100.0*localdata/total
                 msg[0] = _("Download of %s is %.1f%% complete (%s/%s)") % (
                     self.upgrade_target, pct,
                     format_number(localdata), format_number(total)
                 )
+            details = []
+            if info['pkgs_done'] is not None and info['pkgs_total']:
+                details.append(_("%u of %u packages downloaded") % (
+                    info['pkgs_done'], info['pkgs_total']))
+            if info['eta']:
+                details.append(_("About %s left at %s/s") % (
+                    format_time(info['eta'], True),
+                    format_number(info['rate'])))
+            msg[1:1] = details
+            if self.measured_rate:
+                msg.append(_("Last download speed: %s/s") %
+                           format_number(int(self.measured_rate)))
         else:
             msg = [
                 _("Ready for upgrade to %s.") % self.upgrade_target,
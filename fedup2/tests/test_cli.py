@@ -0,0 +1,57 @@
+# test_cli.py - tests for the fedup2 command-line parser
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+
+import os
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+                         os.path.abspath(__file__))))
+# fedup2/version.py is generated by 'make'; it's not in git
+HAVE_VERSION = os.path.exists(os.path.join(TOPDIR, 'fedup2', 'version.py'))
+if HAVE_VERSION:
+    from ..cli import init_parser
+
+@unittest.skipUnless(HAVE_VERSION, "fedup2/version.py missing; run 'make'")
+class TestWaitArgs(unittest.TestCase):
+    def parse(self, *argv):
+        return init_parser().parse_args(argv)
+
+    def test_no_wait(self):
+        '''cli: without --wait, don't wait'''
+        args = self.parse('status')
+        self.assertEqual((args.wait, args.wait_timeout), (False, None))
+
+    def test_wait(self):
+        '''cli: a bare --wait can go before the action'''
+        args = self.parse('--wait', 'status', '--json')
+        self.assertEqual(args.action, 'status')
+        self.assertTrue(args.json)
+        self.assertEqual((args.wait, args.wait_timeout), (True, None))
+
+    def test_wait_timeout(self):
+        '''cli: --wait-timeout N waits up to N seconds'''
+        args = self.parse('--wait-timeout', '2.5', 'status')
+        self.assertEqual(args.action, 'status')
+        self.assertEqual(args.wait_timeout, 2.5)
+
+    def test_wait_timeout_bad(self):
+        '''cli: --wait-timeout needs a number'''
+        with self.assertRaises(SystemExit):
+            self.parse('--wait-timeout', 'status')
@@ -0,0 +1,73 @@
+# test_conflicts.py - tests for fedup2.conflicts
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..conflicts import PathIndex, find_conflicts
+
+import time
+
+FILES = {
+    'new-a': ['/usr/bin/a', '/usr/share/a', '/usr/share/a/data', '/etc/x'],
+    'new-b': ['/usr/bin/b', '/usr/share/b', '/usr/share/b/data'],
+    'old-c': ['/usr/bin/c', '/usr/share/a', '/etc/x'],
+    'old-d': ['/usr/bin/d', '/usr/bin/b'],
+    'old-e': ['/usr/bin/e', '/usr/bin/c'],
+}
+
+def files(pkg):
+    return FILES[pkg]
+
+class TestConflicts(unittest.TestCase):
+    def test_conflicts(self):
+        '''conflicts: shared files are found, shared directories aren't'''
+        conflicts = find_conflicts(['new-a', 'new-b'],
+                                   ['old-c', 'old-d', 'old-e'], files)
+        self.assertEqual(conflicts, [('/etc/x', 'new-a', 'old-c'),
+                                     ('/usr/bin/b', 'new-b', 'old-d')])
+
+    def test_same(self):
+        '''conflicts: packages allowed to share files aren't reported'''
+        conflicts = find_conflicts(['new-a', 'new-b'], ['old-c', 'old-d'],
+                                   files, same=lambda a, b: b == 'old-c')
+        self.assertEqual(conflicts, [('/usr/bin/b', 'new-b', 'old-d')])
+
+    def test_kept_only(self):
+        '''conflicts: conflicts between kept packages are not our problem'''
+        self.assertEqual(find_conflicts([], ['old-c', 'old-e'], files), [])
+
+    def test_index_size(self):
+        '''conflicts: PathIndex stores 8 bytes per path'''
+        index = PathIndex()
+        index.add('pkg', ('/usr/lib/file%u' % n for n in range(1000)))
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(index.entries.itemsize * len(index), 8000)
+
+    def test_scale(self):
+        '''conflicts: 200k paths are handled quickly'''
+        paths = dict(('pkg%u' % n, ['/usr/lib/pkg%u/file%u' % (n, f)
+                                    for f in range(100)])
+                     for n in range(2000))
+        paths['pkg0'].append('/usr/bin/clash')
+        paths['pkg1999'].append('/usr/bin/clash')
+        start = time.time()
+        conflicts = find_conflicts(['pkg%u' % n for n in range(1000)],
+                                   ['pkg%u' % n for n in range(1000, 2000)],
+                                   paths.get)
+        self.assertEqual(conflicts, [('/usr/bin/clash', 'pkg0', 'pkg1999')])
+        self.assertTrue(time.time() - start < 10)
@@ -0,0 +1,73 @@
+# test_dedup.py - tests for fedup2.dedup
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..dedup import LocalCache, link_file
+
+import os
+import shutil
+import hashlib
+from tempfile import mkdtemp
+
+class TestLocalCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='dedup.')
+        self.cachedir = os.path.join(self.tmpdir, 'cache', 'repo', 'packages')
+        self.datadir = os.path.join(self.tmpdir, 'datadir')
+        os.makedirs(self.cachedir)
+        os.makedirs(self.datadir)
+        self.data = b'pretend this is an rpm'
+        self.checksum = 'sha256:' + hashlib.sha256(self.data).hexdigest()
+        self.src = self.write(self.cachedir, 'foo-1.0-1.noarch.rpm', self.data)
+        self.cache = LocalCache([os.path.join(self.tmpdir, 'cache')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def write(dirname, name, data):
+        path = os.path.join(dirname, name)
+        with open(path, 'wb') as outf:
+            outf.write(data)
+        return path
+
+    def test_find(self):
+        '''dedup: find a matching package'''
+        found = self.cache.find('foo-1.0-1.noarch.rpm', len(self.data),
+                                self.checksum)
+        self.assertEqual(found, self.src)
+
+    def test_find_mismatch(self):
+        '''dedup: packages with the wrong name/size/checksum aren't used'''
+        name, size = 'foo-1.0-1.noarch.rpm', len(self.data)
+        self.assertIsNone(self.cache.find('bar.rpm', size, self.checksum))
+        self.assertIsNone(self.cache.find(name, size+1, self.checksum))
+        self.assertIsNone(self.cache.find(name, size, 'sha256:0000'))
+
+    def test_exclude(self):
+        '''dedup: LocalCache skips the excluded dir'''
+        self.write(self.datadir, 'bar-1.0-1.noarch.rpm', self.data)
+        cache = LocalCache([self.tmpdir], exclude=self.datadir)
+        self.assertEqual(list(cache.files), ['foo-1.0-1.noarch.rpm'])
+
+    def test_link(self):
+        '''dedup: link_file() makes a hardlink on the same filesystem'''
+        dest = os.path.join(self.datadir, 'foo-1.0-1.noarch.rpm')
+        self.assertEqual(link_file(self.src, dest), 'hardlink')
+        self.assertTrue(os.path.samefile(self.src, dest))
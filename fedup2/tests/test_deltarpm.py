@@ -0,0 +1,57 @@
+# test_deltarpm.py - tests for fedup2.deltarpm
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from .. import deltarpm
+from ..deltarpm import DeltaJob, Rebuilder
+
+import os
+import shutil
+import hashlib
+from tempfile import mkdtemp
+
+class TestRebuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='deltarpm.')
+        # "applying" a delta with cp just gives you the delta back
+        self.applydelta = deltarpm.APPLYDELTA
+        deltarpm.APPLYDELTA = '/bin/cp'
+
+    def tearDown(self):
+        deltarpm.APPLYDELTA = self.applydelta
+        shutil.rmtree(self.tmpdir)
+
+    def job(self, name, data, checksum_data=None):
+        delta = os.path.join(self.tmpdir, name + '.drpm')
+        with open(delta, 'wb') as outf:
+            outf.write(data)
+        checksum = hashlib.sha256(checksum_data or data).hexdigest()
+        return DeltaJob(name, delta, os.path.join(self.tmpdir, name + '.rpm'),
+                        'sha256:' + checksum, fullsize=1000)
+
+    def test_rebuild(self):
+        '''deltarpm: successful and failed rebuilds'''
+        good = self.job('good', b'good data')
+        bad = self.job('bad', b'bad data', b'what we really wanted')
+        ok, failed = Rebuilder([good, bad], processes=2).wait()
+        self.assertEqual(ok, [good])
+        self.assertEqual(failed, [bad])
+        self.assertEqual(good.saved, 1000 - len(b'good data'))
+        # rebuilt packages stay, everything else gets cleaned up
+        self.assertEqual(os.listdir(self.tmpdir), ['good.rpm'])
@@ -0,0 +1,75 @@
+# test_diskspace.py - tests for fedup2.diskspace
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..diskspace import disk_usage
+
+from collections import namedtuple
+
+StatVFS = namedtuple('StatVFS', 'f_bavail f_frsize')
+
+MOUNTS = ['/', '/boot', '/var']
+FREE = {'/': 1000*4096, '/boot': 10*4096, '/var': 500*4096}
+
+def find_mount(path):
+    return max((m for m in MOUNTS
+                if path == m or path.startswith(m.rstrip('/')+'/')), key=len)
+
+def statvfs(path):
+    return StatVFS(FREE[path] // 4096, 4096)
+
+class TestDiskUsage(unittest.TestCase):
+    def usage(self, download, changes):
+        result = disk_usage('/var/cache/system-upgrade', download, changes,
+                            find_mount=find_mount, statvfs=statvfs)
+        return dict((m.target, m) for m in result)
+
+    def test_download(self):
+        '''diskspace: downloads count against the datadir filesystem'''
+        usage = self.usage(600*4096, [])
+        self.assertEqual(list(usage), ['/var'])
+        self.assertEqual(usage['/var'].short, 100*4096)
+
+    def test_split(self):
+        '''diskspace: installed size is split according to file locations'''
+        files = ['/usr/bin/foo', '/usr/lib/libfoo.so', '/boot/foo', '/var/foo']
+        usage = self.usage(0, [(files, 4000)])
+        self.assertEqual(usage['/'].needed, 2000)
+        self.assertEqual(usage['/boot'].needed, 1000)
+        self.assertEqual(usage['/var'].needed, 1000)
+
+    def test_removed(self):
+        '''diskspace: removed packages make room; shrinking needs nothing'''
+        usage = self.usage(0, [(['/boot/new'], 50*4096),
+                               (['/boot/old'], -45*4096),
+                               (['/usr/bin/gone'], -100)])
+        self.assertEqual(usage['/boot'].needed, 5*4096)
+        self.assertTrue(usage['/boot'].short <= 0)
+        self.assertEqual(usage['/'].needed, 0)
+
+    def test_short(self):
+        '''diskspace: a filesystem that's too small is reported'''
+        usage = self.usage(0, [(['/boot/vmlinuz', '/boot/initramfs'],
+                                30*4096)])
+        self.assertEqual(usage['/boot'].short, 20*4096)
+
+    def test_no_files(self):
+        '''diskspace: packages without file lists are counted against /usr'''
+        usage = self.usage(0, [([], 4096)])
+        self.assertEqual(usage['/'].needed, 4096)
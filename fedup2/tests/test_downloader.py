@@ -0,0 +1,367 @@
+# test_downloader.py - tests for fedup2.downloader
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..downloader import Downloader, DownloadJob, DownloadError
+from ..downloader import PartialFile, staging_files, file_checksum
+from ..downloader import MAX_REDIRECTS
+
+import os
+import shutil
+import hashlib
+import threading
+from tempfile import mkdtemp
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FakeMirrorHandler(BaseHTTPRequestHandler):
+    '''Serves self.server.files (a dict of path -> data) with keep-alive and
+       (unless self.server.ranges is False) simple "bytes=N-[M]" Range
+       requests. Paths in self.server.redirects get a 302 instead.'''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        self.server.requests.append(self.path)
+        self.server.ranges_seen.append(rng)
+        if self.path in self.server.redirects:
+            self.send_response(302)
+            self.send_header('Location', self.server.redirects[self.path])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if rng and self.server.ranges:
+            start, end = rng[len('bytes='):].split('-')
+            start, end = int(start), int(end or len(data)-1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %u-%u/%u' % (
+                             start, end, len(data)))
+            data = data[start:end+1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeMirror(object):
+    def __init__(self, files):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMirrorHandler)
+        self.server.files = files
+        self.server.requests = []
+        self.server.ranges_seen = []
+        self.server.ranges = True
+        self.server.redirects = dict()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def url(self, path):
+        return 'http://127.0.0.1:%u%s' % (self.server.server_port, path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestDownloader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='downloader.')
+        self.files = {
+            '/big.rpm': b'B' * 300000,
+            '/medium.rpm': b'M' * 20000,
+            '/small.rpm': b's' * 10,
+        }
+        self.mirror = FakeMirror(self.files)
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def job(self, path, urls=None):
+        if urls is None:
+            urls = [self.mirror.url(path)]
+        return DownloadJob(path[1:], urls, self.tmpdir + path,
+                           len(self.files.get(path, b'')))
+
+    def read(self, path):
+        with open(self.tmpdir + path, 'rb') as inf:
+            return inf.read()
+
+    def test_download(self):
+        '''downloader: fetch several files from a mirror'''
+        jobs = [self.job(p) for p in self.files]
+        dl = Downloader(max_parallel=2)
+        dl.download(jobs)
+        for path, data in self.files.items():
+            self.assertEqual(self.read(path), data)
+        stats = dl.mirrors['127.0.0.1:%u' % self.mirror.server.server_port]
+        self.assertEqual(stats.files, 3)
+        self.assertEqual(stats.bytes, sum(len(d) for d in self.files.values()))
+
+    def test_poll(self):
+        '''downloader: progress.poll() gets called from the main thread'''
+        class PollMeter(object):
+            def __init__(self):
+                self.ends, self.polls = [], []
+            def start(self, total_files, total_size):
+                pass
+            def progress(self, job, done):
+                pass
+            def end(self, job, status, msg):
+                self.ends.append(threading.current_thread())
+            def poll(self):
+                self.polls.append(threading.current_thread())
+        meter = PollMeter()
+        Downloader(max_parallel=2, progress=meter).download(
+                                    [self.job(p) for p in self.files])
+        main = threading.current_thread()
+        self.assertEqual(len(meter.ends), 3)
+        self.assertFalse(main in meter.ends)
+        self.assertTrue(meter.polls)
+        self.assertEqual(set(meter.polls), set([main]))
+
+    def test_largest_first(self):
+        '''downloader: jobs are started largest-first'''
+        jobs = [self.job(p) for p in ('/small.rpm', '/big.rpm', '/medium.rpm')]
+        Downloader(max_parallel=1).download(jobs)
+        self.assertEqual(self.mirror.requests,
+                         ['/big.rpm', '/medium.rpm', '/small.rpm'])
+
+    def test_skip_existing(self):
+        '''downloader: files that are already present are not fetched'''
+        with open(self.tmpdir + '/big.rpm', 'wb') as outf:
+            outf.write(self.files['/big.rpm'])
+        Downloader().download([self.job('/big.rpm'), self.job('/small.rpm')])
+        self.assertEqual(self.mirror.requests, ['/small.rpm'])
+
+    def test_mirror_fallback(self):
+        '''downloader: try the next mirror if the first one fails'''
+        urls = [self.mirror.url('/missing/small.rpm'),
+                self.mirror.url('/small.rpm')]
+        dl = Downloader()
+        dl.download([self.job('/small.rpm', urls)])
+        self.assertEqual(self.read('/small.rpm'), self.files['/small.rpm'])
+
+    def test_failure(self):
+        '''downloader: raise DownloadError if no mirror has the file'''
+        job = self.job('/nope.rpm')
+        with self.assertRaises(DownloadError) as cm:
+            Downloader().download([job, self.job('/small.rpm')])
+        self.assertEqual(list(cm.exception.errors), ['nope.rpm'])
+        self.assertFalse(os.path.exists(job.dest))
+        self.assertEqual(self.read('/small.rpm'), self.files['/small.rpm'])
+
+    def test_redirect(self):
+        '''downloader: redirects are followed'''
+        self.mirror.server.redirects['/mirrorlist/small.rpm'] = '/small.rpm'
+        self.mirror.server.redirects['/mirrorlist/big.rpm'] = \
+            self.mirror.url('/big.rpm')
+        jobs = [self.job(p, [self.mirror.url('/mirrorlist'+p)])
+                for p in ('/small.rpm', '/big.rpm')]
+        jobs.append(DownloadJob('prefix',
+                                [self.mirror.url('/mirrorlist/big.rpm')],
+                                self.tmpdir + '/prefix', 100, prefix=True))
+        Downloader(max_parallel=1).download(jobs)
+        self.assertEqual(self.read('/small.rpm'), self.files['/small.rpm'])
+        self.assertEqual(self.read('/big.rpm'), self.files['/big.rpm'])
+        self.assertEqual(self.read('/prefix'), self.files['/big.rpm'][:100])
+
+    def test_redirect_loop(self):
+        '''downloader: redirect loops are a failure, not a hang'''
+        self.mirror.server.redirects['/loop.rpm'] = '/loop.rpm'
+        job = DownloadJob('loop', [self.mirror.url('/loop.rpm')],
+                          self.tmpdir + '/loop.rpm', 10)
+        with self.assertRaises(DownloadError) as cm:
+            Downloader().download([job])
+        self.assertTrue("too many redirects" in str(cm.exception))
+        self.assertEqual(len(self.mirror.requests), MAX_REDIRECTS+1)
+
+    def checksum(self, path):
+        return 'sha256:' + hashlib.sha256(self.files[path]).hexdigest()
+
+    def test_checksum(self):
+        '''downloader: the checksum is computed while downloading'''
+        job = self.job('/medium.rpm')
+        job.checksum = self.checksum('/medium.rpm')
+        Downloader().download([job])
+        self.assertEqual(job.verified, job.checksum)
+        self.assertEqual(file_checksum(job.dest, 'sha256'), job.checksum)
+
+    def test_checksum_mismatch(self):
+        '''downloader: a file with the wrong checksum is fetched elsewhere'''
+        self.files['/bad/small.rpm'] = b'x' * len(self.files['/small.rpm'])
+        urls = [self.mirror.url('/bad/small.rpm'),
+                self.mirror.url('/small.rpm')]
+        job = self.job('/small.rpm', urls)
+        job.checksum = self.checksum('/small.rpm')
+        Downloader().download([job])
+        self.assertEqual(self.mirror.requests, ['/bad/small.rpm', '/small.rpm'])
+        self.assertEqual(self.read('/small.rpm'), self.files['/small.rpm'])
+
+    def test_existing_unverified(self):
+        '''downloader: existing files are checked unless already verified'''
+        with open(self.tmpdir + '/small.rpm', 'wb') as outf:
+            outf.write(b'x' * len(self.files['/small.rpm']))
+        job = self.job('/small.rpm')
+        job.checksum = self.checksum('/small.rpm')
+        job.verified = job.checksum # a lie, but we believe it
+        Downloader().download([job])
+        self.assertEqual(self.mirror.requests, [])
+        job.verified = None
+        Downloader().download([job])
+        self.assertEqual(self.mirror.requests, ['/small.rpm'])
+        self.assertEqual(self.read('/small.rpm'), self.files['/small.rpm'])
+
+    def test_limiter(self):
+        '''downloader: all the data goes through the rate limiter'''
+        class CountingLimiter(object):
+            count = 0
+            def consume(self, nbytes):
+                self.count += nbytes
+        limiter = CountingLimiter()
+        dl = Downloader(limiter=limiter)
+        dl.download([self.job(p) for p in self.files])
+        self.assertEqual(limiter.count, dl.bytes)
+        self.assertEqual(dl.bytes, sum(len(d) for d in self.files.values()))
+
+    def test_tune(self):
+        '''downloader: concurrency follows throughput'''
+        # pylint: disable=protected-access
+        dl = Downloader(max_parallel=8)
+        dl._tune(1000.0)
+        self.assertEqual(dl.parallel, 8)
+        dl._tune(2000.0)    # better: keep going (down from the max)
+        self.assertEqual(dl.parallel, 7)
+        dl._tune(1000.0)    # worse: turn around
+        self.assertEqual(dl.parallel, 8)
+        dl._tune(1010.0)    # about the same: stay put
+        self.assertEqual(dl.parallel, 8)
+        dl._tune(2000.0)    # better: keep going (but not over the max)
+        self.assertEqual(dl.parallel, 8)
+        dl._tune(1000.0)    # worse: turn around
+        self.assertEqual(dl.parallel, 7)
+        for _ in range(20): # never drops below 1
+            dl._tune(dl._last_rate * 2)
+        self.assertEqual(dl.parallel, 1)
+
+    def test_prefix(self):
+        '''downloader: prefix jobs fetch just the start of the file'''
+        jobs = [DownloadJob(p[1:], [self.mirror.url(p)], self.tmpdir + p,
+                            1000, prefix=True)
+                for p in ('/big.rpm', '/medium.rpm')]
+        dl = Downloader(max_parallel=1)
+        dl.download(jobs)
+        self.assertEqual(self.read('/big.rpm'), self.files['/big.rpm'][:1000])
+        self.assertEqual(self.mirror.server.ranges_seen, ['bytes=0-999'] * 2)
+        self.assertEqual(dl.bytes, 2000)
+        # ...even if the server sends the whole thing
+        self.mirror.server.ranges = False
+        os.unlink(self.tmpdir + '/big.rpm')
+        Downloader().download(jobs)
+        self.assertEqual(self.read('/big.rpm'), self.files['/big.rpm'][:1000])
+        self.assertFalse(os.path.exists(self.tmpdir + '/big.rpm.part'))
+
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='downloader.')
+        self.data = bytes(bytearray(range(256))) * 40 # 10240 bytes
+        self.mirror = FakeMirror({'/pkg.rpm': self.data})
+        self.dest = os.path.join(self.tmpdir, 'pkg.rpm')
+        self.part, self.idx = staging_files(self.dest)
+        self.chunksize = 1000
+
+    def tearDown(self):
+        self.mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_partial(self, nbytes):
+        part = PartialFile(self.part, self.chunksize)
+        part.write(self.data[:nbytes])
+        part.close()
+
+    def download(self):
+        job = DownloadJob('pkg', [self.mirror.url('/pkg.rpm')],
+                          self.dest, len(self.data))
+        Downloader(chunksize=self.chunksize).download([job])
+        with open(self.dest, 'rb') as inf:
+            self.assertEqual(inf.read(), self.data)
+        self.assertFalse(os.path.exists(self.part))
+        self.assertFalse(os.path.exists(self.idx))
+
+    def test_partialfile_index(self):
+        '''downloader: PartialFile only trusts indexed chunks'''
+        self.write_partial(3500)
+        part = PartialFile(self.part, self.chunksize)
+        self.assertEqual(part.offset, 3000)
+        self.assertEqual(len(part.hashes), 3)
+        part.close()
+        self.assertEqual(os.path.getsize(self.part), 3000)
+
+    def test_partialfile_bad_index(self):
+        '''downloader: PartialFile with mismatched index starts over'''
+        self.write_partial(3500)
+        part = PartialFile(self.part, self.chunksize*2)
+        self.assertEqual(part.offset, 0)
+        part.close()
+
+    def test_resume(self):
+        '''downloader: interrupted download resumes with a Range request'''
+        self.write_partial(4321)
+        self.download()
+        self.assertEqual(self.mirror.server.ranges_seen, ['bytes=4000-'])
+
+    def test_resume_corrupt_chunk(self):
+        '''downloader: resume starts at the first corrupted chunk'''
+        self.write_partial(5000)
+        with open(self.part, 'r+b') as outf:
+            outf.seek(2500)
+            outf.write(b'XXX')
+        self.download()
+        self.assertEqual(self.mirror.server.ranges_seen, ['bytes=2000-'])
+
+    def test_resume_checksum(self):
+        '''downloader: resumed files still get a whole-file checksum'''
+        self.write_partial(4321)
+        job = DownloadJob('pkg', [self.mirror.url('/pkg.rpm')],
+                          self.dest, len(self.data),
+                          'sha1:' + hashlib.sha1(self.data).hexdigest())
+        Downloader(chunksize=self.chunksize).download([job])
+        self.assertEqual(job.verified, job.checksum)
+
+    def test_resume_no_ranges(self):
+        '''downloader: server that ignores Range gets a full download'''
+        self.mirror.server.ranges = False
+        self.write_partial(5000)
+        self.download()
+        self.assertEqual(self.mirror.server.ranges_seen, ['bytes=5000-'])
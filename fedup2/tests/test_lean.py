@@ -0,0 +1,130 @@
+# test_lean.py - tests for fedup2.lean
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..lean import skipped_upgrades
+
+import os
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+                         os.path.abspath(__file__))))
+# fedup2/version.py is generated by 'make'; it's not in git
+HAVE_VERSION = os.path.exists(os.path.join(TOPDIR, 'fedup2', 'version.py'))
+if HAVE_VERSION:
+    from ..cli import Cli
+
+class FakePkg(object):
+    def __init__(self, nevra):
+        self.nevra = nevra
+        name, _ver, rel = nevra.rsplit('-', 2)
+        self.name, self.arch = name, rel.rsplit('.', 1)[1]
+    def __str__(self):
+        return self.nevra
+
+def pkgs(*nevras):
+    return [FakePkg(n) for n in nevras]
+
+class TestSkippedUpgrades(unittest.TestCase):
+    def test_complete(self):
+        '''lean: nothing is skipped if everything gets upgraded'''
+        upgradable = pkgs("foo-1-1.x86_64", "bar-1-1.noarch")
+        new = pkgs("foo-2-1.x86_64", "bar-2-1.noarch", "newdep-1-1.noarch")
+        self.assertEqual(skipped_upgrades(upgradable, new, upgradable), [])
+
+    def test_skipped(self):
+        '''lean: a package left at its old version is caught'''
+        # e.g. bar-2 needs a file that's only in filelists, so with
+        # best=False the solver quietly keeps bar-1
+        upgradable = pkgs("foo-1-1.x86_64", "bar-1-1.noarch")
+        new = pkgs("foo-2-1.x86_64")
+        removed = pkgs("foo-1-1.x86_64")
+        skipped = skipped_upgrades(upgradable, new, removed)
+        self.assertEqual([str(p) for p in skipped], ["bar-1-1.noarch"])
+
+    def test_installonly(self):
+        '''lean: installonly packages are installed, not replaced'''
+        upgradable = pkgs("kernel-4.0-1.x86_64")
+        new = pkgs("kernel-4.1-1.x86_64")
+        self.assertEqual(skipped_upgrades(upgradable, new, []), [])
+
+    def test_obsoleted(self):
+        '''lean: obsoleted packages count as upgraded'''
+        upgradable = pkgs("oldname-1-1.x86_64")
+        new = pkgs("newname-2-1.x86_64")
+        removed = pkgs("oldname-1-1.x86_64")
+        self.assertEqual(skipped_upgrades(upgradable, new, removed), [])
+
+    def test_other_arch(self):
+        '''lean: upgrading one arch doesn't count for the other'''
+        upgradable = pkgs("lib-1-1.x86_64", "lib-1-1.i686")
+        new = pkgs("lib-2-1.x86_64")
+        removed = pkgs("lib-1-1.x86_64")
+        skipped = skipped_upgrades(upgradable, new, removed)
+        self.assertEqual([str(p) for p in skipped], ["lib-1-1.i686"])
+
+class FakeUsage(object):
+    short = 0
+
+class FakeDNFWrapper(object):
+    def __init__(self, lean):
+        self.lean = lean
+        self.checked = []
+
+    def find_conflicts(self):
+        self.checked.append('conflicts')
+        return [("/usr/bin/thing", "foo-2-1.x86_64", "bar-2-1.x86_64")]
+
+    def disk_usage(self, pkglist):
+        self.checked.append('disk')
+        return [FakeUsage()]
+
+@unittest.skipUnless(HAVE_VERSION, "fedup2/version.py missing; run 'make'")
+class TestLeanChecks(unittest.TestCase):
+    def setUp(self):
+        self.cli = Cli()
+        self.messages = []
+        self.cli.message = lambda msg, *args: self.messages.append(msg % args)
+
+    def test_conflicts(self):
+        '''lean: the conflict check is skipped (loudly) in lean mode'''
+        dl = FakeDNFWrapper(lean=True)
+        self.cli.check_conflicts(dl)
+        self.assertEqual(dl.checked, [])
+        self.assertTrue("skipping the file conflict check" in self.messages[0])
+
+    def test_conflicts_full(self):
+        '''lean: the conflict check runs once the file lists are loaded'''
+        dl = FakeDNFWrapper(lean=False)
+        self.cli.check_conflicts(dl)
+        self.assertEqual(dl.checked, ['conflicts'])
+        self.assertTrue("/usr/bin/thing" in self.messages[0])
+
+    def test_conflicts_strict(self):
+        '''lean: conflicts are only fatal with strict=True'''
+        dl = FakeDNFWrapper(lean=False)
+        with self.assertRaises(SystemExit):
+            self.cli.check_conflicts(dl, strict=True)
+        self.assertEqual(dl.checked, ['conflicts'])
+
+    def test_disk_space(self):
+        '''lean: the disk space check still runs, with a warning'''
+        dl = FakeDNFWrapper(lean=True)
+        self.cli.check_disk_space(dl, [])
+        self.assertEqual(dl.checked, ['disk'])
+        self.assertEqual(len(self.messages), 1)
@@ -0,0 +1,136 @@
+# test_ledger.py - tests for fedup2.ledger
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..ledger import DownloadLedger
+from ..state import State
+
+from tempfile import mkstemp
+import os
+import threading
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class FakeMeter(object):
+    def __init__(self):
+        self.calls = []
+    def start(self, *args):
+        self.calls.append(('start',) + args)
+    def progress(self, *args):
+        self.calls.append(('progress',) + args)
+    def end(self, *args):
+        self.calls.append(('end',) + args)
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.fd, self.tmpfile = mkstemp(prefix='state.')
+        State.statefile = self.tmpfile
+        self.state = State()
+        self.state.pkgs_total = 3
+        self.state.size_total = 600
+        self.clock = FakeClock()
+        self.meter = FakeMeter()
+        self.ledger = DownloadLedger(self.state, progress=self.meter,
+                                     interval=5, clock=self.clock)
+        self.sizes = {'a': 100, 'b': 200, 'c': 300}
+
+    def tearDown(self):
+        os.unlink(self.tmpfile)
+        os.close(self.fd)
+
+    def test_reset(self):
+        '''ledger: reset() counts the packages that are already done'''
+        self.ledger.reset(self.sizes, done=['b'])
+        state = State()
+        self.assertEqual(state.pkgs_done, '1')
+        self.assertEqual(state.size_done, '200')
+        self.assertEqual(state.current_rate, None)
+
+    def test_end(self):
+        '''ledger: finished downloads are counted once, failed ones not at all'''
+        self.ledger.reset(self.sizes)
+        self.ledger.end('a', None, None)
+        self.ledger.end('a', None, None)
+        self.ledger.end('b', 2, "it broke")
+        self.ledger.end('not-a-package', None, None)
+        self.ledger.flush()
+        self.assertEqual(self.state.pkgs_done, '1')
+        self.assertEqual(self.state.size_done, '100')
+        self.assertEqual([c[0] for c in self.meter.calls], ['end'] * 4)
+
+    def test_interval(self):
+        '''ledger: commits are limited to one per interval'''
+        self.ledger.reset(self.sizes)
+        self.clock.now += 10
+        self.ledger.done('a')
+        self.clock.now += 1
+        self.ledger.done('b')
+        self.assertEqual(State().pkgs_done, '1')
+        self.clock.now += 5
+        self.ledger.done('c')
+        state = State()
+        self.assertEqual(state.pkgs_done, '3')
+        self.assertEqual(state.size_done, '600')
+
+    def test_thread(self):
+        '''ledger: other threads' downloads get committed by poll()'''
+        self.ledger.reset(self.sizes)
+        self.clock.now += 10
+        t = threading.Thread(target=self.ledger.end, args=('a', None, None))
+        t.start()
+        t.join()
+        self.assertEqual(State().pkgs_done, '0')
+        self.ledger.poll()
+        state = State()
+        self.assertEqual(state.pkgs_done, '1')
+        self.assertEqual(state.size_done, '100')
+        self.clock.now += 10
+        self.ledger.poll()
+        self.assertEqual(State().progress_time, '1010')
+
+    def test_rate(self):
+        '''ledger: throughput only counts this session's downloads'''
+        self.ledger.reset(self.sizes, done=['c'])
+        self.clock.now += 10
+        self.ledger.sync(['a', 'b'])
+        self.assertEqual(self.state.current_rate, '30')
+        info = State().progress()
+        self.assertEqual(info['rate'], 30)
+        self.assertEqual(info['eta'], 0)
+
+    def test_eta(self):
+        '''ledger: progress() estimates the time left'''
+        self.ledger.reset(self.sizes)
+        self.clock.now += 10
+        self.ledger.sync(['a'])
+        info = State().progress()
+        self.assertEqual(info['pkgs_done'], 1)
+        self.assertEqual(info['eta'], 50)
+        self.assertEqual(info['updated'], 1010)
+
+    def test_forward(self):
+        '''ledger: progress calls are passed along to the meter'''
+        self.ledger.start(3, 600)
+        self.ledger.progress('a', 50)
+        self.assertEqual(self.meter.calls,
+                         [('start', 3, 600), ('progress', 'a', 50)])
@@ -0,0 +1,71 @@
+# test_localrepo.py - tests for fedup2.localrepo
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from .. import localrepo
+from ..localrepo import make_local_repo, has_local_repo, repomd_files
+
+import os
+import shutil
+from tempfile import mkdtemp
+
+REPOMD = '''<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <revision>1431440000</revision>
+  <data type="primary">
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+  <data type="filelists">
+    <location href="repodata/filelists.xml.gz"/>
+  </data>
+</repomd>
+'''
+
+class TestLocalRepo(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='localrepo.')
+        self.createrepo = localrepo.CREATEREPO
+
+    def tearDown(self):
+        localrepo.CREATEREPO = self.createrepo
+        shutil.rmtree(self.tmpdir)
+
+    def test_repomd_files(self):
+        '''localrepo: read the metadata file locations from repomd.xml'''
+        self.assertFalse(has_local_repo(self.tmpdir))
+        os.makedirs(os.path.join(self.tmpdir, 'repodata'))
+        with open(os.path.join(self.tmpdir, 'repodata/repomd.xml'), 'w') as f:
+            f.write(REPOMD)
+        self.assertTrue(has_local_repo(self.tmpdir))
+        files = repomd_files(self.tmpdir)
+        self.assertEqual(files, {
+            'primary': os.path.join(self.tmpdir, 'repodata/primary.xml.gz'),
+            'filelists': os.path.join(self.tmpdir, 'repodata/filelists.xml.gz'),
+        })
+
+    def test_make_local_repo(self):
+        '''localrepo: make_local_repo() reports failure and cleans up'''
+        paths = [os.path.join(self.tmpdir, 'foo.rpm')]
+        localrepo.CREATEREPO = '/bin/true'
+        self.assertTrue(make_local_repo(self.tmpdir, paths))
+        localrepo.CREATEREPO = '/bin/false'
+        self.assertFalse(make_local_repo(self.tmpdir, paths))
+        localrepo.CREATEREPO = os.path.join(self.tmpdir, 'no-such-program')
+        self.assertFalse(make_local_repo(self.tmpdir, paths))
+        self.assertEqual(os.listdir(self.tmpdir), [])
@@ -18,10 +18,11 @@
 # Author: Will Woods <wwoods@redhat.com>
 
 import unittest
-from ..lock import lock, unlock, LockError, PidLock, PidLockError
+from ..lock import lock, unlock, locked, LockError, PidLock, PidLockError
 from tempfile import mktemp
 from os import unlink, getpid
 from os.path import exists
+from time import time
 from multiprocessing import Process, Pipe #pylint: disable=no-name-in-module
 from contextlib import contextmanager
 
@@ -210,3 +211,54 @@ class TestPidLock(unittest.TestCase):
         e = self.inpipe.recv()
         self.assertTrue(isinstance(e, PidLockError))
         self.assertEqual(e.pid, self.pid)
+
+    def test_pidlock_wait(self):
+        '''check that PidLock(timeout=N) waits for the lock to be released'''
+        def child_pidlock(filename):
+            try:
+                pidlock = PidLock(filename, timeout=5)
+            except PidLockError as e:
+                self.outpipe.send(e)
+            else:
+                self.outpipe.send(pidlock.waited)
+                pidlock.remove()
+        p = Process(target=child_pidlock, args=(self.pidlock.name,))
+        p.start()
+        self.assertFalse(self.inpipe.poll(0.3))
+        self.pidlock.remove()
+        if not self.inpipe.poll(5):
+            raise LockTimeoutError("timeout waiting for other process")
+        waited = self.inpipe.recv()
+        p.join()
+        self.assertTrue(waited >= 0.3)
+        self.pidlock = PidLock(self.pidlock.name)
+
+    def test_pidlock_timeout(self):
+        '''check that PidLock raises PidLockError after the timeout'''
+        def child_pidlock(filename):
+            start = time()
+            try:
+                PidLock(filename, timeout=0.3)
+            except PidLockError as e:
+                self.outpipe.send((e.pid, time() - start))
+            else:
+                self.outpipe.send(None)
+        p = Process(target=child_pidlock, args=(self.pidlock.name,))
+        p.start()
+        if not self.inpipe.poll(5):
+            raise LockTimeoutError("timeout waiting for other process")
+        pid, waited = self.inpipe.recv()
+        p.join()
+        self.assertEqual(pid, self.pid)
+        self.assertTrue(0.2 <= waited < 2)
+
+class TestLocked(unittest.TestCase):
+    def test_locked_closes(self):
+        '''check that locked(filename) closes the file it opened'''
+        name = mktemp()
+        try:
+            with locked(name, 'a+', share=False) as f:
+                self.assertFalse(f.closed)
+            self.assertTrue(f.closed)
+        finally:
+            unlink(name)
@@ -0,0 +1,129 @@
+# test_logutils.py - tests for fedup2.logutils
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from .. import logutils
+from ..logutils import RateLimitFilter, GzipRotatingFileHandler
+from ..logutils import debuglog_handler, log_flush, log_shutdown
+
+import os, gzip, shutil, logging
+from tempfile import mkdtemp
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def record(name, msg, level=logging.DEBUG, args=None):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+class TestRateLimitFilter(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.filt = RateLimitFilter(10, clock=self.clock)
+
+    def test_rate_limit(self):
+        '''logutils: each logger gets 'rate' debug messages per second'''
+        passed = [self.filt.filter(record("dnf", "flood")) for _ in range(50)]
+        self.assertEqual(passed.count(True), 10)
+        self.assertTrue(self.filt.filter(record("fedup2", "other logger")))
+        self.clock.now += 0.5
+        passed = [self.filt.filter(record("dnf", "flood")) for _ in range(50)]
+        self.assertEqual(passed.count(True), 5)
+        self.assertEqual(self.filt.dropped, 85)
+
+    def test_suppressed(self):
+        '''logutils: the next message notes how many were suppressed'''
+        for _ in range(15):
+            self.filt.filter(record("dnf", "flood"))
+        self.clock.now += 1
+        r = record("dnf", "hello")
+        self.assertTrue(self.filt.filter(r))
+        self.assertEqual(r.suppressed, 5)
+        fmt = logutils.FedupFormatter("%(message)s")
+        self.assertEqual(fmt.format(r), "hello [5 earlier messages suppressed]")
+
+    def test_warnings(self):
+        '''logutils: warnings are never dropped'''
+        r = [self.filt.filter(record("dnf", "uh-oh", logging.WARNING))
+             for _ in range(50)]
+        self.assertTrue(all(r))
+
+class TestDebugLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='logutils.')
+        self.logfile = os.path.join(self.tmpdir, 'fedup2.log')
+        self.log = logging.getLogger("fedup2.test.logutils")
+        self.log.propagate = False
+        self.log.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for h in self.log.handlers[:]:
+            self.log.removeHandler(h)
+        log_shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def _lines(self):
+        with open(self.logfile) as inf:
+            return [l.split("() ", 1)[1].rstrip() for l in inf]
+
+    def test_background(self):
+        '''logutils: the debug log is written by a background thread'''
+        self.log.addHandler(debuglog_handler(self.logfile))
+        things = ['a']
+        self.log.debug("things: %s", things)
+        things.append('b') # too late, the message was filled in already
+        log_flush()
+        self.assertEqual(self._lines(), ["things: ['a']"])
+        # pylint: disable=protected-access
+        self.assertTrue(logutils._listener._thread.is_alive())
+        log_shutdown()
+        self.assertTrue(logutils._listener is None)
+
+    def test_record_unchanged(self):
+        '''logutils: the queued copy doesn't change other handlers' record'''
+        class Keep(logging.Handler):
+            def emit(self, record):
+                self.record = record
+        keep = Keep()
+        self.log.addHandler(debuglog_handler(self.logfile))
+        self.log.addHandler(keep)
+        self.log.debug("count: %d", 5)
+        log_flush()
+        self.assertEqual(self._lines(), ["count: 5"])
+        self.assertEqual((keep.record.msg, keep.record.args),
+                         ("count: %d", (5,)))
+
+    def test_rotate(self):
+        '''logutils: old logs are rotated and compressed'''
+        handler = GzipRotatingFileHandler(self.logfile, maxBytes=1000,
+                                          backupCount=2)
+        self.log.addHandler(handler)
+        for n in range(100):
+            self.log.debug("line %03d %s", n, "x"*40)
+        handler.close()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['fedup2.log', 'fedup2.log.1.gz', 'fedup2.log.2.gz'])
+        self.assertLessEqual(os.path.getsize(self.logfile), 1000)
+        with gzip.open(self.logfile + '.1.gz', 'rt') as inf:
+            last = inf.readlines()[-1]
+        with open(self.logfile) as inf:
+            first = inf.readline()
+        self.assertEqual(int(first.split()[1]), int(last.split()[1]) + 1)
@@ -0,0 +1,96 @@
+# test_plymouth.py - tests for fedup2.plymouth
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from .. import plymouth
+from ..plymouth import _PlymouthOutput
+
+import os, time, shutil
+from tempfile import mkdtemp
+
+import logging
+log = logging.getLogger("fedup2.test")
+
+# a fake plymouth that logs its arguments and takes a while, like the real one
+STUB = '''#!/bin/sh
+echo "$*" >> "%s"
+sleep 0.01
+'''
+
+# how long one rpm callback may spend on plymouth updates, on average
+ELEMENT_BUDGET = 0.001
+
+class TestPlymouthOutput(unittest.TestCase):
+    # pylint: disable=protected-access
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='plymouth.')
+        self.logfile = os.path.join(self.tmpdir, 'calls')
+        stub = os.path.join(self.tmpdir, 'plymouth')
+        with open(stub, 'w') as outf:
+            outf.write(STUB % self.logfile)
+        os.chmod(stub, 0o755)
+        self.real_plymouth, plymouth.PLYMOUTH = plymouth.PLYMOUTH, stub
+        self.ply = _PlymouthOutput(interval=0.05)
+
+    def tearDown(self):
+        self.ply.flush()
+        plymouth.PLYMOUTH = self.real_plymouth
+        shutil.rmtree(self.tmpdir)
+
+    def _calls(self):
+        with open(self.logfile) as inf:
+            return [l.strip() for l in inf]
+
+    def test_ping(self):
+        '''plymouth: plymouth is pinged once, on first use'''
+        self.assertFalse(os.path.exists(self.logfile))
+        self.assertTrue(self.ply.alive)
+        self.assertTrue(self.ply.ping())
+        self.assertEqual(self._calls(), ['--ping'])
+
+    def test_order(self):
+        '''plymouth: pending updates are sent mode first, message last'''
+        # hold the lock so the updates all end up in the same batch
+        with self.ply._cond:
+            self.ply.message("hello")
+            self.ply.progress(5)
+            self.ply.set_mode("updates")
+        self.assertTrue(self.ply.flush())
+        self.assertEqual(self._calls(), ['change-mode --updates',
+                                         'system-update --progress 5',
+                                         'display-message --text hello'])
+
+    def test_coalesce(self):
+        '''plymouth: bursts of updates only send the latest values'''
+        total = 3000
+        start = time.time()
+        for n in range(1, total+1):
+            self.ply.progress(int(100.0 * n / total))
+            self.ply.message("[%d/%d] upgrading package-%d..." % (n, total, n))
+        elapsed = time.time() - start
+        self.assertTrue(self.ply.flush())
+        calls = self._calls()
+        log.info("plymouth: %.1fus per element, %u of %u updates sent",
+                 elapsed / total * 1e6, len(calls), total * 2)
+        self.assertLess(elapsed / total, ELEMENT_BUDGET)
+        self.assertLess(len(calls), total / 10)
+        self.assertEqual(calls[-1], "display-message --text [%d/%d] "
+                                    "upgrading package-%d..." % (total, total,
+                                                                 total))
+        self.assertEqual(self.ply.percent, 100)
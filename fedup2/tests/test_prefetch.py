@@ -0,0 +1,85 @@
+# test_prefetch.py - tests for fedup2.prefetch
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..prefetch import prefetch
+
+import threading
+
+class FakeRepoError(Exception):
+    pass
+
+class FakeRepo(object):
+    '''Fails to load the first 'failures' times.'''
+    def __init__(self, repoid, failures=0):
+        self.id = repoid
+        self.failures = failures
+        self.loaded = False
+
+    def load(self):
+        if self.failures:
+            self.failures -= 1
+            raise FakeRepoError("%s: can't download repomd.xml" % self.id)
+        self.loaded = True
+
+def fill_sack(repos):
+    '''Like dnf.Base.fill_sack(): load each repo, one at a time.'''
+    for repo in repos:
+        if not repo.loaded:
+            repo.load()
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch(self):
+        '''prefetch: all the repos get loaded'''
+        repos = [FakeRepo("repo%u" % n) for n in range(20)]
+        timings = prefetch(repos, lambda r: r.load(), threads=4)
+        self.assertTrue(all(r.loaded for r in repos))
+        self.assertEqual(sorted(timings), sorted(r.id for r in repos))
+
+    def test_concurrent_system(self):
+        '''prefetch: the rpmdb loads while the repos are loading'''
+        system_started = threading.Event()
+        def load_repo(repo):
+            # this would time out if load_system() waited for the repos
+            if not system_started.wait(5):
+                raise FakeRepoError("load_system() didn't start")
+            repo.load()
+        def load_system():
+            system_started.set()
+        repos = [FakeRepo("fedora"), FakeRepo("updates")]
+        timings = prefetch(repos, load_repo, load_system)
+        self.assertTrue(all(r.loaded for r in repos))
+        self.assertTrue(timings['@System'] is not None)
+
+    def test_errors(self):
+        '''prefetch: errors don't stop the other repos or fill_sack()'''
+        repos = [FakeRepo("fedora"), FakeRepo("flaky", failures=1),
+                 FakeRepo("updates")]
+        def load_system():
+            raise IOError("rpmdb is locked")
+        timings = prefetch(repos, lambda r: r.load(), load_system)
+        self.assertEqual(timings['flaky'], None)
+        self.assertEqual(timings['@System'], None)
+        self.assertEqual([r.loaded for r in repos], [True, False, True])
+        fill_sack(repos)
+        self.assertTrue(all(r.loaded for r in repos))
+
+    def test_no_repos(self):
+        '''prefetch: no repos is fine'''
+        self.assertEqual(list(prefetch([], lambda r: r.load())), [])
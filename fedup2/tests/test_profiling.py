@@ -0,0 +1,85 @@
+# test_profiling.py - tests for fedup2.profiling
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..profiling import Profiler, SamplingProfiler, profile_files
+from ..timing import PhaseTimer
+
+import os, json, time, shutil
+from tempfile import mkdtemp
+
+def busy_loop(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+class TestSamplingProfiler(unittest.TestCase):
+    def test_sample(self):
+        '''profiling: samples show up as folded stacks'''
+        sampler = SamplingProfiler(interval=0.001)
+        sampler.start()
+        busy_loop(0.2)
+        sampler.stop()
+        self.assertTrue(sampler.samples > 0)
+        ours = [s for s in sampler.stacks if 'busy_loop' in s]
+        self.assertTrue(ours)
+        self.assertTrue(ours[0].startswith("thread:MainThread;"))
+        self.assertTrue(ours[0].split(';')[-1].startswith(
+                        "busy_loop (test_profiling.py:"))
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='profiling.')
+        self.logfile = os.path.join(self.tmpdir, 'fedup2.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_profile_files(self):
+        '''profiling: output goes next to the log'''
+        self.assertEqual(profile_files("/var/log/fedup2.log"),
+                         ("/var/log/fedup2-profile.folded",
+                          "/var/log/fedup2-memory.json"))
+
+    def test_phases(self):
+        '''profiling: memory gets recorded at each phase boundary'''
+        timer = PhaseTimer()
+        profiler = Profiler(interval=0.001)
+        timer.listeners.append(profiler.phase)
+        profiler.start()
+        with timer.phase("metadata"):
+            junk = [str(n) for n in range(100000)]
+        with timer.phase("depsolve"):
+            busy_loop(0.05)
+        del junk
+        profiler.stop()
+        profiler.write(self.logfile)
+        folded, memory = profile_files(self.logfile)
+        with open(memory) as inf:
+            snapshots = json.load(inf)
+        self.assertEqual([s['phase'] for s in snapshots],
+                         ['start', 'metadata', 'depsolve', 'end'])
+        self.assertTrue(snapshots[1]['python_current'] > 1000000)
+        self.assertTrue(snapshots[1]['top'])
+        with open(folded) as inf:
+            lines = inf.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
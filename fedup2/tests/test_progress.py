@@ -0,0 +1,110 @@
+# test_progress.py - tests for fedup2.progress
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..progress import ProgressRenderer, DownloadMeter
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class FakePayload(object):
+    def __init__(self, size):
+        self.download_size = size
+
+class TestProgressRenderer(unittest.TestCase):
+    def setUp(self):
+        self.drawn = []
+        self.clock = FakeClock()
+
+    def renderer(self, isatty=True):
+        return ProgressRenderer(draw=lambda *a: self.drawn.append(a),
+                                fps=8, isatty=isatty, clock=self.clock)
+
+    def test_rate_limit(self):
+        '''progress: redraws are limited to fps per second'''
+        r = self.renderer()
+        for n in range(1, 50):
+            r.update(n, 1000, "stuff")
+            self.clock.now += 1.0/64
+        self.assertEqual([d[0] for d in self.drawn], [1, 9, 17, 25, 33, 41,
+                                                      49])
+
+    def test_final(self):
+        '''progress: the final state is always drawn, once'''
+        r = self.renderer()
+        r.update(1, 2, "stuff")
+        r.update(2, 2, "stuff")
+        r.update(2, 2, "stuff")
+        r.finish()
+        self.assertEqual(self.drawn, [(1, 2, "stuff"), (2, 2, "stuff")])
+
+    def test_not_a_tty(self):
+        '''progress: only the final state is drawn if stdout isn't a tty'''
+        r = self.renderer(isatty=False)
+        for n in range(1, 11):
+            r.update(n, 10)
+            self.clock.now += 1
+        self.assertEqual(self.drawn, [(10, 10, None)])
+
+    def test_finish(self):
+        '''progress: finish() draws the last update if it was skipped'''
+        r = self.renderer()
+        r.update(1, 10, "stuff")
+        r.update(5, 10, "stuff")
+        r.finish()
+        r.finish()
+        self.assertEqual(self.drawn, [(1, 10, "stuff"), (5, 10, "stuff")])
+        self.assertEqual(r.draws, 2)
+
+class TestDownloadMeter(unittest.TestCase):
+    def test_meter(self):
+        '''progress: DownloadMeter counts files and bytes'''
+        drawn = []
+        r = ProgressRenderer(draw=lambda *a: drawn.append(a), isatty=False)
+        meter = DownloadMeter(r)
+        a, b = FakePayload(100), FakePayload(200)
+        meter.start(2, 300)
+        meter.progress(a, 50)
+        meter.progress(b, 100)
+        meter.end(a, None, None)
+        meter.progress(b, 200)
+        meter.end(b, None, None)
+        self.assertEqual(len(drawn), 1)
+        self.assertEqual(drawn[0][:2], (2, 2))
+        self.assertTrue("300" in drawn[0][2])
+
+    def test_failed(self):
+        '''progress: DownloadMeter doesn't count failed downloads as done'''
+        drawn = []
+        r = ProgressRenderer(draw=lambda *a: drawn.append(a), isatty=False)
+        meter = DownloadMeter(r)
+        a, b = FakePayload(100), FakePayload(200)
+        meter.start(2, 300)
+        meter.progress(a, 100)
+        meter.end(a, None, None)
+        meter.progress(b, 150)
+        meter.end(b, 2, "it broke")
+        r.finish()
+        self.assertEqual((meter.done_files, meter.failed_files), (1, 1))
+        self.assertEqual(drawn[-1][:2], (1, 2))
+        self.assertTrue(drawn[-1][2].startswith("downloading (100 "))
+        self.assertTrue("1 failed" in drawn[-1][2])
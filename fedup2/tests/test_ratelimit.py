@@ -0,0 +1,93 @@
+# test_ratelimit.py - tests for fedup2.ratelimit
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..ratelimit import parse_rate, parse_schedule, RateSchedule, RateLimiter
+
+import time
+
+def localtime(hour, minute):
+    return time.mktime((2015, 5, 1, hour, minute, 0, 0, 0, -1))
+
+class TestParse(unittest.TestCase):
+    def test_rate(self):
+        '''ratelimit: parse_rate()'''
+        self.assertEqual(parse_rate("100"), 100)
+        self.assertEqual(parse_rate("500k"), 500*1024)
+        self.assertEqual(parse_rate("2M"), 2*1024*1024)
+        self.assertEqual(parse_rate("1.5MB"), int(1.5*1024*1024))
+        self.assertEqual(parse_rate("0"), 0)
+        self.assertEqual(parse_rate("1"), 1)
+        for bad in ("", "fast", "-1k", "2X", "inf", "1e400", "nan",
+                    "0.5", "0.0001k"):
+            with self.assertRaises(ValueError):
+                parse_rate(bad)
+
+    def test_schedule(self):
+        '''ratelimit: parse_schedule()'''
+        self.assertEqual(parse_schedule("01:00-05:30=0,22:00-02:00=1k"),
+                         [(60, 330, 0), (1320, 120, 1024)])
+        self.assertEqual(parse_schedule(None), [])
+        for bad in ("01:00=0", "1-2=0", "25:00-26:00=0", "01:00-02:00",
+                    "22:00-24:00=0"):
+            with self.assertRaises(ValueError):
+                parse_schedule(bad)
+
+class TestRateSchedule(unittest.TestCase):
+    def test_rate_at(self):
+        '''ratelimit: RateSchedule windows'''
+        sched = RateSchedule("2M", "01:00-05:00=0,22:00-00:30=1k")
+        self.assertEqual(sched.rate_at(localtime(0, 59)), 2*1024*1024)
+        self.assertEqual(sched.rate_at(localtime(1, 0)), 0)
+        self.assertEqual(sched.rate_at(localtime(4, 59)), 0)
+        self.assertEqual(sched.rate_at(localtime(5, 0)), 2*1024*1024)
+        self.assertEqual(sched.rate_at(localtime(23, 0)), 1024)
+        self.assertEqual(sched.rate_at(localtime(0, 15)), 1024)
+
+    def test_empty(self):
+        '''ratelimit: empty RateSchedule is false (no limit)'''
+        self.assertFalse(RateSchedule())
+        self.assertTrue(RateSchedule("1k"))
+        self.assertTrue(RateSchedule(None, "01:00-02:00=0"))
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept += secs
+        self.now += secs
+
+    def test_limit(self):
+        '''ratelimit: RateLimiter holds the rate down'''
+        limiter = RateLimiter(lambda: 1000, clock=self.clock, sleep=self.sleep)
+        for _ in range(10):
+            limiter.consume(500)
+        self.assertAlmostEqual(self.slept, 5.0)
+
+    def test_unlimited(self):
+        '''ratelimit: RateLimiter with rate 0 never sleeps'''
+        limiter = RateLimiter(lambda: 0, clock=self.clock, sleep=self.sleep)
+        for _ in range(10):
+            limiter.consume(1000000)
+        self.assertEqual(self.slept, 0.0)
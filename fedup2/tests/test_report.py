@@ -0,0 +1,99 @@
+# test_report.py - tests for fedup2.report
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..report import TransactionTimer, read_timing, summarize, packages_file
+from ..report import INSTALL, CLEANUP
+
+from tempfile import mkstemp
+import os
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+    def tick(self, secs):
+        self.now += secs
+
+class TestTransactionTimer(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = TransactionTimer(clock=self.clock)
+        self.fd, self.tmpfile = mkstemp(prefix='packages.', suffix='.csv')
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.unlink(self.tmpfile)
+
+    def _install(self, name, unpack, scripts, gap=0.0):
+        self.clock.tick(gap)
+        self.timer.event(name, INSTALL, 0, 100)
+        self.clock.tick(unpack / 2)
+        self.timer.event(name, INSTALL, 50, 100)
+        self.clock.tick(unpack / 2)
+        self.timer.event(name, INSTALL, 100, 100)
+        self.clock.tick(scripts)
+        self.timer.finished(name, INSTALL)
+
+    def _transaction(self):
+        self._install("foo-2-1.noarch", 1.0, 0.5)
+        self._install("bar-2-1.noarch", 4.0, 8.0, gap=2.0)
+        # an erase with a single event, and no finished() call
+        self.timer.event("foo-1-1.noarch", CLEANUP, 100, 100)
+        self.clock.tick(3.0)
+        self.timer.finish()
+        self.timer.write(self.tmpfile)
+        return read_timing(self.tmpfile)
+
+    def test_phases(self):
+        '''report: transaction elements are split into phases'''
+        rows = self._transaction()
+        self.assertEqual([r['package'] for r in rows],
+                         ["foo-2-1.noarch", "bar-2-1.noarch",
+                          "foo-1-1.noarch", ""])
+        foo, bar, cleanup, end = rows
+        self.assertEqual((foo['unpack'], foo['scriptlets']), (1.0, 0.5))
+        self.assertEqual((bar['unpack'], bar['scriptlets'],
+                          bar['triggers']), (4.0, 8.0, 2.0))
+        self.assertEqual(cleanup['cleanup'], 3.0)
+        self.assertEqual(end['total'], 0.0)
+
+    def test_summarize(self):
+        '''report: summarize() totals the phases and finds the slowest'''
+        phases, slowest = summarize(self._transaction(), top=2)
+        self.assertEqual(dict(phases), dict(unpack=5.0, scriptlets=8.5,
+                                            cleanup=3.0, triggers=2.0))
+        self.assertEqual([r['package'] for r in slowest],
+                         ["bar-2-1.noarch", "foo-1-1.noarch"])
+
+    def test_trailing_triggers(self):
+        '''report: time after the last element counts as triggers'''
+        self._install("foo-2-1.noarch", 1.0, 0.5)
+        self.clock.tick(7.0)
+        self.timer.finish()
+        self.timer.write(self.tmpfile)
+        rows = read_timing(self.tmpfile)
+        self.assertEqual(rows[-1]['action'], 'triggers')
+        self.assertEqual(rows[-1]['triggers'], 7.0)
+
+    def test_packages_file(self):
+        '''report: the timing file goes next to the log'''
+        self.assertEqual(packages_file("/var/log/fedup2.log"),
+                         "/var/log/fedup2-packages.csv")
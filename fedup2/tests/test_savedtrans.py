@@ -0,0 +1,88 @@
+# test_savedtrans.py - tests for fedup2.savedtrans
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..savedtrans import write_transaction, read_transaction, fingerprint
+
+import os
+import shutil
+from tempfile import mkdtemp
+
+class TestSavedTransaction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='savedtrans.')
+        self.rpmdb = os.path.join(self.tmpdir, 'rpm')
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.repomd = os.path.join(self.cachedir, 'fedora',
+                                   'repodata', 'repomd.xml')
+        os.makedirs(self.rpmdb)
+        os.makedirs(os.path.dirname(self.repomd))
+        self.write(os.path.join(self.rpmdb, 'Packages'), 'rpmdb')
+        self.write(self.repomd, '<repomd/>')
+        self.path = os.path.join(self.tmpdir, 'upgrade.transaction')
+        self.items = [
+            {"action": "upgrade", "nevra": "foo-1.1-1.noarch",
+             "path": "/data/foo-1.1-1.noarch.rpm", "checksum": "sha256:ab",
+             "replaces": ["foo-1.0-1.noarch"], "reason": "user"},
+            {"action": "erase", "nevra": "bar-1.0-1.noarch", "path": None,
+             "checksum": None, "replaces": [], "reason": "unknown"},
+        ]
+        write_transaction(self.path, self.items, self.cachedir, ['fedora'],
+                          rpmdb=self.rpmdb)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def write(path, data):
+        with open(path, 'w') as outf:
+            outf.write(data)
+
+    def read(self):
+        return read_transaction(self.path, rpmdb=self.rpmdb)
+
+    def test_read(self):
+        '''savedtrans: read_transaction() returns the saved items'''
+        self.assertEqual(self.read(), self.items)
+
+    def test_missing(self):
+        '''savedtrans: a missing or corrupt file gives None'''
+        os.unlink(self.path)
+        self.assertEqual(self.read(), None)
+        self.write(self.path, '{"items": [')
+        self.assertEqual(self.read(), None)
+
+    def test_rpmdb_changed(self):
+        '''savedtrans: the saved transaction is ignored if the rpmdb changed'''
+        with open(os.path.join(self.rpmdb, 'Packages'), 'a') as outf:
+            outf.write('new package')
+        self.assertEqual(self.read(), None)
+
+    def test_metadata_changed(self):
+        '''savedtrans: the saved transaction is ignored if metadata changed'''
+        self.write(self.repomd, '<repomd revision="2"/>')
+        self.assertEqual(self.read(), None)
+        os.unlink(self.repomd)
+        self.assertEqual(self.read(), None)
+
+    def test_fingerprint_repos(self):
+        '''savedtrans: the fingerprint depends on which repos are used'''
+        self.assertNotEqual(fingerprint(self.cachedir, ['fedora'], self.rpmdb),
+                            fingerprint(self.cachedir, ['fedora', 'updates'],
+                                        self.rpmdb))
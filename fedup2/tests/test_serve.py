@@ -0,0 +1,168 @@
+# test_serve.py - tests for fedup2.serve
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..serve import PeerServer, parse_range, drop_privileges
+from ..downloader import Downloader, DownloadJob, file_checksum
+from .test_downloader import FakeMirror
+
+import os
+import shutil
+import socket
+import threading
+from tempfile import mkdtemp
+from http.client import HTTPConnection
+
+class TestParseRange(unittest.TestCase):
+    def test_open(self):
+        '''parse_range: "bytes=N-" goes to the end of the file'''
+        self.assertEqual(parse_range('bytes=10-', 100), (10, 99))
+
+    def test_closed(self):
+        '''parse_range: "bytes=N-M" is clamped to the file size'''
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+
+    def test_invalid(self):
+        '''parse_range: unsupported or unsatisfiable ranges give None'''
+        for header in ('bytes=100-', 'bytes=5-1', 'bytes=0-1,5-9',
+                       'items=0-1', 'bytes=-10', 'bytes=x-'):
+            self.assertEqual(parse_range(header, 100), None, header)
+
+class TestPeerServer(unittest.TestCase):
+    def setUp(self):
+        self.datadir = mkdtemp(prefix='serve.')
+        self.tmpdir = mkdtemp(prefix='serve-client.')
+        self.data = b'P' * 200000
+        self.path = os.path.join(self.datadir, 'foo-1.0-1.noarch.rpm')
+        with open(self.path, 'wb') as outf:
+            outf.write(self.data)
+        with open(os.path.join(self.datadir, 'secret.rpm.part'), 'wb') as outf:
+            outf.write(b'nope')
+        self.checksum = file_checksum(self.path, 'sha256')
+        self.server = PeerServer(self.datadir, {self.path: self.checksum},
+                                 ('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.datadir)
+        shutil.rmtree(self.tmpdir)
+
+    def url(self, name=''):
+        return 'http://127.0.0.1:%u/%s' % (self.server.server_port, name)
+
+    def get(self, path, headers=None):
+        conn = HTTPConnection('127.0.0.1', self.server.server_port)
+        try:
+            conn.request('GET', path, headers=headers or {})
+            resp = conn.getresponse()
+            return resp.status, resp.getheader('Content-Range'), resp.read()
+        finally:
+            conn.close()
+
+    def test_packagelist(self):
+        '''serve: /package.list lists the files and checksums'''
+        status, _, body = self.get('/package.list')
+        self.assertEqual(status, 200)
+        self.assertEqual(body.decode('utf-8'),
+                         'foo-1.0-1.noarch.rpm %s\n' % self.checksum)
+
+    def test_unlisted(self):
+        '''serve: files that aren't in the list are not served'''
+        for path in ('/secret.rpm.part', '/../etc/passwd', '/nothere.rpm'):
+            self.assertEqual(self.get(path)[0], 404, path)
+
+    def test_range(self):
+        '''serve: Range requests get 206 and the requested bytes'''
+        status, crange, body = self.get('/foo-1.0-1.noarch.rpm',
+                                        {'Range': 'bytes=100-199'})
+        self.assertEqual(status, 206)
+        self.assertEqual(crange, 'bytes 100-199/%u' % len(self.data))
+        self.assertEqual(body, self.data[100:200])
+        status, crange, _ = self.get('/foo-1.0-1.noarch.rpm',
+                                     {'Range': 'bytes=999999-'})
+        self.assertEqual(status, 416)
+
+    def test_download_from_peer(self):
+        '''serve: the downloader gets packages from a peer first'''
+        mirror = FakeMirror({'/foo-1.0-1.noarch.rpm': self.data})
+        try:
+            dest = os.path.join(self.tmpdir, 'foo-1.0-1.noarch.rpm')
+            job = DownloadJob('foo', [self.url('foo-1.0-1.noarch.rpm'),
+                                      mirror.url('/foo-1.0-1.noarch.rpm')],
+                              dest, len(self.data), self.checksum)
+            Downloader().download([job])
+            self.assertEqual(mirror.requests, [])
+            self.assertEqual(job.verified, self.checksum)
+        finally:
+            mirror.close()
+
+    def test_bad_peer(self):
+        '''serve: a peer with the wrong data is ignored'''
+        with open(self.path, 'wb') as outf:
+            outf.write(b'X' * len(self.data))
+        mirror = FakeMirror({'/foo-1.0-1.noarch.rpm': self.data})
+        try:
+            dest = os.path.join(self.tmpdir, 'foo-1.0-1.noarch.rpm')
+            job = DownloadJob('foo', [self.url('foo-1.0-1.noarch.rpm'),
+                                      mirror.url('/foo-1.0-1.noarch.rpm')],
+                              dest, len(self.data), self.checksum)
+            Downloader().download([job])
+            self.assertEqual(mirror.requests, ['/foo-1.0-1.noarch.rpm'])
+            self.assertEqual(file_checksum(dest, 'sha256'), self.checksum)
+        finally:
+            mirror.close()
+
+    def test_unreachable_peer(self):
+        '''serve: an unreachable peer is skipped'''
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close() # nothing listening there now
+        mirror = FakeMirror({'/foo-1.0-1.noarch.rpm': self.data})
+        try:
+            dest = os.path.join(self.tmpdir, 'foo-1.0-1.noarch.rpm')
+            job = DownloadJob('foo', ['http://127.0.0.1:%u/foo' % port,
+                                      mirror.url('/foo-1.0-1.noarch.rpm')],
+                              dest, len(self.data), self.checksum)
+            Downloader().download([job])
+            self.assertEqual(job.verified, self.checksum)
+        finally:
+            mirror.close()
+
+@unittest.skipUnless(os.getuid() == 0, "needs root")
+class TestDropPrivileges(unittest.TestCase):
+    def test_drop(self):
+        '''serve: drop_privileges() switches to an unprivileged user'''
+        import pwd
+        nobody = pwd.getpwnam('nobody')
+        pid = os.fork()
+        if pid == 0: # pragma: no cover
+            ok = False
+            try:
+                ok = (drop_privileges() and os.getuid() == nobody.pw_uid and
+                      os.getgid() == nobody.pw_gid and not os.getgroups())
+            finally:
+                os._exit(0 if ok else 1) # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
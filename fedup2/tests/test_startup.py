@@ -0,0 +1,124 @@
+# test_startup.py - make sure 'fedup2 status' starts up quickly
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+import os, sys, json
+from subprocess import check_output
+from tempfile import mkstemp
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+                         os.path.abspath(__file__))))
+
+# fedup2/version.py is generated by 'make'; it's not in git
+HAVE_VERSION = os.path.exists(os.path.join(TOPDIR, 'fedup2', 'version.py'))
+if HAVE_VERSION:
+    from .. import cli
+
+# modules that 'fedup2 status' shouldn't need
+HEAVY_MODULES = ('dnf', 'rpm', 'hawkey', 'libmount', 'librepo',
+                 'multiprocessing', 'http.client', 'subprocess')
+
+# how long importing fedup2.cli and running 'status' may take (seconds).
+# importing dnf alone takes longer than this.
+STATUS_BUDGET = 0.5
+
+STATUS_SCRIPT = '''
+import sys, time, json
+start = time.time()
+from fedup2.cli import Cli
+from fedup2.state import State
+State.statefile = sys.argv[1]
+sys.argv = ['fedup2', 'status', '--json']
+Cli().main()
+sys.stdout.flush()
+print(json.dumps(dict(seconds=time.time()-start,
+                      modules=[m for m in sys.argv[2:] if m in sys.modules])))
+'''
+
+@unittest.skipUnless(HAVE_VERSION, "fedup2/version.py missing; run 'make'")
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.fd, self.statefile = mkstemp(prefix='state.')
+        os.write(self.fd, b'{"upgrade": {"target": "TacOS 4u"}, '
+                          b'"download": {"size_total": "100", '
+                          b'"size_done": "50"}}\n')
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.unlink(self.statefile)
+
+    def _status(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [TOPDIR] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep)
+                        if p])
+        out = check_output([sys.executable, '-c', STATUS_SCRIPT,
+                            self.statefile] + list(HEAVY_MODULES), env=env)
+        status, result = out.decode('utf-8').strip().splitlines()[-2:]
+        return json.loads(status), json.loads(result)
+
+    def test_status(self):
+        '''startup: status works without importing dnf etc.'''
+        status, result = self._status()
+        self.assertEqual(status['target'], "TacOS 4u")
+        self.assertEqual(status['size_done'], 50)
+        self.assertEqual(result['modules'], [])
+
+    def test_status_time(self):
+        '''startup: status is quick'''
+        _, result = self._status()
+        self.assertLess(result['seconds'], STATUS_BUDGET)
+
+@unittest.skipUnless(HAVE_VERSION, "fedup2/version.py missing; run 'make'")
+class TestOSRelease(unittest.TestCase):
+    # pylint: disable=protected-access
+    def setUp(self):
+        self.fd, self.tmpfile = mkstemp(prefix='os-release.')
+        cli._os_release = None
+
+    def tearDown(self):
+        os.close(self.fd)
+        os.unlink(self.tmpfile)
+        cli._os_release = None
+
+    def _write(self, data):
+        os.write(self.fd, data.encode('utf-8'))
+
+    def test_fedora(self):
+        '''startup: read_os_release() parses quoted values'''
+        self._write('NAME=Fedora\nVERSION="22 (Twenty Two)"\nID=fedora\n'
+                    'VERSION_ID=22\n# comment\nPRETTY_NAME="Fedora 22"\n')
+        osr = cli.read_os_release(self.tmpfile)
+        self.assertEqual(osr['VERSION'], "22 (Twenty Two)")
+        self.assertEqual(cli.get_distro(), ("Fedora", "22"))
+
+    def test_read_once(self):
+        '''startup: os-release is only read once'''
+        self._write('ID=fedora\nVERSION_ID=22\n')
+        cli.read_os_release(self.tmpfile)
+        os.unlink(self.tmpfile)
+        with open(self.tmpfile, 'w') as outf:
+            outf.write('ID=tacos\n')
+        self.assertEqual(cli.read_os_release(self.tmpfile)['ID'], 'fedora')
+
+    def test_unsupported(self):
+        '''startup: get_distro() returns empty strings for other distros'''
+        self._write('ID=tacos\nNAME="TacOS"\nVERSION_ID=4u\n')
+        cli.read_os_release(self.tmpfile)
+        self.assertEqual(cli.get_distro(), ('', ''))
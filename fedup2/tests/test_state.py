@@ -22,6 +22,9 @@ from ..state import State
 
 from tempfile import mkstemp, mkdtemp
 import os
+import time
+import fcntl
+import shutil
 
 
 class TestStateBasic(unittest.TestCase):
@@ -34,7 +37,7 @@ class TestStateBasic(unittest.TestCase):
         '''state: test setting a property'''
         p = "wow this is totally a datadir path"
         self.state.datadir = p
-        self.assertEqual(self.state._conf.get("persist", "datadir"), p)
+        self.assertEqual(self.state._get("persist", "datadir"), p)
 
     def test_set_invalid(self):
         '''state: setting a property using an invalid type raises TypeError'''
@@ -43,8 +46,7 @@ class TestStateBasic(unittest.TestCase):
 
     def test_get(self):
         '''state: test getting a property'''
-        self.state._conf.add_section("persist")
-        self.state._conf.set("persist", "datadir", "A VERY COOL VALUE")
+        self.state._set("persist", "datadir", "A VERY COOL VALUE")
         self.assertEqual(self.state.datadir, "A VERY COOL VALUE")
 
     def test_get_missing(self):
@@ -56,7 +58,7 @@ class TestStateBasic(unittest.TestCase):
         self.state.datadir = "doomed"
         del self.state.datadir
         self.assertTrue(self.state.datadir is None)
-        self.assertFalse(self.state._conf.has_option("persist", "datadir"))
+        self.assertFalse("datadir" in dict(self.state._items("persist")))
 
     def test_cmdline(self):
         '''state: test the cmdline property'''
@@ -84,7 +86,26 @@ class TestStateBasic(unittest.TestCase):
         del self.state.upgrade_ready
         self.assertEqual(self.state.summarize(), inprog_msg)
 
+def waiting_writer(path):
+    '''
+    Fork a process that waits for an exclusive lock on path. It exits with
+    0 if, once it has the lock, path has been replaced with a new file
+    (like State.write() does when converting an INI file).
+    '''
+    pid = os.fork()
+    if pid == 0: # pragma: no cover
+        status = 1
+        try:
+            with open(path, 'a+b') as fobj:
+                fcntl.lockf(fobj, fcntl.LOCK_EX)
+                if os.fstat(fobj.fileno()).st_ino != os.stat(path).st_ino:
+                    status = 0
+        finally:
+            os._exit(status) # pylint: disable=protected-access
+    return pid
+
 class TestStateWithFile(unittest.TestCase):
+    # pylint: disable=protected-access
     def setUp(self):
         # it'd probably be better to use a mock file here
         self.fd, self.tmpfile = mkstemp(prefix='state.')
@@ -104,7 +125,116 @@ class TestStateWithFile(unittest.TestCase):
         self.state.datadir = "/data"
         self.state.write()
         data = self._read_data()
-        self.assertEqual(data.strip(), '[persist]\ndatadir = /data')
+        self.assertEqual(data, '{"persist": {"datadir": "/data"}}\n')
+
+    def test_write_appends(self):
+        '''state: each write() appends just the changes'''
+        self.state.datadir = "/data"
+        self.state.write()
+        self.state.upgrade_target = "TacOS 4u"
+        del self.state.datadir
+        self.state.write()
+        lines = self._read_data().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1], '{"persist": {"datadir": null}, '
+                                   '"upgrade": {"target": "TacOS 4u"}}')
+        newstate = State()
+        self.assertEqual(newstate.datadir, None)
+        self.assertEqual(newstate.upgrade_target, "TacOS 4u")
+
+    def test_write_unchanged(self):
+        '''state: write() doesn't touch the file if nothing changed'''
+        self.state.datadir = "/data"
+        self.state.write()
+        self.state.write()
+        self.assertEqual(len(self._read_data().splitlines()), 1)
+
+    def test_nested_context(self):
+        '''state: nested with-blocks are committed together'''
+        with self.state:
+            self.state.datadir = "/data"
+            with self.state:
+                self.state.upgrade_target = "TacOS 4u"
+            self.assertEqual(self._read_data(), '')
+        self.assertEqual(len(self._read_data().splitlines()), 1)
+
+    def test_context_error(self):
+        '''state: with-block that raises an exception doesn't write'''
+        with self.assertRaises(KeyError):
+            with self.state:
+                self.state.datadir = "/data"
+                raise KeyError
+        self.assertEqual(self._read_data(), '')
+
+    def test_torn_line(self):
+        '''state: an incomplete last line is ignored'''
+        self.state.datadir = "/data"
+        self.state.write()
+        with open(self.tmpfile, 'a') as outf:
+            outf.write('{"persist": {"datadir": "/o')
+        self.assertEqual(State().datadir, "/data")
+
+    def test_compact(self):
+        '''state: a long journal gets replaced by a snapshot'''
+        for n in range(self.state.compact_lines + 1):
+            self.state.pkgs_total = n
+            self.state.write()
+        self.assertEqual(self._read_data(),
+                         '{"download": {"pkgs_total": "%u"}}\n' % n)
+        self.assertEqual(State().pkgs_total, str(n))
+
+    def test_two_writers(self):
+        '''state: writers don't lose each other's changes'''
+        other = State()
+        self.state.datadir = "/data"
+        self.state.write()
+        other.upgrade_target = "TacOS 4u"
+        other.write()
+        self.assertEqual(other.datadir, "/data")
+        # compacting the journal keeps the other writer's changes too
+        self.state.compact_lines = 0
+        self.state.releasever = "4u"
+        self.state.write()
+        other.pkgs_total = 7
+        other.write()
+        state = State()
+        self.assertEqual(state.datadir, "/data")
+        self.assertEqual(state.upgrade_target, "TacOS 4u")
+        self.assertEqual(state.releasever, "4u")
+        self.assertEqual(state.pkgs_total, "7")
+
+    def test_read_ini(self):
+        '''state: old INI-style state files are converted'''
+        with open(self.tmpfile, 'w') as outf:
+            outf.write('[persist]\ndatadir = /data\n\n'
+                       '[upgrade]\ntarget = TacOS 4u\n')
+        state = State()
+        self.assertEqual(state.datadir, "/data")
+        self.assertEqual(state.upgrade_target, "TacOS 4u")
+        state.write()
+        self.assertEqual(self._read_data(),
+                         '{"persist": {"datadir": "/data"}, '
+                         '"upgrade": {"target": "TacOS 4u"}}\n')
+
+    def test_read_ini_locked(self):
+        '''state: converting an INI file keeps it locked the whole time'''
+        with open(self.tmpfile, 'w') as outf:
+            outf.write('[persist]\ndatadir = /data\n')
+        load = self.state._load
+        children = []
+        def slow_load(inf):
+            # get another process waiting for the lock, then read the file
+            children.append(waiting_writer(self.tmpfile))
+            time.sleep(0.2)
+            load(inf)
+            time.sleep(0.2)
+        self.state._load = slow_load
+        self.state.upgrade_target = "TacOS 4u"
+        self.state.write()
+        _, status = os.waitpid(children[0], 0)
+        # it got the lock after the INI file was replaced, not before
+        self.assertEqual(status, 0)
+        self.assertEqual(State().datadir, "/data")
 
     def test_context(self):
         '''state: test State as context manager'''
@@ -163,3 +293,64 @@ class TestStatePackageList(unittest.TestCase):
         self.state.write_packagelist(self.pkglist)
         with open(os.path.join(self.tmpdir, "package.list")) as inf:
             self.assertEqual(inf.read(), packagelist_data)
+
+    def test_packagelist_checksums(self):
+        '''state: write_packagelist() records checksums, if given'''
+        checksums = {self.pkglist[1]: 'sha256:abcdef'}
+        self.state.write_packagelist(self.pkglist, checksums)
+        self.assertEqual(self.state.read_packagelist(), self.pkglist)
+        self.assertEqual(self.state.read_checksums(), checksums)
+        self.assertEqual(self.state.unverified_packages(), self.pkglist)
+
+    def test_clean_datadir(self):
+        '''state: clean_datadir() keeps listed packages and partial downloads'''
+        keep = ['fake-1.rpm', 'fake-2.rpm.part', 'fake-2.rpm.part.idx']
+        self.state.write_packagelist(os.path.join(self.tmpdir, p)
+                                     for p in ('fake-1.rpm', 'fake-2.rpm'))
+        for f in keep + ['junk.rpm', 'junk.rpm.part']:
+            open(os.path.join(self.tmpdir, f), 'w').close()
+        os.makedirs(os.path.join(self.tmpdir, 'repodata'))
+        self.state.clean_datadir()
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted(keep + ['package.list']))
+
+class TestStateProgress(unittest.TestCase):
+    def setUp(self):
+        State.statefile = ''
+        self.state = State()
+        self.state.upgrade_target = "TacOS 4u"
+
+    def test_progress_empty(self):
+        '''state: progress() has None for unknown values'''
+        info = State().progress()
+        self.assertEqual(info['target'], None)
+        self.assertEqual(info['size_done'], None)
+        self.assertEqual(info['eta'], None)
+
+    def test_summarize_progress(self):
+        '''state: summarize() uses the saved totals'''
+        self.state.pkgs_total = 4
+        self.state.size_total = 4000
+        self.state.pkgs_done = 1
+        self.state.size_done = 1000
+        self.state.current_rate = 100
+        self.assertEqual(self.state.progress()['eta'], 30)
+        msg = self.state.summarize()
+        self.assertTrue("25.0%" in msg)
+        self.assertTrue("1 of 4 packages" in msg)
+
+    def test_rescan(self):
+        '''state: rescan() counts the verified packages in datadir'''
+        tmpdir = mkdtemp(prefix='state.')
+        try:
+            self.state.datadir = tmpdir
+            pkgs = [os.path.join(tmpdir, p) for p in ('a.rpm', 'b.rpm')]
+            for p in pkgs:
+                with open(p, 'w') as outf:
+                    outf.write('x' * 10)
+            self.state.write_packagelist(pkgs, {pkgs[0]: 'sha256:abc'})
+            self.state.rescan()
+            self.assertEqual(self.state.pkgs_done, '1')
+            self.assertEqual(self.state.size_done, '10')
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,113 @@
+# test_timing.py - tests for fedup2.timing
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..timing import PhaseTimer, DepsolveClock, timing_file
+
+import os
+import json
+import shutil
+from tempfile import mkdtemp
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+    def __call__(self):
+        return self.now
+
+class TestPhaseTimer(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = PhaseTimer(clock=self.clock)
+
+    def test_phases(self):
+        '''timing: phases are timed, in order, and repeats are added up'''
+        with self.timer.phase("b"):
+            self.clock.now += 2
+        with self.timer.phase("a"):
+            self.clock.now += 1
+        self.timer.add("b", 0.5)
+        summary = self.timer.summary()
+        self.assertEqual(summary["phases"], [dict(name="b", seconds=2.5),
+                                             dict(name="a", seconds=1.0)])
+        self.assertEqual(summary["total"], 3.0)
+
+    def test_exception(self):
+        '''timing: a phase that raises an exception is still recorded'''
+        with self.assertRaises(ValueError):
+            with self.timer.phase("oops"):
+                self.clock.now += 1
+                raise ValueError
+        self.assertEqual(self.timer.phases, [("oops", 1.0)])
+
+    def test_write(self):
+        '''timing: write() saves the summary as JSON'''
+        tmpdir = mkdtemp(prefix='timing.')
+        try:
+            path = timing_file(os.path.join(tmpdir, 'fedup2.log'))
+            self.assertEqual(path, os.path.join(tmpdir, 'fedup2-timing.json'))
+            self.timer.count("installed", 1234)
+            self.timer.add("depsolve.goal", 3.0)
+            self.timer.write(path)
+            with open(path) as inf:
+                data = json.load(inf)
+            self.assertEqual(data["counts"], {"installed": 1234})
+            self.assertEqual(data["phases"][0]["name"], "depsolve.goal")
+        finally:
+            shutil.rmtree(tmpdir)
+
+class TestDepsolveClock(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ds = DepsolveClock(clock=self.clock)
+
+    def test_split(self):
+        '''timing: the goal ends at the first pkg_added, not at start'''
+        start = self.clock.now      # resolve(); ds_callback.start()
+        self.clock.now += 30        # hawkey goal
+        self.ds.pkg_added()
+        self.clock.now += 1
+        self.ds.pkg_added()
+        self.clock.now += 4
+        self.ds.end()
+        self.assertEqual(self.ds.split(start, self.clock.now + 1), (30, 5))
+
+    def test_nothing_added(self):
+        '''timing: with no packages added, it's all goal time'''
+        start = self.clock.now
+        self.clock.now += 10
+        self.ds.end()
+        self.assertEqual(self.ds.split(start, self.clock.now), (10, 0))
+
+    def test_failed(self):
+        '''timing: if resolve() fails before end(), the rest is transaction'''
+        start = self.clock.now
+        self.clock.now += 10
+        self.ds.pkg_added()
+        self.clock.now += 2
+        self.assertEqual(self.ds.split(start, self.clock.now), (10, 2))
+
+    def test_reset(self):
+        '''timing: reset() forgets the previous resolve()'''
+        self.ds.pkg_added()
+        self.ds.end()
+        self.ds.reset()
+        start = self.clock.now
+        self.clock.now += 3
+        self.assertEqual(self.ds.split(start, self.clock.now), (3, 0))
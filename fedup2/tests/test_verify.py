@@ -0,0 +1,80 @@
+# test_verify.py - tests for fedup2.verify
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+import unittest
+from ..verify import write_manifest, read_manifest, manifest_covers, MANIFEST
+
+import os
+import time
+import shutil
+from tempfile import mkdtemp
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp(prefix='verify.')
+        self.paths = [os.path.join(self.tmpdir, n) for n in ('a.rpm', 'b.rpm')]
+        for p in self.paths:
+            with open(p, 'w') as outf:
+                outf.write(p)
+        self.checksums = {self.paths[0]: 'sha256:abcd'}
+        self.digest = write_manifest(self.tmpdir, self.paths, self.checksums)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read(self):
+        '''verify: read_manifest() returns what write_manifest() wrote'''
+        manifest = read_manifest(self.tmpdir, self.digest)
+        self.assertEqual(sorted(manifest), self.paths)
+        self.assertEqual(manifest[self.paths[0]][1], 'sha256:abcd')
+        self.assertEqual(manifest[self.paths[1]][1], '-')
+
+    def test_covers(self):
+        '''verify: manifest_covers() for unchanged files'''
+        self.assertTrue(manifest_covers(self.tmpdir, self.digest, self.paths))
+
+    def test_tampered(self):
+        '''verify: a modified manifest is ignored'''
+        with open(os.path.join(self.tmpdir, MANIFEST), 'a') as outf:
+            outf.write("evil.rpm 1:2:3 -\n")
+        self.assertEqual(read_manifest(self.tmpdir, self.digest), {})
+        self.assertFalse(manifest_covers(self.tmpdir, self.digest, self.paths))
+
+    def test_changed_file(self):
+        '''verify: manifest_covers() is False if a file has changed'''
+        with open(self.paths[1], 'a') as outf:
+            outf.write("more data")
+        self.assertFalse(manifest_covers(self.tmpdir, self.digest, self.paths))
+
+    def test_reset_mtime(self):
+        '''verify: a replaced file is caught even if its mtime is put back'''
+        st = os.stat(self.paths[1])
+        time.sleep(0.05) # let the clock tick past the original ctime
+        with open(self.paths[1], 'r+') as outf:
+            outf.write("X")
+        os.utime(self.paths[1], ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(os.stat(self.paths[1]).st_size, st.st_size)
+        self.assertFalse(manifest_covers(self.tmpdir, self.digest, self.paths))
+
+    def test_unlisted_file(self):
+        '''verify: manifest_covers() is False for files it doesn't list'''
+        extra = os.path.join(self.tmpdir, 'c.rpm')
+        open(extra, 'w').close()
+        self.assertFalse(manifest_covers(self.tmpdir, self.digest,
+                                         self.paths + [extra]))
@@ -0,0 +1,130 @@
+# timing.py - time the phases of the download/upgrade
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Simple timers for the phases of the download/upgrade:
+
+    timer = PhaseTimer()
+    with timer.phase("depsolve.goal"):
+        ...
+    timer.count("installed", 1234)
+    timer.write("/var/log/fedup2-timing.json")
+
+Each phase gets logged (at DEBUG level) as it finishes, and write()
+saves all of them as JSON so they can be compared between runs.
+Phases that happen more than once get their times added together.
+Functions in timer.listeners get called with (name, seconds) as each
+phase finishes.
+
+DepsolveClock splits the time spent in dnf's Base.resolve() into running
+the hawkey goal and building the Transaction from its results.
+'''
+
+import os
+import json
+import time
+from contextlib import contextmanager
+
+import logging
+log = logging.getLogger("fedup2.timing")
+
+__all__ = ['PhaseTimer', 'DepsolveClock', 'timing_file']
+
+def timing_file(logfile):
+    '''Where to write the timing summary, given the path of the log.'''
+    return os.path.splitext(logfile)[0] + '-timing.json'
+
+class PhaseTimer(object):
+    def __init__(self, clock=time.time):
+        self.phases = []
+        self.counts = dict()
+        self.listeners = []
+        self._clock = clock
+        self._start = clock()
+
+    def add(self, name, seconds):
+        '''Record that phase 'name' took 'seconds'.'''
+        self.phases.append((name, seconds))
+        log.debug("phase %s took %.3fs", name, seconds)
+        for listener in self.listeners:
+            listener(name, seconds)
+
+    @contextmanager
+    def phase(self, name):
+        start = self._clock()
+        try:
+            yield
+        finally:
+            self.add(name, self._clock() - start)
+
+    def count(self, name, value):
+        '''Record the size of something (e.g. how many packages) that the
+           phase times can be compared against.'''
+        self.counts[name] = value
+        log.debug("count %s = %s", name, value)
+
+    def summary(self):
+        totals, order = dict(), []
+        for name, seconds in self.phases:
+            if name not in totals:
+                order.append(name)
+                totals[name] = 0.0
+            totals[name] += seconds
+        return {
+            "start": self._start,
+            "total": self._clock() - self._start,
+            "phases": [dict(name=n, seconds=round(totals[n], 6))
+                       for n in order],
+            "counts": self.counts,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as outf:
+            json.dump(self.summary(), outf, indent=2, sort_keys=True)
+            outf.write('\n')
+
+class DepsolveClock(object):
+    '''
+    Base.resolve() calls ds_callback.start() *before* it runs the hawkey
+    goal, then calls pkg_added() for each package while it builds the
+    Transaction, and end() when that's done. So the goal ends at the first
+    pkg_added() (or at end(), if nothing was added).
+    '''
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        self.added = self.ended = None
+
+    def pkg_added(self):
+        if self.added is None:
+            self.added = self._clock()
+
+    def end(self):
+        self.ended = self._clock()
+
+    def split(self, start, end):
+        '''
+        Given when resolve() was called and when it returned, return
+        (goal seconds, transaction seconds).
+        '''
+        ended = end if self.ended is None else self.ended
+        added = ended if self.added is None else self.added
+        return added - start, ended - added
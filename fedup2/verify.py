@@ -0,0 +1,156 @@
+# verify.py - check package signatures ahead of the upgrade
+#
+# Copyright (c) 2015 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Author: Will Woods <wwoods@redhat.com>
+
+'''
+Signature checking is slow, and during the offline upgrade every second
+counts. So we check all the signatures in parallel right after the
+download, and write the results into a manifest in datadir:
+
+    results = check_signatures(paths)
+    ok = [p for p, r in results.items() if r == SIG_OK]
+    state.manifest_digest = write_manifest(datadir, ok, checksums)
+
+During the upgrade, if the manifest is intact (its digest matches the one
+we saved in the state file, which lives outside datadir) and none of the
+files have changed since they were checked, the signature checks can be
+skipped (rpm still checks the payload digests):
+
+    if manifest_covers(datadir, state.manifest_digest, paths):
+        ...
+'''
+
+import os
+import hashlib
+
+import logging
+log = logging.getLogger("fedup2.verify")
+
+__all__ = ['check_signatures', 'write_manifest', 'read_manifest',
+           'manifest_covers', 'SIG_OK', 'SIG_BAD', 'MANIFEST']
+
+MANIFEST = 'verified.manifest'
+
+# return values of dnf.rpm.miscutils.checkSig()
+SIG_OK = 0
+SIG_NOKEY = 1
+SIG_BAD = 2
+SIG_UNTRUSTED = 3
+SIG_UNSIGNED = 4
+
+# == signature checking ======================================================
+
+_ts = None
+
+def _init_worker():
+    # pylint: disable=global-statement
+    global _ts
+    import rpm
+    _ts = rpm.TransactionSet()
+
+def _check_one(path):
+    from dnf.rpm.miscutils import checkSig
+    return path, checkSig(_ts, path)
+
+def check_signatures(paths, processes=None):
+    '''
+    Check the signatures of the packages in paths, using a pool of
+    'processes' worker processes (default: one per CPU).
+    Returns a dict mapping each path to a SIG_* value.
+    '''
+    paths = list(paths)
+    if not paths:
+        return {}
+    import multiprocessing
+    processes = processes or multiprocessing.cpu_count()
+    log.info("checking %u signatures with %u processes", len(paths), processes)
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        return dict(pool.imap_unordered(_check_one, paths, chunksize=8))
+    finally:
+        pool.close()
+        pool.join()
+
+# == the manifest ============================================================
+
+def _fileid(path):
+    '''
+    Enough info about a file to tell if it's been changed. This uses the
+    ctime, not the mtime: anyone who can write the file can set its mtime
+    back (with utime()), but nothing short of changing the clock resets the
+    ctime.
+    '''
+    st = os.stat(path)
+    # same as the dnf plugin's _fileid(), which might be running on python 2
+    ctime = getattr(st, 'st_ctime_ns', None) or int(st.st_ctime * 1e9)
+    return "%u:%u:%u" % (st.st_size, ctime, st.st_ino)
+
+def write_manifest(datadir, paths, checksums):
+    '''
+    Write the manifest of verified files to datadir and return its digest.
+    checksums is a dict of path -> checksum (see State.read_checksums).
+    '''
+    lines = []
+    for path in sorted(paths):
+        lines.append("%s %s %s\n" % (os.path.relpath(path, datadir),
+                                     _fileid(path), checksums.get(path, '-')))
+    data = ''.join(lines).encode('utf-8')
+    tmpfile = os.path.join(datadir, MANIFEST + '.tmp')
+    with open(tmpfile, 'wb') as outf:
+        outf.write(data)
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.rename(tmpfile, os.path.join(datadir, MANIFEST))
+    return hashlib.sha256(data).hexdigest()
+
+def read_manifest(datadir, digest):
+    '''
+    Read the manifest from datadir. Returns a dict mapping each path to
+    (fileid, checksum), or an empty dict if the manifest is missing or its
+    digest doesn't match.
+    '''
+    try:
+        with open(os.path.join(datadir, MANIFEST), 'rb') as inf:
+            data = inf.read()
+    except (IOError, OSError):
+        return {}
+    if not digest or hashlib.sha256(data).hexdigest() != digest:
+        log.warning("%s has been modified; ignoring it", MANIFEST)
+        return {}
+    manifest = dict()
+    for line in data.decode('utf-8').splitlines():
+        relpath, fileid, checksum = line.split(' ')
+        manifest[os.path.join(datadir, relpath)] = (fileid, checksum)
+    return manifest
+
+def manifest_covers(datadir, digest, paths):
+    '''True if every file in paths was verified and hasn't changed since.'''
+    manifest = read_manifest(datadir, digest)
+    if not manifest:
+        return False
+    for path in paths:
+        try:
+            if manifest[path][0] != _fileid(path):
+                log.info("%s changed since it was verified", path)
+                return False
+        except KeyError:
+            log.info("%s was not verified", path)
+            return False
+        except OSError:
+            return False
+    return True
@@ -19,14 +19,24 @@
 
 import os
 import json
+import hashlib
 
 from argparse import ArgumentParser
 from subprocess import call
 
 import dnf
 import dnf.cli
+import dnf.exceptions
+import dnf.transaction
 from dnf.i18n import _
 
+try:
+    from fedup2.savedtrans import write_transaction, read_transaction
+    from fedup2.plymouth import PlymouthOutput
+except ImportError: # fedup2 isn't installed; always resolve the upgrade
+    write_transaction = read_transaction = None
+    PlymouthOutput = None
+
 import logging
 log = logging.getLogger("dnf.plugin.fedup")
 
@@ -35,6 +45,8 @@ PLYMOUTH = '/usr/bin/plymouth'
 DEFAULT_DATADIR = '/var/lib/fedup'
 MAGIC_SYMLINK = '/system-update'
 SYSTEMD_FLAG_FILE = '/system-update/.dnf-fedup2-upgrade'
+MANIFEST = 'verified.manifest'
+TRANSFILE = 'upgrade.transaction'
 
 NO_KERNEL_MSG = _("No new kernel packages were found.")
 RELEASEVER_MSG = _("Need a --releasever greater than the current system version.")
@@ -45,6 +57,8 @@ def reboot():
     call(["systemctl", "reboot"])
 
 # Plymouth helper class + singleton object
+# fedup2.plymouth sends the updates from a background thread, so the rpm
+# callback never waits for plymouth. Without fedup2, just run plymouth.
 class _PlymouthOutput(object):
     def __init__(self):
         self._last_args = dict()
@@ -52,10 +66,13 @@ class _PlymouthOutput(object):
 
     def _plymouth(self, cmd, *args):
         if cmd == '--ping' or args != self._last_args.get(cmd):
-            self.alive = (call([PLYMOUTH, cmd] + args) == 0)
+            self.alive = (call([PLYMOUTH, cmd] + list(args)) == 0)
             self._last_args[cmd] = args
         return self.alive
 
+    def flush(self):
+        return True
+
     def ping(self):
         return self._plymouth("--ping")
 
@@ -67,7 +84,11 @@ class _PlymouthOutput(object):
 
     def progress(self, percent):
         return self._plymouth("system-update", "--progress", str(percent))
-Plymouth = _PlymouthOutput()
+
+if PlymouthOutput is not None:
+    Plymouth = PlymouthOutput()
+else:
+    Plymouth = _PlymouthOutput()
 
 
 # A couple checkXXX() functions in the style of dnf.cli.command.check*
@@ -80,6 +101,99 @@ def checkDataDir(datadir):
         raise dnf.cli.CliError(_("--datadir: File exists"))
 
 
+# A list of the packages that were verified when they were downloaded.
+# The digest gets saved in the State, so we can tell if it's been tampered with.
+# The ctime is used because, unlike the mtime, it can't be set back.
+def _fileid(path):
+    st = os.stat(path)
+    ctime = getattr(st, 'st_ctime_ns', None) or int(st.st_ctime * 1e9)
+    return "%u:%u:%u" % (st.st_size, ctime, st.st_ino)
+
+def write_manifest(datadir, paths):
+    data = ''.join("%s %s\n" % (os.path.relpath(p, datadir), _fileid(p))
+                   for p in sorted(paths)).encode('utf-8')
+    with open(os.path.join(datadir, MANIFEST), 'wb') as outf:
+        outf.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+def manifest_covers_datadir(datadir, digest):
+    '''True if every package in datadir is listed, unchanged, in the manifest'''
+    try:
+        with open(os.path.join(datadir, MANIFEST), 'rb') as inf:
+            data = inf.read()
+    except IOError:
+        return False
+    if not digest or hashlib.sha256(data).hexdigest() != digest:
+        return False
+    manifest = dict(l.split(' ') for l in data.decode('utf-8').splitlines())
+    for f in os.listdir(datadir):
+        if f.endswith('.rpm'):
+            try:
+                if manifest.get(f) != _fileid(os.path.join(datadir, f)):
+                    return False
+            except OSError:
+                return False
+    return True
+
+
+# The resolved transaction, saved after the download so the upgrade doesn't
+# have to load all the metadata and depsolve again (see fedup2.savedtrans).
+# Only upgrades/installs/erases are saved.
+def save_transaction(base, datadir):
+    if write_transaction is None:
+        return
+    path = os.path.join(datadir, TRANSFILE)
+    items = []
+    for tsi in base.transaction:
+        if tsi.op_type == dnf.transaction.ERASE:
+            action, path, replaces = 'erase', None, []
+        elif tsi.op_type in (dnf.transaction.INSTALL, dnf.transaction.UPGRADE):
+            action = 'upgrade' if tsi.erased else 'install'
+            path = tsi.installed.localPkg()
+            replaces = [str(p) for p in [tsi.erased] if p] + \
+                       [str(p) for p in tsi.obsoleted]
+        else:
+            # something unusual; let the upgrade resolve it again (and make
+            # sure it doesn't use a transaction saved by an earlier run)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return
+        items.append(dict(action=action, nevra=str(tsi.installed or tsi.erased),
+                          path=path, replaces=replaces, reason=tsi.reason))
+    repoids = [r.id for r in base.repos.iter_enabled()]
+    write_transaction(path, items, base.conf.cachedir, repoids)
+
+def load_saved_transaction(datadir):
+    if read_transaction is None:
+        return None
+    return read_transaction(os.path.join(datadir, TRANSFILE))
+
+def load_transaction(base, items):
+    '''Set up base.transaction from the saved items. Returns False if they
+       don't match the installed system (or are otherwise unusable).'''
+    installed = dict((str(p), p) for p in base.sack.query().installed())
+    trans = dnf.transaction.Transaction()
+    try:
+        for item in items:
+            old = [installed[nevra] for nevra in item['replaces']]
+            if item['action'] == 'erase':
+                trans.add_erase(installed[item['nevra']])
+            elif item['action'] == 'upgrade':
+                trans.add_upgrade(base.add_remote_rpm(item['path']),
+                                  old[0], old[1:])
+            else:
+                trans.add_install(base.add_remote_rpm(item['path']), old,
+                                  item['reason'])
+    except (KeyError, IndexError, ValueError, TypeError, IOError, OSError,
+            dnf.exceptions.Error) as e:
+        log.warning(_("can't use saved transaction: %s"), e)
+        return False
+    base.transaction = trans
+    return True
+
+
 # Holds the state of the upgrade between runs of the command.
 # Would be nice if dnf.Base provided access to its persistor, but oh well
 class State(object):
@@ -122,6 +236,7 @@ class State(object):
 
     download_status = _prop("download", "status")
     datadir = _prop("download", "datadir")
+    manifest_digest = _prop("download", "manifest")
 
     upgrade_status = _prop("upgrade", "status")
     releasever = _prop("upgrade", "releasever")
@@ -190,6 +305,7 @@ class FedupCommand(dnf.cli.Command):
         super(FedupCommand, self).__init__(cli)
         self.opts = None
         self.state = State()
+        self.saved_transaction = None
 
     def parse_args(self, extargs):
         p = PluginArgumentParser(self.aliases[0])
@@ -253,6 +369,21 @@ class FedupCommand(dnf.cli.Command):
         self.cli.demands.cacheonly = True
         # and don't ask any questions (we confirmed all this beforehand)
         self.base.conf.assumeyes = True
+        # signatures were checked during the download; if the packages are
+        # still exactly the same, don't waste time checking them again.
+        if manifest_covers_datadir(self.state.datadir,
+                                   self.state.manifest_digest):
+            log.info(_("packages already verified; skipping GPG checks"))
+            for repo in self.base.repos.iter_enabled():
+                repo.gpgcheck = False
+            # and if the system hasn't changed either, we can use the saved
+            # transaction and skip loading the metadata and depsolving.
+            self.saved_transaction = load_saved_transaction(
+                                                    self.state.datadir)
+            if self.saved_transaction:
+                log.info(_("using saved transaction"))
+                self.cli.demands.available_repos = False
+                self.cli.demands.resolving = False
 
     def configure_clean(self, args):
         self.cli.demands.root_user = True
@@ -311,6 +442,20 @@ class FedupCommand(dnf.cli.Command):
         Plymouth.progress(0)
         Plymouth.message(_("Starting system upgrade. This will take a while."))
         # set up the upgrade transaction
+        if self.saved_transaction:
+            # DNF won't resolve or run it for us, so do it ourselves
+            if not load_transaction(self.base, self.saved_transaction):
+                # DNF didn't load the repos either; do that and resolve it
+                self.base.fill_sack(load_system_repo=True,
+                                    load_available_repos=True)
+                self._mark_upgrade()
+                self.base.resolve(self.cli.demands.allow_erasing)
+            self.base.do_transaction(display=PlymouthTransactionDisplay())
+            self.transaction_upgrade()
+        else:
+            self._mark_upgrade()
+
+    def _mark_upgrade(self):
         if self.state.distro_sync:
             self.base.distro_sync()
         else:
@@ -330,7 +475,11 @@ class FedupCommand(dnf.cli.Command):
         if not any(p.name.startswith('kernel') for p in downloads):
             raise dnf.exceptions.Error(NO_KERNEL_MSG)
         # Okay! Write out the state so the upgrade can use it.
+        # (DNF checked the signatures before running the test transaction.)
+        save_transaction(self.base, self.opts.datadir)
         with self.state:
+            self.state.manifest_digest = write_manifest(self.opts.datadir,
+                                        [p.localPkg() for p in downloads])
             self.state.download_status = 'complete'
             self.state.distro_sync = self.opts.distro_sync
             self.state.best = self.base.conf.best
@@ -341,4 +490,5 @@ class FedupCommand(dnf.cli.Command):
     def transaction_upgrade(self):
         Plymouth.message(_("Upgrade complete! Cleaning up and rebooting..."))
         self.run_clean([])
+        Plymouth.flush()
         reboot()